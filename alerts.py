@@ -0,0 +1,249 @@
+# alerts.py
+"""Background alerting on stale sensors and pressure readings.
+
+One AlertEngine per collection follows new readings through the live feed
+and keeps a small state per sensor: when it was last seen and its readings
+over the last RATE_WINDOW_SECONDS. Each reading is checked against the
+sensor's rules in constant time; staleness deadlines sit in a heap with one
+entry per sensor, so a timer thread wakes only when the next sensor can go
+stale. An alert is written to the alerts store when it is raised and again
+when it is resolved, never while it stays active.
+
+The engines of every site are started once per process, by the app on its
+first run or, with `run_in = "ingest"`, by the standalone ingest process,
+so rules are evaluated whether or not anyone has a page open.
+
+Rules are set in `.streamlit/secrets.toml`, with optional overrides per
+sensor:
+
+    [alerts]
+    run_in = "app"            # or "ingest"
+    stale_seconds = 300
+    min_pressure = 0.5
+    max_pressure = 6.0
+    max_rate = 1.0            # pressure change per minute
+
+    [alerts.sensors.PR-01]
+    max_pressure = 8.0
+"""
+import streamlit as st
+import heapq
+import math
+import queue
+import sys
+import threading
+import time
+from collections import deque
+import pandas as pd
+from storage import get_alert_store
+from live_updates import get_live_feed
+from sites import get_sites
+
+DEFAULT_STALE_SECONDS = 5 * 60
+# Span over which the rate of change is measured
+RATE_WINDOW_SECONDS = 5 * 60
+# Longest the timer sleeps, so it also keeps the live feed's listener running
+MAX_SLEEP_SECONDS = 30
+RULE_KEYS = ('stale_seconds', 'min_pressure', 'max_pressure', 'max_rate')
+
+def _epoch(timestamp):
+    """Convert a reading timestamp to UTC epoch seconds."""
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize('UTC')
+    return timestamp.timestamp()
+
+def alert_rules():
+    """Return (default rule, {sensorID: rule}) from the [alerts] secrets."""
+    config = st.secrets.get('alerts', {})
+    default = {'stale_seconds': DEFAULT_STALE_SECONDS, 'min_pressure': None, 'max_pressure': None, 'max_rate': None}
+    default.update({key: config[key] for key in RULE_KEYS if key in config})
+    overrides = {
+        sensor_id: dict(default, **{key: rule[key] for key in RULE_KEYS if key in rule})
+        for sensor_id, rule in config.get('sensors', {}).items()
+    }
+    return default, overrides
+
+class SensorState:
+    """What the engine remembers about one sensor."""
+
+    __slots__ = ('last_seen', 'window')
+
+    def __init__(self):
+        self.last_seen = None
+        # (epoch seconds, pressure) of the readings inside the rate window
+        self.window = deque()
+
+class AlertEngine:
+    """Incremental per-sensor rule evaluation with deduplicated alerts."""
+
+    def __init__(self, collection_name, default_rule=None, sensor_rules=None, store=None):
+        self.collection_name = collection_name
+        self.default_rule = default_rule or {'stale_seconds': DEFAULT_STALE_SECONDS}
+        self.sensor_rules = sensor_rules or {}
+        self.store = store or get_alert_store()
+        self._states = {}
+        self._deadlines = []  # heap of (stale deadline, sensorID)
+        # Alerts of this collection still active from before a restart are not raised again
+        self._active = {
+            (collection_name, alert['sensorID'], alert['kind']):
+                dict(alert, raised_at=pd.Timestamp(alert['raised_at']).to_pydatetime())
+            for alert in self.store.active_alerts(collection_name)
+        }
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._writes = queue.Queue()
+        threading.Thread(target=self._write_loop, daemon=True, name=f'alert-writer-{collection_name}').start()
+
+    def rule(self, sensor_id):
+        """Return the rule that applies to a sensor."""
+        return self.sensor_rules.get(sensor_id, self.default_rule)
+
+    def observe(self, records):
+        """Evaluate new readings; runs on the feed's thread."""
+        try:
+            with self._lock:
+                for record in records:
+                    self._observe(record)
+        except Exception as error:
+            print(f"Alert evaluation failed: {error}", file=sys.stderr)
+
+    def _observe(self, record):
+        sensor_id = record.get('sensorID')
+        pressure = record.get('pressure')
+        if not sensor_id or record.get('timestamp') is None:
+            return
+        seen = _epoch(record['timestamp'])
+        rule = self.rule(sensor_id)
+        state = self._states.get(sensor_id)
+        if state is None:
+            state = self._states[sensor_id] = SensorState()
+            heapq.heappush(self._deadlines, (seen + rule['stale_seconds'], sensor_id))
+            self._wake.set()
+        if state.last_seen is not None and seen <= state.last_seen:
+            return  # late or duplicate reading
+        state.last_seen = seen
+        self._resolve(sensor_id, 'stale', seen)
+
+        if pressure is None or not math.isfinite(pressure):
+            return
+        self._check(sensor_id, 'above', rule.get('max_pressure') is not None and pressure > rule['max_pressure'],
+                    seen, pressure, rule.get('max_pressure'))
+        self._check(sensor_id, 'below', rule.get('min_pressure') is not None and pressure < rule['min_pressure'],
+                    seen, pressure, rule.get('min_pressure'))
+
+        window = state.window
+        window.append((seen, pressure))
+        while window[0][0] < seen - RATE_WINDOW_SECONDS:
+            window.popleft()
+        if rule.get('max_rate') is not None and len(window) > 1 and seen > window[0][0]:
+            rate = (pressure - window[0][1]) / (seen - window[0][0]) * 60
+            self._check(sensor_id, 'rate', abs(rate) > rule['max_rate'], seen, rate, rule['max_rate'])
+
+    def _check(self, sensor_id, kind, breached, at, value, limit):
+        if breached:
+            self._raise(sensor_id, kind, at, value, limit)
+        else:
+            self._resolve(sensor_id, kind, at)
+
+    def _raise(self, sensor_id, kind, at, value, limit):
+        if (self.collection_name, sensor_id, kind) in self._active:
+            return
+        alert = {
+            'id': f"{self.collection_name}:{sensor_id}:{kind}:{int(at * 1000)}",
+            'collection': self.collection_name,
+            'sensorID': sensor_id,
+            'kind': kind,
+            'status': 'active',
+            'raised_at': pd.Timestamp(at, unit='s', tz='UTC').to_pydatetime(),
+            'resolved_at': None,
+            'value': value,
+            'limit': limit,
+        }
+        self._active[(self.collection_name, sensor_id, kind)] = alert
+        self._writes.put(dict(alert))
+
+    def _resolve(self, sensor_id, kind, at):
+        alert = self._active.pop((self.collection_name, sensor_id, kind), None)
+        if alert is not None:
+            self._writes.put(dict(alert, status='resolved',
+                                  resolved_at=pd.Timestamp(at, unit='s', tz='UTC').to_pydatetime()))
+
+    def check_stale(self, now=None):
+        """Raise stale alerts for sensors past their deadline; return seconds until the next deadline."""
+        now = now or time.time()
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, sensor_id = heapq.heappop(self._deadlines)
+                state = self._states[sensor_id]
+                stale_seconds = self.rule(sensor_id)['stale_seconds']
+                deadline = state.last_seen + stale_seconds
+                if deadline <= now:
+                    self._raise(sensor_id, 'stale', now, now - state.last_seen, stale_seconds)
+                    deadline = now + stale_seconds
+                # Each sensor keeps a single heap entry, moved forward here rather than on every reading
+                heapq.heappush(self._deadlines, (deadline, sensor_id))
+            return self._deadlines[0][0] - now if self._deadlines else MAX_SLEEP_SECONDS
+
+    def active(self):
+        """Return the active alerts, newest first."""
+        with self._lock:
+            alerts = list(self._active.values())
+        return sorted(alerts, key=lambda alert: alert['raised_at'], reverse=True)
+
+    def _write_loop(self):
+        while True:
+            alerts = [self._writes.get()]
+            while True:
+                try:
+                    alerts.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.store.save_alerts(alerts)
+            except Exception as error:
+                print(f"Saving {len(alerts)} alerts failed: {error}", file=sys.stderr)
+
+    def run(self, feed):
+        """Follow a live feed and check staleness deadlines; never returns."""
+        feed.subscribe(self.observe)
+        feed.ensure_running()
+        # Sensors that never report again still need a deadline
+        self.observe(feed.table.records())
+        while True:
+            try:
+                feed.ensure_running()
+            except Exception as error:
+                print(f"Alert feed restart failed: {error}", file=sys.stderr)
+            delay = self.check_stale()
+            self._wake.wait(min(max(delay, 0.1), MAX_SLEEP_SECONDS))
+            self._wake.clear()
+
+@st.cache_resource
+def _start_alerting(collection_name):
+    default_rule, sensor_rules = alert_rules()
+    engine = AlertEngine(collection_name, default_rule, sensor_rules)
+    threading.Thread(target=engine.run, args=(get_live_feed(collection_name),), daemon=True,
+                     name=f'alerts-{collection_name}').start()
+    return engine
+
+def start_alerting(process='app'):
+    """Start the alert engine of every site if alerting is enabled and runs in this process.
+
+    Returns {collection: engine}, empty when the engines run elsewhere.
+    """
+    config = st.secrets.get('alerts', {})
+    if not config.get('enabled', True) or config.get('run_in', 'app') != process:
+        return {}
+    return {site.collection: _start_alerting(site.collection) for site in get_sites().values()}
+
+def active_alerts(collection_name, engines):
+    """Return the active alerts of a collection, newest first, from its engine or else from the store."""
+    engine = engines.get(collection_name)
+    if engine is not None:
+        return engine.active()
+    config = st.secrets.get('alerts', {})
+    if not config.get('enabled', True):
+        return []
+    alerts = get_alert_store().active_alerts(collection_name)
+    return sorted(alerts, key=lambda alert: pd.Timestamp(alert['raised_at']), reverse=True)
@@ -0,0 +1,307 @@
+# anomaly.py
+"""Anomaly detection on pressure time series.
+
+Three detectors run per sensor over its readings in time order, with a
+window of `window` readings:
+
+- zscore: a reading more than `threshold` standard deviations from the
+  mean of the `window` readings before it.
+- ewma: a reading more than `threshold` exponentially weighted standard
+  deviations from the exponentially weighted mean before it
+  (alpha = 2 / (window + 1)).
+- changepoint: the first reading whose following `window` readings have a
+  mean that differs from the preceding `window` readings' mean by more
+  than `changepoint_threshold` pooled standard deviations.
+
+detect() evaluates a whole frame with array operations. AnomalyTracker
+produces the same anomalies one reading at a time in O(1) each, so a
+cached result can be extended with new readings instead of recomputed.
+"""
+import streamlit as st
+import math
+import threading
+from collections import OrderedDict, deque
+import numpy as np
+import pandas as pd
+
+DEFAULT_WINDOW = 60
+DEFAULT_THRESHOLD = 3.0
+DEFAULT_CHANGEPOINT_THRESHOLD = 2.0
+# Floor on standard deviations, so flat stretches followed by a jump still score finitely
+MIN_STD = 1e-6
+ANOMALY_COLUMNS = ['timestamp', 'sensorID', 'pressure', 'kind', 'score']
+# Cached (selection, window) results kept at a time
+MAX_CACHED_RESULTS = 32
+
+def empty_anomalies():
+    """Return an anomaly frame with no rows."""
+    return pd.DataFrame({
+        'timestamp': pd.Series(dtype='datetime64[ns, UTC]'),
+        'sensorID': pd.Series(dtype=object),
+        'pressure': pd.Series(dtype=np.float64),
+        'kind': pd.Series(dtype=object),
+        'score': pd.Series(dtype=np.float64),
+    })
+
+def _window_sums(cumsum, lo, hi):
+    """Sums of values[lo:hi] for arrays of bounds, from a cumulative sum with a leading zero."""
+    return cumsum[hi] - cumsum[lo]
+
+def _ewm(values, codes, alpha):
+    """Exponentially weighted mean (adjust=False) restarting at every sensor."""
+    means = pd.Series(values).groupby(codes, sort=False).ewm(alpha=alpha, adjust=False).mean()
+    return means.droplevel(0).sort_index().to_numpy()
+
+def _previous(values, starts, first):
+    """Shift values down by one within each sensor, putting `first` at every sensor's first row."""
+    previous = np.empty_like(values)
+    previous[1:] = values[:-1]
+    previous[starts] = first[starts] if isinstance(first, np.ndarray) else first
+    return previous
+
+def detect(df, window=DEFAULT_WINDOW, threshold=DEFAULT_THRESHOLD,
+           changepoint_threshold=DEFAULT_CHANGEPOINT_THRESHOLD):
+    """Return the anomalies of a reading frame, ordered by sensor and time."""
+    df = df.dropna(subset=['pressure'])
+    if len(df) <= window:
+        return empty_anomalies()
+    df = (df.sort_values(['sensorID', 'timestamp'], kind='stable')
+          .drop_duplicates(['sensorID', 'timestamp'], ignore_index=True))
+    sensor_ids = df['sensorID'].astype(str).to_numpy()
+    codes = pd.factorize(sensor_ids)[0]
+    x = df['pressure'].to_numpy(dtype=np.float64)
+    n = len(x)
+    index = np.arange(n)
+
+    # Position of each reading within its sensor, and its sensor's first and last row
+    is_start = np.r_[True, codes[1:] != codes[:-1]]
+    is_end = np.r_[codes[1:] != codes[:-1], True]
+    starts = np.flatnonzero(is_start)
+    first_row = np.maximum.accumulate(np.where(is_start, index, 0))
+    last_row = np.minimum.accumulate(np.where(is_end, index, n - 1)[::-1])[::-1]
+    position = index - first_row
+
+    cumsum = np.r_[0.0, np.cumsum(x)]
+    cumsum_sq = np.r_[0.0, np.cumsum(x * x)]
+
+    def window_stats(lo, hi):
+        mean = _window_sums(cumsum, lo, hi) / window
+        var = np.maximum(_window_sums(cumsum_sq, lo, hi) / window - mean * mean, 0.0)
+        return mean, var
+
+    found = []
+
+    # Rolling z-score against the preceding window
+    has_history = position >= window
+    lo = np.where(has_history, index - window, 0)
+    mean_before, var_before = window_stats(lo, np.where(has_history, index, 0))
+    z = np.abs(x - mean_before) / np.maximum(np.sqrt(var_before), MIN_STD)
+    mask = has_history & (z > threshold)
+    found.append((np.flatnonzero(mask), 'zscore', z[mask]))
+
+    # EWMA residual against the mean and variance before each reading
+    alpha = 2.0 / (window + 1)
+    means = _ewm(x, codes, alpha)
+    deviation = x - _previous(means, starts, x)
+    variances = _ewm((1 - alpha) * deviation * deviation, codes, alpha)
+    ewma_score = np.abs(deviation) / np.maximum(np.sqrt(_previous(variances, starts, 0.0)), MIN_STD)
+    mask = has_history & (ewma_score > threshold)
+    found.append((np.flatnonzero(mask), 'ewma', ewma_score[mask]))
+
+    # Mean shift between the windows before and after each reading; report where it starts exceeding
+    has_future = has_history & (index + window - 1 <= last_row)
+    hi = np.where(has_future, index + window, 0)
+    mean_after, var_after = window_stats(np.where(has_future, index, 0), hi)
+    pooled = np.sqrt((var_before + var_after) / 2)
+    shift = np.abs(mean_after - mean_before) / np.maximum(pooled, MIN_STD)
+    exceeds = has_future & (shift > changepoint_threshold)
+    rising = exceeds & ~(np.r_[False, exceeds[:-1]] & (position > 0))
+    found.append((np.flatnonzero(rising), 'changepoint', shift[rising]))
+
+    frames = [
+        pd.DataFrame({
+            'timestamp': df['timestamp'].iloc[rows].to_numpy(),
+            'sensorID': sensor_ids[rows],
+            'pressure': x[rows],
+            'kind': kind,
+            'score': scores,
+        })
+        for rows, kind, scores in found if len(rows)
+    ]
+    if not frames:
+        return empty_anomalies()
+    anomalies = pd.concat(frames, ignore_index=True)
+    anomalies['timestamp'] = pd.to_datetime(anomalies['timestamp'], utc=True)
+    return anomalies.sort_values(['sensorID', 'timestamp'], ignore_index=True)
+
+class SensorAnomalyState:
+    """Running sums of one sensor's last two windows and its EWMA mean and variance."""
+
+    __slots__ = ('recent', 'older', 'recent_sum', 'recent_sq', 'older_sum', 'older_sq',
+                 'count', 'mean', 'var', 'last_shift', 'last_timestamp')
+
+    def __init__(self):
+        self.recent = deque()  # (timestamp, pressure) of the last `window` readings
+        self.older = deque()   # the `window` readings before those
+        self.recent_sum = self.recent_sq = self.older_sum = self.older_sq = 0.0
+        self.count = 0
+        self.mean = self.var = None
+        self.last_shift = None
+        self.last_timestamp = None
+
+class AnomalyTracker:
+    """Incremental version of detect(): O(1) work per new reading."""
+
+    def __init__(self, window=DEFAULT_WINDOW, threshold=DEFAULT_THRESHOLD,
+                 changepoint_threshold=DEFAULT_CHANGEPOINT_THRESHOLD):
+        self.window = window
+        self.threshold = threshold
+        self.changepoint_threshold = changepoint_threshold
+        self.alpha = 2.0 / (window + 1)
+        self._states = {}
+
+    def _stats(self, total, total_sq):
+        mean = total / self.window
+        return mean, max(total_sq / self.window - mean * mean, 0.0)
+
+    def update(self, timestamp, sensor_id, pressure):
+        """Feed one reading (in time order per sensor); return its anomalies as (timestamp, kind, score, pressure)."""
+        if pressure is None or not math.isfinite(pressure):
+            return []
+        state = self._states.get(sensor_id)
+        if state is None:
+            state = self._states[sensor_id] = SensorAnomalyState()
+        if state.last_timestamp is not None and timestamp <= state.last_timestamp:
+            return []
+        state.last_timestamp = timestamp
+        w = self.window
+        found = []
+
+        if state.count >= w:
+            mean, var = self._stats(state.recent_sum, state.recent_sq)
+            z = abs(pressure - mean) / max(math.sqrt(var), MIN_STD)
+            if z > self.threshold:
+                found.append((timestamp, 'zscore', z, pressure))
+
+        if state.mean is None:
+            state.mean, state.var = pressure, 0.0
+        else:
+            deviation = pressure - state.mean
+            score = abs(deviation) / max(math.sqrt(state.var), MIN_STD)
+            if state.count >= w and score > self.threshold:
+                found.append((timestamp, 'ewma', score, pressure))
+            state.mean += self.alpha * deviation
+            state.var = (1 - self.alpha) * (state.var + self.alpha * deviation * deviation)
+
+        state.recent.append((timestamp, pressure))
+        state.recent_sum += pressure
+        state.recent_sq += pressure * pressure
+        if len(state.recent) > w:
+            moved = state.recent.popleft()[1]
+            state.recent_sum -= moved
+            state.recent_sq -= moved * moved
+            state.older.append(moved)
+            state.older_sum += moved
+            state.older_sq += moved * moved
+            if len(state.older) > w:
+                dropped = state.older.popleft()
+                state.older_sum -= dropped
+                state.older_sq -= dropped * dropped
+        state.count += 1
+
+        # The window after a reading is complete once `window` readings have followed it
+        if len(state.older) == w and len(state.recent) == w:
+            mean_before, var_before = self._stats(state.older_sum, state.older_sq)
+            mean_after, var_after = self._stats(state.recent_sum, state.recent_sq)
+            shift = abs(mean_after - mean_before) / max(math.sqrt((var_before + var_after) / 2), MIN_STD)
+            previous, state.last_shift = state.last_shift, shift
+            if shift > self.changepoint_threshold and (previous is None or previous <= self.changepoint_threshold):
+                start_timestamp, start_pressure = state.recent[0]
+                found.append((start_timestamp, 'changepoint', shift, start_pressure))
+        return found
+
+    def update_frame(self, df):
+        """Feed a frame of new readings; return their anomalies as a frame."""
+        rows = []
+        ordered = df.dropna(subset=['pressure']).sort_values('timestamp', kind='stable')
+        for timestamp, sensor_id, pressure in zip(ordered['timestamp'], ordered['sensorID'].astype(str),
+                                                  ordered['pressure'].astype(np.float64)):
+            for found_at, kind, score, value in self.update(timestamp, sensor_id, float(pressure)):
+                rows.append((found_at, sensor_id, value, kind, score))
+        if not rows:
+            return empty_anomalies()
+        anomalies = pd.DataFrame(rows, columns=ANOMALY_COLUMNS)
+        anomalies['timestamp'] = pd.to_datetime(anomalies['timestamp'], utc=True)
+        return anomalies
+
+class AnomalyCache:
+    """Anomalies per (selection, window), extended incrementally as readings arrive."""
+
+    def __init__(self, max_entries=MAX_CACHED_RESULTS):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, df, window=DEFAULT_WINDOW, threshold=DEFAULT_THRESHOLD,
+            changepoint_threshold=DEFAULT_CHANGEPOINT_THRESHOLD):
+        """Return the anomalies of `df`, the readings of the selection identified by `key`.
+
+        Readings newer than those of the cached result are fed through its
+        tracker; anything else (first call, readings removed) recomputes.
+        """
+        key = (key, window, threshold, changepoint_threshold)
+        newest = df['timestamp'].max() if len(df) else None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            tracker, anomalies, seen_newest, seen_rows = entry
+            if newest == seen_newest and len(df) == seen_rows:
+                return anomalies
+            if seen_newest is not None and newest is not None and newest > seen_newest:
+                new_rows = df[df['timestamp'] > seen_newest]
+                if len(df) - len(new_rows) == seen_rows:
+                    added = tracker.update_frame(new_rows)
+                    anomalies = anomalies if added.empty else pd.concat([anomalies, added], ignore_index=True)
+                    self._store(key, (tracker, anomalies, newest, len(df)))
+                    return anomalies
+
+        anomalies = detect(df, window, threshold, changepoint_threshold)
+        tracker = AnomalyTracker(window, threshold, changepoint_threshold)
+        # Replay each sensor's recent history so the tracker continues where detect() stopped
+        recent = df.dropna(subset=['pressure']).sort_values('timestamp', kind='stable')
+        tracker.update_frame(recent.groupby('sensorID', observed=True).tail(2 * window + 1))
+        self._seed_ewma(tracker, recent)
+        self._store(key, (tracker, anomalies, newest, len(df)))
+        return anomalies
+
+    @staticmethod
+    def _seed_ewma(tracker, df):
+        """Give the tracker each sensor's EWMA state over the full history, not just the replayed tail."""
+        if df.empty:
+            return
+        df = df.sort_values(['sensorID', 'timestamp'], kind='stable', ignore_index=True)
+        x = df['pressure'].to_numpy(dtype=np.float64)
+        codes = pd.factorize(df['sensorID'].astype(str))[0]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        means = _ewm(x, codes, tracker.alpha)
+        deviation = x - _previous(means, starts, x)
+        variances = _ewm((1 - tracker.alpha) * deviation * deviation, codes, tracker.alpha)
+        ends = np.r_[starts[1:] - 1, len(x) - 1]
+        for sensor_id, start, end in zip(df['sensorID'].astype(str).to_numpy()[ends], starts, ends):
+            state = tracker._states[sensor_id]
+            state.mean, state.var = float(means[end]), float(variances[end])
+            state.count = int(end - start + 1)
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+@st.cache_resource
+def get_anomaly_cache():
+    """Get the anomaly cache shared by all sessions."""
+    return AnomalyCache()
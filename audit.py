@@ -0,0 +1,112 @@
+# audit.py
+"""Audit trail of logins, user changes and exports.
+
+record() only puts the event on an in-memory queue, so it adds no latency
+to the action being audited. A background writer drains the queue and
+stores events in batches through the configured AuditStore, every
+FLUSH_SECONDS or as soon as BATCH_SIZE events are waiting.
+"""
+import streamlit as st
+import atexit
+import queue
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from storage import get_audit_store
+
+# Events written per batch
+BATCH_SIZE = 500
+# Longest an event waits in memory before it is written
+FLUSH_SECONDS = 2
+# Events held in memory while the store is unreachable; newer ones are dropped beyond this
+MAX_PENDING = 50_000
+MAX_WRITE_RETRIES = 3
+
+ACTIONS = [
+    'login', 'login_failed', 'login_throttled', 'logout',
+    'user_added', 'user_updated', 'user_removed',
+    'users_imported', 'users_enabled', 'users_disabled', 'users_removed',
+    'export_readings_csv', 'export_readings_pdf', 'export_users', 'export_audit_log',
+]
+
+class AuditWriter:
+    """Buffered, batching writer of audit events."""
+
+    def __init__(self, store=None):
+        self.store = store or get_audit_store()
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue(maxsize=MAX_PENDING)
+        self._thread = threading.Thread(target=self._run, daemon=True, name='audit-writer')
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def record(self, action, username=None, **details):
+        """Queue an event; never blocks."""
+        event = {
+            'id': uuid.uuid4().hex,
+            'timestamp': datetime.now(timezone.utc),
+            'username': username,
+            'action': action,
+            'details': details,
+        }
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self, timeout):
+        """Wait up to `timeout` for a first event, then take whatever else is queued, up to a batch."""
+        try:
+            events = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(events) < BATCH_SIZE:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def _write(self, events):
+        for attempt in range(MAX_WRITE_RETRIES):
+            try:
+                self.store.add_events(events)
+                self.written += len(events)
+                return
+            except Exception as error:
+                if attempt == MAX_WRITE_RETRIES - 1:
+                    self.dropped += len(events)
+                    print(f"Audit write of {len(events)} events failed: {error}", file=sys.stderr)
+                    return
+                time.sleep(2 ** attempt)
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            events = self._drain(FLUSH_SECONDS)
+            # Let a trickle of events accumulate into one batch instead of one write each
+            if events and len(events) < BATCH_SIZE:
+                time.sleep(max(0, FLUSH_SECONDS - (time.monotonic() - started)))
+                events += self._drain(0)
+            if events:
+                self._write(events)
+
+    def flush(self):
+        """Write everything queued so far, on the calling thread."""
+        while True:
+            events = self._drain(0)
+            if not events:
+                return
+            self._write(events)
+
+@st.cache_resource
+def get_audit_writer():
+    """Get the audit writer shared by all sessions."""
+    return AuditWriter()
+
+def record(action, username=None, **details):
+    """Record an audit event without waiting for it to be stored."""
+    get_audit_writer().record(action, username, **details)
@@ -0,0 +1,282 @@
+# benchmarks.py
+"""Benchmarks of every page's data path against synthetic data.
+
+Runs offline: the app is pointed at a local SQLite database filled by
+synthetic_data.py, one per dataset size, kept in the work directory and
+reused by later runs. For every step it reports the median and best wall
+time, the peak Python memory and the bytes read by the process:
+
+    $ python benchmarks.py --rows 10k,1M --repeat 5
+    $ python benchmarks.py --rows 10M --only regulator --json results.json
+
+Compare runs of the same size on the same machine; absolute numbers vary
+between machines. --save-baseline records a run's results, and a later run
+with --baseline fails (exit status 1) if any step's median time or peak
+memory grew by more than --tolerance over the baseline:
+
+    $ python benchmarks.py --rows 10k,1M --save-baseline baseline.json
+    $ python benchmarks.py --rows 10k,1M --baseline baseline.json
+"""
+import argparse
+import gc
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+COLLECTION_NAME = 'iot_gateway_reading'
+DEFAULT_SENSORS = 100
+BENCH_USERS = 2_000
+BENCH_PASSWORD = 'benchmark-password'
+# Relative growth over the baseline that counts as a regression
+DEFAULT_TOLERANCE = 0.25
+# Compared against the baseline; read MB depends on the OS page cache
+COMPARED_METRICS = ('median_ms', 'peak_mb')
+SECRETS = """\
+[storage]
+backend = "sqlite"
+sqlite_path = "{path}"
+
+[auth]
+bcrypt_rounds = {rounds}
+jwt_secret = "benchmark"
+
+[alerts]
+enabled = false
+"""
+
+def parse_rows(text):
+    """Parse a row count such as 10000, 10k or 1M."""
+    text = text.strip().lower()
+    scale = {'k': 1_000, 'm': 1_000_000}.get(text[-1], 1)
+    return int(float(text.rstrip('km')) * scale)
+
+def read_bytes():
+    """Return the bytes this process has read so far (Linux), or None."""
+    try:
+        with open('/proc/self/io') as f:
+            return int(next(line for line in f if line.startswith('rchar:')).split()[1])
+    except (OSError, StopIteration):
+        return None
+
+def measure(function, repeat):
+    """Time `repeat` calls of a function, then measure its peak memory on one more call."""
+    times, reads = [], []
+    for _ in range(repeat):
+        gc.collect()
+        before = read_bytes()
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+        if before is not None:
+            reads.append(read_bytes() - before)
+    gc.collect()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'median_ms': statistics.median(times) * 1000,
+        'best_ms': min(times) * 1000,
+        'peak_mb': peak / 2**20,
+        'read_mb': statistics.median(reads) / 2**20 if reads else None,
+    }
+
+def result_key(result):
+    """Identify a step of one dataset size across runs."""
+    return result['rows'], result['page'], result['step']
+
+def load_results(path):
+    """Return the results saved in a JSON file, or [] if there is none."""
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+def save_baseline(path, results):
+    """Record results as the baseline, replacing earlier results of the same steps."""
+    keys = {result_key(result) for result in results}
+    kept = [result for result in load_results(path) if result_key(result) not in keys]
+    with open(path, 'w') as f:
+        json.dump(kept + results, f, indent=2)
+
+def regressions(results, baseline, tolerance):
+    """Return a message for every metric that grew by more than `tolerance` over the baseline."""
+    saved = {result_key(result): result for result in baseline}
+    messages = []
+    for result in results:
+        before = saved.get(result_key(result))
+        if before is None:
+            continue
+        for metric in COMPARED_METRICS:
+            if before[metric] > 0 and result[metric] > before[metric] * (1 + tolerance):
+                messages.append(f"{result['rows']:,} {result['page']}/{result['step']}: {metric} "
+                                f"{before[metric]:.1f} -> {result[metric]:.1f} "
+                                f"(+{result[metric] / before[metric] - 1:.0%})")
+    return messages
+
+def prepare_environment(workdir, rows, rounds):
+    """Point the app at this size's database; must run before any app module is imported."""
+    os.makedirs(os.path.join(workdir, '.streamlit'), exist_ok=True)
+    with open(os.path.join(workdir, '.streamlit', 'secrets.toml'), 'w') as f:
+        f.write(SECRETS.format(path=f'bench_{rows}.db', rounds=rounds))
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+
+def ensure_data(rows, sensors):
+    """Fill this size's database with synthetic readings and users unless it already holds them."""
+    import bcrypt
+    from login import bcrypt_rounds
+    from storage import get_reading_store, get_user_store
+    from synthetic_data import populate_readings, populate_users
+
+    store = get_reading_store(COLLECTION_NAME)
+    if store.date_bounds() is None:
+        print(f"Generating {rows:,} readings for {sensors} sensors...", file=sys.stderr)
+        populate_readings(store, sensors, max(1, rows // sensors))
+        password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode('utf-8'), bcrypt.gensalt(bcrypt_rounds())).decode('utf-8')
+        populate_users(get_user_store(), BENCH_USERS, password_hash)
+
+def page_benchmarks():
+    """Return {page: [(step name, function)]} over the whole synthetic range."""
+    import altair as alt
+    import pandas as pd
+    from storage import get_audit_store, get_reading_store, get_user_store
+    from reading_cache import ReadingCache
+    from rollups import RollupStore
+    from downsample import downsample
+    from exporters import iter_frame_chunks, write_csv
+    from reports import build_pdf_report, summary_table
+    from reading_frame import with_formatted_timestamps
+    from anomaly import detect
+    from login import AuthService
+    from streamlit_app import build_sensor_cards, fetch_latest_readings, filter_sensor_cards, render_sensor_cards
+
+    oldest, newest = get_reading_store(COLLECTION_NAME).date_bounds()
+    start, end = pd.Timestamp(oldest), pd.Timestamp(newest) + pd.Timedelta(seconds=1)
+    warm_cache = ReadingCache()
+    frame = warm_cache.get_frame(COLLECTION_NAME, start=start.to_pydatetime(), end=end.to_pydatetime())
+    latest = fetch_latest_readings(COLLECTION_NAME)
+    export_columns = ['formatted_timestamp', 'sensorID', 'pressure']
+
+    def cold_fetch():
+        ReadingCache().get_frame(COLLECTION_NAME, start=start.to_pydatetime(), end=end.to_pydatetime())
+
+    def warm_fetch():
+        warm_cache.get_frame(COLLECTION_NAME, start=start.to_pydatetime(), end=end.to_pydatetime())
+
+    def rollups():
+        store = RollupStore(COLLECTION_NAME)
+        store.refresh()
+        store.summarize(start, end)
+
+    def chart():
+        chart_df = with_formatted_timestamps(downsample(frame, start, end))
+        alt.Chart(chart_df).mark_line(point=True).encode(
+            x='timestamp:T', y='pressure:Q', color='sensorID:N',
+            tooltip=['formatted_timestamp', 'sensorID', 'pressure']
+        ).to_dict()
+
+    def csv_export():
+        write_csv((with_formatted_timestamps(chunk) for chunk in iter_frame_chunks(frame)), export_columns).close()
+
+    def pdf_export():
+        build_pdf_report([with_formatted_timestamps(frame)], summary_table(frame), columns=export_columns)
+
+    def sensor_cards():
+        render_sensor_cards(filter_sensor_cards(build_sensor_cards(latest), "PR", "All"))
+
+    auth = AuthService()
+    usernames = itertools.count()
+
+    def login():
+        # A different user each time: the record is not cached and the per-user rate limit is not hit
+        auth.authenticate(f"user{next(usernames) % BENCH_USERS:04d}", BENCH_PASSWORD)
+
+    return {
+        'overview': [
+            ('fetch_latest_readings', lambda: fetch_latest_readings(COLLECTION_NAME)),
+            ('sensor_cards', sensor_cards),
+        ],
+        'regulator': [
+            ('fetch_data_cold', cold_fetch),
+            ('fetch_data_warm', warm_fetch),
+            ('rollups_refresh_summarize', rollups),
+            ('chart_build', chart),
+            ('anomaly_detect', lambda: detect(frame)),
+            ('to_csv', csv_export),
+            ('to_pdf', pdf_export),
+        ],
+        'login': [('login', login)],
+        'user_management': [('user_page', lambda: get_user_store().page(prefix='user1'))],
+        'audit_log': [('audit_page', lambda: get_audit_store().page())],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard's data paths on synthetic data.")
+    parser.add_argument('--rows', default='10k', help="comma-separated dataset sizes, e.g. 10k,1M,10M")
+    parser.add_argument('--sensors', type=int, default=DEFAULT_SENSORS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', help="comma-separated pages to run")
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    parser.add_argument('--workdir', default=os.path.join(REPO_DIR, 'bench_data'))
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--baseline', help="fail if a step regressed against the results saved in this file")
+    parser.add_argument('--save-baseline', help="save the results as the baseline in this file")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="relative growth over the baseline that fails the run")
+    args = parser.parse_args()
+
+    sizes = [parse_rows(value) for value in args.rows.split(',')]
+    if len(sizes) > 1:
+        # Streamlit keeps its secrets and caches per process; run one size per process
+        options = ['--sensors', str(args.sensors), '--repeat', str(args.repeat),
+                   '--bcrypt-rounds', str(args.bcrypt_rounds), '--workdir', os.path.abspath(args.workdir)]
+        options += ['--only', args.only] if args.only else []
+        options += ['--json', os.path.abspath(args.json)] if args.json else []
+        options += ['--baseline', os.path.abspath(args.baseline)] if args.baseline else []
+        options += ['--save-baseline', os.path.abspath(args.save_baseline)] if args.save_baseline else []
+        options += ['--tolerance', str(args.tolerance)]
+        codes = [subprocess.call([sys.executable, os.path.abspath(__file__), '--rows', str(rows)] + options)
+                 for rows in sizes]
+        sys.exit(max(codes))
+
+    rows = sizes[0]
+    os.makedirs(args.workdir, exist_ok=True)
+    prepare_environment(args.workdir, rows, args.bcrypt_rounds)
+    ensure_data(rows, args.sensors)
+    pages = page_benchmarks()
+    only = set(args.only.split(',')) if args.only else set(pages)
+
+    results = []
+    print(f"{'rows':>10}  {'page':<16} {'step':<26} {'median ms':>10} {'best ms':>10} {'peak MB':>9} {'read MB':>9}")
+    for page, steps in pages.items():
+        if page not in only:
+            continue
+        for name, function in steps:
+            result = dict(measure(function, args.repeat), rows=rows, page=page, step=name)
+            results.append(result)
+            read = f"{result['read_mb']:9.1f}" if result['read_mb'] is not None else f"{'n/a':>9}"
+            print(f"{rows:>10,}  {page:<16} {name:<26} {result['median_ms']:10.1f} {result['best_ms']:10.1f} "
+                  f"{result['peak_mb']:9.1f} {read}")
+
+    if args.json:
+        existing = load_results(args.json)
+        with open(args.json, 'w') as f:
+            json.dump(existing + results, f, indent=2)
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results)
+    if args.baseline:
+        messages = regressions(results, load_results(args.baseline), args.tolerance)
+        for message in messages:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        if messages:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# downsample.py
+"""Reduce reading frames to a bounded number of chart points.
+
+Both methods work per sensor and keep spikes visible: `minmax` keeps the
+lowest and highest reading of every time bucket, and `lttb` keeps the
+points that preserve the visual shape of each series
+(Largest-Triangle-Three-Buckets).
+"""
+import numpy as np
+import pandas as pd
+
+# Most points a chart may contain, across all sensors
+DEFAULT_MAX_POINTS = 2000
+# Assumed chart width in pixels; more than two points per pixel column are never visible
+DEFAULT_CHART_WIDTH = 1200
+# Largest budget worth asking for at the default width
+MAX_CHART_POINTS = 2 * DEFAULT_CHART_WIDTH
+
+def point_budget(max_points=DEFAULT_MAX_POINTS, chart_width=DEFAULT_CHART_WIDTH):
+    """Return how many points a chart of the given width can usefully show."""
+    return max(2, min(max_points, 2 * chart_width))
+
+def choose_bucket(start, end, n_series, budget):
+    """Pick a bucket size so that every series fits its share of the budget.
+
+    Each bucket yields up to two points (its minimum and maximum), and the
+    range may straddle one extra bucket boundary.
+    """
+    buckets_per_series = max(1, budget // (2 * max(1, n_series)) - 1)
+    bucket = (pd.Timestamp(end) - pd.Timestamp(start)) / buckets_per_series
+    return max(pd.Timedelta(bucket).ceil('s'), pd.Timedelta(seconds=1))
+
+def downsample_minmax(df, bucket, time_col='timestamp', value_col='pressure', series_col='sensorID'):
+    """Keep the raw minimum and maximum reading of each series per time bucket, or over the whole range."""
+    df = df.dropna(subset=[value_col])
+    keys = [df[series_col]] if bucket is None else [df[series_col], df[time_col].dt.floor(bucket)]
+    grouped = df.groupby(keys, observed=True, sort=False)[value_col]
+    keep = np.union1d(grouped.idxmin().to_numpy(), grouped.idxmax().to_numpy())
+    return df.loc[keep].sort_values([series_col, time_col])
+
+def lttb_indices(x, y, n_out):
+    """Return the positions LTTB keeps when reducing the series (x, y) to n_out points.
+
+    The work inside each bucket is vectorized; only the buckets are iterated.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    anchor = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[hi:next_hi].mean()
+        avg_y = y[hi:next_hi].mean()
+        area = np.abs((x[anchor] - avg_x) * (y[lo:hi] - y[anchor])
+                      - (x[anchor] - x[lo:hi]) * (avg_y - y[anchor]))
+        anchor = lo + int(area.argmax())
+        selected[i + 1] = anchor
+    return selected
+
+def downsample_lttb(df, points_per_series, time_col='timestamp', value_col='pressure', series_col='sensorID'):
+    """Reduce each series to at most points_per_series points with LTTB."""
+    df = df.dropna(subset=[value_col]).sort_values([series_col, time_col])
+    parts = []
+    for _, series in df.groupby(series_col, observed=True, sort=False):
+        x = series[time_col].to_numpy(dtype='datetime64[ns]').astype(np.int64).astype(np.float64)
+        y = series[value_col].to_numpy(dtype=np.float64)
+        parts.append(series.iloc[lttb_indices(x, y, points_per_series)])
+    return pd.concat(parts) if parts else df
+
+def downsample(df, start, end, max_points=DEFAULT_MAX_POINTS, chart_width=DEFAULT_CHART_WIDTH,
+               method='minmax', time_col='timestamp', value_col='pressure', series_col='sensorID'):
+    """Return at most the point budget of readings for charting, unchanged if it already fits.
+
+    Every series keeps at least its minimum and maximum, so with more than
+    half as many series as the budget the chart holds two points per series.
+    """
+    budget = point_budget(max_points, chart_width)
+    if len(df) <= budget:
+        return df
+    n_series = max(1, df[series_col].nunique())
+    if method == 'lttb' and budget // n_series >= 3:
+        return downsample_lttb(df, budget // n_series, time_col, value_col, series_col)
+    # Fewer than two buckets per series would overshoot the budget at a bucket boundary
+    bucket = choose_bucket(start, end, n_series, budget) if budget >= 4 * n_series else None
+    return downsample_minmax(df, bucket, time_col, value_col, series_col)
@@ -0,0 +1,51 @@
+# exporters.py
+"""Chunked exports of reading data.
+
+Rows are written in chunks straight from a paginated reading-store cursor
+or an already loaded frame into a spooled temporary file, so an export never
+holds the whole CSV text in memory next to the frame it came from.
+"""
+import gzip
+import tempfile
+from storage import PAGE_SIZE, get_reading_store
+import perf
+
+# Rows formatted per chunk
+CHUNK_ROWS = 50_000
+# Exports larger than this spill from memory to a temporary file on disk
+SPOOL_MAX_BYTES = 16 * 1024 * 1024
+
+def iter_frame_chunks(df, chunk_rows=CHUNK_ROWS):
+    """Yield consecutive row slices of a DataFrame."""
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+def iter_query_pages(collection_name, start=None, end=None, sensor_id=None, page_size=PAGE_SIZE):
+    """Yield lists of reading records page by page, resuming each page after the last one."""
+    store = get_reading_store(collection_name)
+    for page in store.query_pages(start=start, end=end, sensor_id=sensor_id, page_size=page_size):
+        perf.count(docs=len(page))
+        yield page
+
+def iter_csv(chunks, columns):
+    """Yield the CSV encoding of a stream of DataFrame chunks, header first."""
+    yield (','.join(columns) + '\n').encode('utf-8')
+    for chunk in chunks:
+        if len(chunk):
+            yield chunk[columns].to_csv(index=False, header=False).encode('utf-8')
+
+def write_csv(chunks, columns, compress=False):
+    """Write chunks as CSV into a spooled temporary file and return it rewound.
+
+    With `compress`, the file holds gzip-compressed CSV.
+    """
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    if compress:
+        with gzip.GzipFile(fileobj=output, mode='wb') as writer:
+            for data in iter_csv(chunks, columns):
+                writer.write(data)
+    else:
+        for data in iter_csv(chunks, columns):
+            output.write(data)
+    output.seek(0)
+    return output
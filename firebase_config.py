@@ -1,21 +1,106 @@
 import streamlit as st
 import json
+import hashlib
+import threading
+import time
 from google.oauth2 import service_account
 from google.cloud import firestore
+from perf import traced
 
-def initialize_firestore():
+# Seconds between liveness probes of a pooled client
+HEALTH_CHECK_INTERVAL = 300
+
+# One Firestore client (and therefore one gRPC channel) per credentials hash,
+# shared by every Streamlit session and rerun in this process.
+_clients = {}
+_clients_lock = threading.Lock()
+_stats = {
+    'clients_created': 0,
+    'clients_closed': 0,
+    'reconnects': 0,
+    'health_checks': 0,
+    'health_check_failures': 0,
+}
+
+def _credentials_key(firestore_json):
+    """Hash the service-account JSON so it can key the client pool."""
+    return hashlib.sha256(firestore_json.encode('utf-8')).hexdigest()
+
+def initialize_firestore(firestore_json=None):
     # Load Firestore JSON credentials from Streamlit secrets
-    firestore_json = st.secrets["firebase"]["credentials"]
+    if firestore_json is None:
+        firestore_json = st.secrets["firebase"]["credentials"]
     key_dict = json.loads(firestore_json)
-    
+
     # Create credentials and initialize Firestore client
     creds = service_account.Credentials.from_service_account_info(key_dict)
     db = firestore.Client(credentials=creds, project=key_dict["project_id"])
     return db
 
+def _close_client(db):
+    """Close a client's gRPC channel, ignoring errors from a dead channel."""
+    try:
+        db.close()
+    except Exception:
+        pass
+    _stats['clients_closed'] += 1
+
+def check_health(db):
+    """Return True if the client can still reach Firestore."""
+    _stats['health_checks'] += 1
+    try:
+        # A metadata-only call; it does not read any documents
+        list(db.collections())
+        return True
+    except Exception:
+        _stats['health_check_failures'] += 1
+        return False
+
+@traced('firestore.get_database')
 def get_database():
-    """Get Firestore database client."""
-    return initialize_firestore()
+    """Get the pooled Firestore database client, reconnecting if it is unhealthy."""
+    firestore_json = st.secrets["firebase"]["credentials"]
+    key = _credentials_key(firestore_json)
+
+    with _clients_lock:
+        entry = _clients.get(key)
+        if entry is None:
+            entry = {'client': initialize_firestore(firestore_json), 'checked_at': time.monotonic()}
+            _clients[key] = entry
+            _stats['clients_created'] += 1
+            return entry['client']
+        client = entry['client']
+        if time.monotonic() - entry['checked_at'] <= HEALTH_CHECK_INTERVAL:
+            return client
+        # Claim the check so concurrent callers keep using the client meanwhile
+        entry['checked_at'] = time.monotonic()
+
+    # The check is a network round trip; other sessions must not wait for it
+    if check_health(client):
+        return client
+    with _clients_lock:
+        if entry['client'] is client:
+            _close_client(client)
+            entry['client'] = initialize_firestore(firestore_json)
+            _stats['clients_created'] += 1
+            _stats['reconnects'] += 1
+        return entry['client']
+
+def reset_database():
+    """Close every pooled client; the next get_database call reconnects."""
+    with _clients_lock:
+        for entry in _clients.values():
+            _close_client(entry['client'])
+        _clients.clear()
+
+def client_stats():
+    """Return counters describing the client pool."""
+    with _clients_lock:
+        stats = dict(_stats)
+        stats['clients_open'] = len(_clients)
+        # Each Firestore client owns exactly one gRPC channel
+        stats['channels_open'] = len(_clients)
+    return stats
 
 def get_user_data(username):
     """Fetch user data from Firestore based on username."""
@@ -0,0 +1,335 @@
+# ingest.py
+"""Batched ingestion endpoint for gateway readings.
+
+Gateways POST JSON readings, one object or a list, to /sites/<site>/readings,
+or to /readings for the first configured site (see sites.py):
+
+    {"sensorID": "PR-01", "timestamp": "2024-05-01T08:00:00Z", "pressure": 3.2}
+
+Every site has its own pipeline writing to its own collection.
+
+Readings are validated, queued and written by one background writer that
+flushes when BATCH_SIZE readings are waiting or the oldest has waited
+MAX_LATENCY_SECONDS. Writes go through the reading store (Firestore
+BulkWriter plus the sensor_latest index), and every flushed batch is passed
+to the registered hooks, e.g. to fold it into the rollups. When the queue
+is full the endpoint answers 503 with Retry-After, so gateways back off.
+GET /metrics reports counters in Prometheus text format.
+
+Writes need `Authorization: Bearer <token>` with the shared token from
+`.streamlit/secrets.toml`; without a token the endpoint does not start.
+It listens on localhost unless `host` is set. Run standalone with
+`python ingest.py [port]`, or embedded in the app by setting:
+
+    [ingest]
+    token = "..."
+    embedded = true
+    port = 8600
+    host = "0.0.0.0"          # to accept gateways on other machines
+"""
+import streamlit as st
+import hmac
+import json
+import math
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+from storage import assign_reading_ids, get_reading_store
+from reading_frame import build_reading_frame
+from parallel_fetch import is_retryable
+from sites import get_sites
+
+DEFAULT_PORT = 8600
+DEFAULT_HOST = '127.0.0.1'
+BATCH_SIZE = 500
+MAX_LATENCY_SECONDS = 0.5
+# Readings waiting to be written before the endpoint pushes back
+MAX_QUEUE = 50_000
+MAX_WRITE_RETRIES = 5
+# Largest request body accepted
+MAX_BODY_BYTES = 5 * 1024 * 1024
+# How far past the server's clock a reading may be timestamped
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+def validate_reading(item):
+    """Return (reading, None) for a valid reading dict, or (None, error message)."""
+    if not isinstance(item, dict):
+        return None, "reading must be an object"
+    sensor_id = item.get('sensorID')
+    if not isinstance(sensor_id, str) or not sensor_id.strip():
+        return None, "sensorID must be a non-empty string"
+    pressure = item.get('pressure')
+    if isinstance(pressure, bool) or not isinstance(pressure, (int, float)) or not math.isfinite(pressure):
+        return None, "pressure must be a finite number"
+    timestamp = item.get('timestamp')
+    if timestamp is None:
+        timestamp = datetime.now(timezone.utc)
+    else:
+        if isinstance(timestamp, bool) or (isinstance(timestamp, float) and not math.isfinite(timestamp)):
+            return None, "timestamp must be an ISO 8601 string or epoch seconds"
+        try:
+            if isinstance(timestamp, (int, float)):
+                timestamp = pd.Timestamp(timestamp, unit='s', tz='UTC')
+            else:
+                timestamp = pd.Timestamp(timestamp)
+                if not pd.isna(timestamp):
+                    timestamp = timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')
+        except (ValueError, TypeError, OverflowError):
+            return None, "timestamp must be an ISO 8601 string or epoch seconds"
+        # "", "nan" and "NaT" parse to NaT, which would fail the whole batch it is written with
+        if pd.isna(timestamp):
+            return None, "timestamp must be an ISO 8601 string or epoch seconds"
+        timestamp = timestamp.to_pydatetime()
+        # A future timestamp would hide every later reading of the sensor behind it
+        if timestamp > datetime.now(timezone.utc) + MAX_CLOCK_SKEW:
+            return None, "timestamp is in the future"
+    return {'sensorID': sensor_id.strip(), 'timestamp': timestamp, 'pressure': float(pressure)}, None
+
+class IngestPipeline:
+    """Bounded queue of validated readings drained by a batching writer thread."""
+
+    def __init__(self, collection_name, store=None, batch_size=BATCH_SIZE,
+                 max_latency=MAX_LATENCY_SECONDS, max_queue=MAX_QUEUE):
+        self.collection_name = collection_name
+        self.store = store or get_reading_store(collection_name)
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.hooks = []
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._metrics = {
+            'readings_received_total': 0,
+            'readings_rejected_total': 0,
+            'readings_throttled_total': 0,
+            'readings_written_total': 0,
+            'readings_dropped_total': 0,
+            'batches_written_total': 0,
+            'write_retries_total': 0,
+            'hook_errors_total': 0,
+        }
+        self._last_batch_seconds = 0.0
+        self._metrics_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f'ingest-writer-{collection_name}')
+        self._thread.start()
+
+    def _count(self, name, amount=1):
+        with self._metrics_lock:
+            self._metrics[name] += amount
+
+    def submit(self, items):
+        """Validate and enqueue readings.
+
+        Returns (accepted, errors, throttled): errors lists (index, message)
+        pairs, and throttled is True if the queue was full.
+        """
+        self._count('readings_received_total', len(items))
+        readings, errors = [], []
+        for index, item in enumerate(items):
+            reading, error = validate_reading(item)
+            if error:
+                errors.append((index, error))
+            else:
+                readings.append(reading)
+        self._count('readings_rejected_total', len(errors))
+
+        # All or nothing, so a gateway can simply resend the request after a 503
+        if self._queue.maxsize - self._queue.qsize() < len(readings):
+            self._count('readings_throttled_total', len(readings))
+            return 0, errors, True
+        for reading in readings:
+            self._queue.put_nowait(reading)
+        return len(readings), errors, False
+
+    def _next_batch(self):
+        """Block for the first reading, then collect until the batch is full or its latency is spent."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        """Write one batch, retrying transient errors with backoff; return the readings that were stored."""
+        # IDs are fixed before the first attempt, so a retry rewrites the same documents
+        batch = assign_reading_ids(batch)
+        for attempt in range(MAX_WRITE_RETRIES + 1):
+            try:
+                failed = self.store.add_readings(batch) or []
+            except Exception as error:
+                if not is_retryable(error) or attempt == MAX_WRITE_RETRIES:
+                    print(f"Ingest write failed: {error}", file=sys.stderr)
+                    break
+                self._count('write_retries_total')
+                time.sleep(0.5 * 2 ** attempt)
+                continue
+            if failed:
+                print(f"Ingest write failed for {len(failed)} readings", file=sys.stderr)
+                self._count('readings_dropped_total', len(failed))
+                failed_ids = {record['id'] for record in failed}
+                return [reading for reading in batch if reading['id'] not in failed_ids]
+            return batch
+        self._count('readings_dropped_total', len(batch))
+        return []
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started = time.monotonic()
+            written = self._write(batch)
+            if written:
+                self._last_batch_seconds = time.monotonic() - started
+                self._count('readings_written_total', len(written))
+                self._count('batches_written_total')
+                frame = build_reading_frame(written)
+                for hook in self.hooks:
+                    try:
+                        hook(frame)
+                    except Exception as error:
+                        self._count('hook_errors_total')
+                        print(f"Ingest hook failed: {error}", file=sys.stderr)
+
+    def metrics(self):
+        """Return counters and gauges of the pipeline."""
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics['queue_depth'] = self._queue.qsize()
+        metrics['queue_capacity'] = self._queue.maxsize
+        metrics['last_batch_seconds'] = self._last_batch_seconds
+        return metrics
+
+def prometheus(pipelines):
+    """Render the metrics of every site's pipeline in the Prometheus text exposition format."""
+    metrics = {site_id: pipeline.metrics() for site_id, pipeline in pipelines.items()}
+    lines = []
+    for name in next(iter(metrics.values())):
+        kind = 'counter' if name.endswith('_total') else 'gauge'
+        lines.append(f"# TYPE ingest_{name} {kind}")
+        lines.extend(f'ingest_{name}{{site="{site_id}"}} {values[name]}' for site_id, values in metrics.items())
+    return '\n'.join(lines) + '\n'
+
+def make_handler(pipelines, token):
+    """Return an HTTP request handler class bound to {site ID: pipeline}; the first site is the default."""
+    default_site = next(iter(pipelines))
+    expected = f"Bearer {token}".encode('utf-8')
+
+    class IngestHandler(BaseHTTPRequestHandler):
+        def _reply(self, status, body, content_type='application/json', headers=None):
+            data = (json.dumps(body) if content_type == 'application/json' else body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self._reply(200, prometheus(pipelines), content_type='text/plain; version=0.0.4')
+            elif self.path == '/healthz':
+                self._reply(200, {'status': 'ok'})
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            parts = self.path.strip('/').split('/')
+            if parts == ['readings']:
+                pipeline = pipelines[default_site]
+            elif len(parts) == 3 and parts[0] == 'sites' and parts[2] == 'readings' and parts[1] in pipelines:
+                pipeline = pipelines[parts[1]]
+            else:
+                self._reply(404, {'error': 'not found'})
+                return
+            if not hmac.compare_digest(self.headers.get('Authorization', '').encode('utf-8'), expected):
+                self._reply(401, {'error': 'missing or wrong bearer token'}, headers={'WWW-Authenticate': 'Bearer'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                self._reply(400, {'error': 'Content-Length must be a non-negative integer'})
+                return
+            if length > MAX_BODY_BYTES:
+                self._reply(413, {'error': 'request body too large'})
+                return
+            try:
+                payload = json.loads(self.rfile.read(length) or b'null')
+            except ValueError:
+                self._reply(400, {'error': 'body must be JSON'})
+                return
+            items = payload if isinstance(payload, list) else [payload]
+            accepted, errors, throttled = pipeline.submit(items)
+            body = {'accepted': accepted, 'errors': [{'index': i, 'error': e} for i, e in errors]}
+            if throttled:
+                self._reply(503, dict(body, error='ingest queue full'), headers={'Retry-After': '1'})
+            elif accepted == 0 and errors:
+                self._reply(400, body)
+            else:
+                self._reply(202, body)
+
+        def log_message(self, format, *args):
+            # One line per request would dominate the log at thousands of readings per second
+            pass
+
+    return IngestHandler
+
+def site_pipelines():
+    """Return {site ID: pipeline} with one pipeline per configured site."""
+    return {site.id: IngestPipeline(site.collection) for site in get_sites().values()}
+
+def ingest_config():
+    """Return (token, host) from the [ingest] secrets; the token is None when it is not set."""
+    config = st.secrets.get('ingest', {})
+    return config.get('token') or None, config.get('host', DEFAULT_HOST)
+
+def start_server(pipelines, token, port=DEFAULT_PORT, host=DEFAULT_HOST):
+    """Serve the ingestion endpoint in a daemon thread and return the server."""
+    server = ThreadingHTTPServer((host, port), make_handler(pipelines, token))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name='ingest-http').start()
+    return server
+
+@st.cache_resource
+def _start_embedded(port, token, host):
+    from rollups import get_rollup_store
+
+    pipelines = site_pipelines()
+    # Keep the app's in-memory rollups current without re-reading what was just written
+    for site in get_sites().values():
+        pipelines[site.id].hooks.append(get_rollup_store(site.collection, site.timezone).add)
+    start_server(pipelines, token, port, host)
+    return pipelines
+
+def start_embedded_ingest():
+    """Start the ingestion endpoint inside the app if [ingest] embedded is set; return its pipelines."""
+    config = st.secrets.get('ingest', {})
+    if not config.get('embedded', False):
+        return None
+    token, host = ingest_config()
+    if token is None:
+        print("Embedded ingest not started: set [ingest] token in secrets", file=sys.stderr)
+        return None
+    return _start_embedded(int(config.get('port', DEFAULT_PORT)), token, host)
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT
+    from alerts import start_alerting
+
+    token, host = ingest_config()
+    if token is None:
+        sys.exit("Set [ingest] token in .streamlit/secrets.toml; gateways send it as a bearer token.")
+    pipelines = site_pipelines()
+    start_alerting(process='ingest')
+    server = ThreadingHTTPServer((host, port), make_handler(pipelines, token))
+    print(f"Ingesting readings for sites {', '.join(pipelines)} on {host}:{port}")
+    server.serve_forever()
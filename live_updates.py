@@ -0,0 +1,111 @@
+# live_updates.py
+"""Push new readings to the overview through a Firestore snapshot listener.
+
+One listener per collection runs in the background for the whole process
+(the SQLite backend polls instead) and applies new readings to an
+in-memory latest-per-sensor table. Pages render from that table, so
+viewers never re-read the collection.
+"""
+import streamlit as st
+import threading
+import time
+from storage import get_reading_store
+from reading_frame import build_reading_frame
+
+# How often live pages re-render from the shared table
+LIVE_REFRESH_SECONDS = 2
+# A listener keeps every document it has matched; restart it from the
+# newest timestamp periodically so that set stays small
+LISTENER_RESTART_SECONDS = 60 * 60
+
+class LatestTable:
+    """Thread-safe latest reading per sensor."""
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+        self.version = 0
+
+    def apply(self, record):
+        """Store a reading if it is newer than the sensor's current one; return whether it was."""
+        sensor_id = record.get('sensorID')
+        timestamp = record.get('timestamp')
+        if not sensor_id or timestamp is None:
+            return False
+        with self._lock:
+            current = self._records.get(sensor_id)
+            if current is not None and current['timestamp'] >= timestamp:
+                return False
+            self._records[sensor_id] = record
+            self.version += 1
+            return True
+
+    def newest_timestamp(self):
+        """Return the newest timestamp across all sensors, or None if empty."""
+        with self._lock:
+            return max((record['timestamp'] for record in self._records.values()), default=None)
+
+    def records(self):
+        """Return the latest reading of every sensor."""
+        with self._lock:
+            return list(self._records.values())
+
+    def frame(self):
+        """Return the table as a reading frame with one row per sensor."""
+        return build_reading_frame(self.records())
+
+class LiveFeed:
+    """Background snapshot listener feeding a LatestTable."""
+
+    def __init__(self, collection_name):
+        self.collection_name = collection_name
+        self.table = LatestTable()
+        self._watch = None
+        self._started_at = None
+        self._lock = threading.Lock()
+        self._subscribers = []
+
+    def ensure_running(self):
+        """Seed the table and (re)start the listener if it is missing, stopped or due for a restart."""
+        with self._lock:
+            if self._watch is not None:
+                expired = time.monotonic() - self._started_at > LISTENER_RESTART_SECONDS
+                if getattr(self._watch, 'is_active', True) and not expired:
+                    return
+                self._watch.unsubscribe()
+                self._watch = None
+
+            store = get_reading_store(self.collection_name)
+            if self._started_at is None:
+                for record in store.latest_per_sensor():
+                    self.table.apply(record)
+
+            self._watch = store.watch(self._on_readings, after=self.table.newest_timestamp())
+            self._started_at = time.monotonic()
+
+    def subscribe(self, callback):
+        """Also pass every batch of new readings to `callback`, on the listener's thread."""
+        self._subscribers.append(callback)
+
+    def _on_readings(self, records):
+        """Apply new readings; runs on the listener's thread."""
+        for record in records:
+            self.table.apply(record)
+        for callback in self._subscribers:
+            callback(records)
+
+    def frame(self):
+        """Return the current latest-per-sensor frame."""
+        return self.table.frame()
+
+    def stop(self):
+        """Stop listening."""
+        with self._lock:
+            if self._watch is not None:
+                self._watch.unsubscribe()
+                self._watch = None
+
+@st.cache_resource
+def get_live_feed(collection_name):
+    """Get the live feed of a collection, shared by all sessions."""
+    return LiveFeed(collection_name)
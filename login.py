@@ -1,22 +1,196 @@
 # login.py
+"""Password login shared by all pages.
+
+User records are cached for a few seconds, bcrypt runs on a small worker
+pool off the script thread, and attempts are rate limited per client IP
+and per username. The bcrypt cost and the number of reverse proxies in
+front of the app are set in `.streamlit/secrets.toml`:
+
+    [auth]
+    bcrypt_rounds = 12
+    trusted_proxies = 1       # read the client IP from X-Forwarded-For
+
+Stored hashes with a different cost are rehashed on the next successful
+login.
+"""
 import streamlit as st
 import bcrypt
-from firebase_config import get_user_data
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from storage import get_user_store
+import audit
+import perf
 
-def login(username, password):
-    """Attempt to log in a user with username and password."""
-    user_data = get_user_data(username)
-    if not user_data:
-        return False
+DEFAULT_BCRYPT_ROUNDS = 12
+# How long a fetched user record is trusted
+USER_CACHE_SECONDS = 30
+# Concurrent bcrypt checks; each one keeps a core busy for a few hundred milliseconds
+AUTH_WORKERS = 2
+# Checks waiting for a worker before new logins are turned away
+MAX_PENDING_CHECKS = 32
+# Login attempts allowed per window, per client IP and per username
+RATE_WINDOW_SECONDS = 60
+MAX_ATTEMPTS_PER_IP = 20
+MAX_ATTEMPTS_PER_USER = 5
+
+class LoginThrottled(Exception):
+    """Raised when a login attempt is refused because of too many recent attempts."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Too many login attempts. Try again in {int(retry_after) + 1} seconds.")
+        self.retry_after = retry_after
+
+def bcrypt_rounds():
+    """Return the configured bcrypt cost."""
+    return int(st.secrets.get('auth', {}).get('bcrypt_rounds', DEFAULT_BCRYPT_ROUNDS))
+
+def hash_password(password, rounds=None):
+    """Hash a password with the configured bcrypt cost."""
+    salt = bcrypt.gensalt(rounds or bcrypt_rounds())
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+def hash_rounds(password_hash):
+    """Return the cost a bcrypt hash was made with, or None if it is not a bcrypt hash."""
+    parts = password_hash.split('$')
+    return int(parts[2]) if len(parts) > 3 and parts[2].isdigit() else None
+
+class RateLimiter:
+    """Sliding-window attempt counter per key."""
+
+    def __init__(self, max_attempts, window_seconds=RATE_WINDOW_SECONDS):
+        self.max_attempts = max_attempts
+        self.window_seconds = window_seconds
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key):
+        """Record an attempt; return 0 if allowed, else the seconds until one is."""
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._attempts.setdefault(key, deque())
+            while attempts and attempts[0] <= now - self.window_seconds:
+                attempts.popleft()
+            if len(attempts) >= self.max_attempts:
+                return attempts[0] + self.window_seconds - now
+            attempts.append(now)
+            # Drop idle keys so the table only holds recent clients
+            if len(self._attempts) > 10_000:
+                self._attempts = {k: v for k, v in self._attempts.items() if v and v[-1] > now - self.window_seconds}
+            return 0
+
+class AuthService:
+    """Cached user lookups, pooled bcrypt checks and login rate limits."""
 
-    stored_password_hash = user_data.get('password')
-    if not stored_password_hash:
-        return False
+    def __init__(self, workers=AUTH_WORKERS):
+        self._users = {}
+        self._users_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self._slots = threading.BoundedSemaphore(MAX_PENDING_CHECKS)
+        self._ip_limiter = RateLimiter(MAX_ATTEMPTS_PER_IP)
+        self._user_limiter = RateLimiter(MAX_ATTEMPTS_PER_USER)
 
-    password_bytes = password.encode('utf-8')
-    stored_hash_bytes = stored_password_hash.encode('utf-8')
-    return bcrypt.checkpw(password_bytes, stored_hash_bytes)
+    def get_user(self, username):
+        """Return a user's record, from the cache if it was fetched in the last few seconds."""
+        now = time.monotonic()
+        with self._users_lock:
+            cached = self._users.get(username)
+            if cached is not None and cached[0] > now:
+                return cached[1]
+        user_data = get_user_store().get(username)
+        perf.count(docs=1)
+        with self._users_lock:
+            self._users[username] = (now + USER_CACHE_SECONDS, user_data)
+        return user_data
+
+    def invalidate_user(self, username=None):
+        """Forget a cached user record, or all of them."""
+        with self._users_lock:
+            if username is None:
+                self._users.clear()
+            else:
+                self._users.pop(username, None)
+
+    def _run(self, function, *args):
+        """Run a bcrypt call on the worker pool, refusing if too many are already waiting."""
+        if not self._slots.acquire(blocking=False):
+            raise LoginThrottled(1)
+        try:
+            with perf.span('login.bcrypt'):
+                return self._executor.submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def authenticate(self, username, password, client_ip=None):
+        """Return the user's record if the password matches, else None.
+
+        Raises LoginThrottled when the client or username has made too many
+        recent attempts.
+        """
+        retry_after = max(self._ip_limiter.hit(client_ip) if client_ip else 0,
+                          self._user_limiter.hit(username))
+        if retry_after:
+            raise LoginThrottled(retry_after)
+
+        user_data = self.get_user(username)
+        if not user_data or user_data.get('disabled'):
+            return None
+        stored_password_hash = user_data.get('password')
+        if not stored_password_hash:
+            return None
+
+        password_bytes = password.encode('utf-8')
+        if not self._run(bcrypt.checkpw, password_bytes, stored_password_hash.encode('utf-8')):
+            return None
+
+        rounds = bcrypt_rounds()
+        if hash_rounds(stored_password_hash) != rounds:
+            new_hash = self._run(hash_password, password, rounds)
+            get_user_store().update(username, {'password': new_hash})
+            self.invalidate_user(username)
+            user_data = dict(user_data, password=new_hash)
+        return user_data
+
+@st.cache_resource
+def get_auth_service():
+    """Get the auth service shared by all sessions."""
+    return AuthService()
+
+def client_ip():
+    """Return the IP address of the current session's client, if Streamlit exposes it.
+
+    Behind `trusted_proxies` reverse proxies, this is the X-Forwarded-For
+    entry the outermost of them appended; entries left of it come from the
+    client and are ignored. Without proxies the header is not read at all.
+    """
+    context = getattr(st, 'context', None)
+    if context is None:
+        return None
+    proxies = int(st.secrets.get('auth', {}).get('trusted_proxies', 0))
+    forwarded = context.headers.get('X-Forwarded-For') if proxies and context.headers else None
+    if forwarded:
+        hops = [hop.strip() for hop in forwarded.split(',') if hop.strip()]
+        if len(hops) >= proxies:
+            return hops[-proxies]
+    return getattr(context, 'ip_address', None)
+
+@perf.traced('login.authenticate')
+def authenticate(username, password):
+    """Return the user's record if the credentials are valid, else None. Raises LoginThrottled."""
+    ip = client_ip()
+    try:
+        user_data = get_auth_service().authenticate(username, password, ip)
+    except LoginThrottled:
+        audit.record('login_throttled', username, ip=ip)
+        raise
+    audit.record('login' if user_data else 'login_failed', username, ip=ip)
+    return user_data
+
+def login(username, password):
+    """Attempt to log in a user with username and password."""
+    return authenticate(username, password) is not None
 
-def is_logged_in():
-    """Check if the user is logged in."""
-    return 'logged_in' in st.session_state and st.session_state['logged_in']
+def invalidate_user(username=None):
+    """Drop a user's cached record after it changed."""
+    get_auth_service().invalidate_user(username)
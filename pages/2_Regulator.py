@@ -1,59 +1,153 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
-from io import BytesIO
-from firebase_config import get_database
-from fpdf import FPDF  # Import the FPDF library
+from reading_cache import get_reading_cache
+from storage import get_reading_store
+from downsample import DEFAULT_MAX_POINTS, MAX_CHART_POINTS, downsample
+from rollups import DIGEST_RETENTION, RETENTION, get_rollup_store
+from anomaly import DEFAULT_THRESHOLD, DEFAULT_WINDOW, get_anomaly_cache
+from exporters import iter_frame_chunks, iter_query_pages, write_csv
+from reports import build_pdf_report, get_report_jobs
+from reading_frame import DEFAULT_TIMEZONE, build_reading_frame, with_formatted_timestamps
+from session import require_login
+from sites import user_sites
+import audit
+import perf
 
-def fetch_data(collection_name):
+# Longer ranges are charted from hourly/daily rollups instead of raw readings
+RAW_CHART_MAX_RANGE = pd.Timedelta(days=2)
+EXPORT_COLUMNS = ['formatted_timestamp', 'sensorID', 'pressure']
+
+@perf.traced('regulator.fetch_data')
+def fetch_data(collection_name, start=None, end=None, sensor_id=None):
     """Fetches data from a Firestore collection.
 
+    The date range and sensor are applied by Firestore, and only documents
+    newer than the shared cache's watermark are read; everything older is
+    served from memory.
+
     Args:
         collection_name (str): The name of the Firestore collection.
+        start (datetime, optional): Inclusive lower bound on `timestamp`.
+        end (datetime, optional): Exclusive upper bound on `timestamp`.
+        sensor_id (str, optional): Only return readings of this sensor.
 
     Returns:
         pandas.DataFrame: A DataFrame containing the fetched data.
     """
-    db = get_database()
-    docs = db.collection(collection_name).get()
-    data = [doc.to_dict() for doc in docs]
-    return pd.DataFrame(data) if data else pd.DataFrame()
-
-def to_csv(df):
-    """Convert DataFrame to CSV format."""
-    return df.to_csv(index=False).encode('utf-8')
-
-def to_pdf(df):
-    """Convert DataFrame to PDF format."""
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size=12)
-    pdf.cell(200, 10, txt="Filtered Data", ln=True, align='C')
-    
-    header = df.columns.tolist()
-    for col in header:
-        pdf.cell(40, 10, txt=col, border=1)
-    pdf.ln()
+    return get_reading_cache().get_frame(collection_name, start=start, end=end, sensor_id=sensor_id)
+
+@st.cache_data(ttl=60)
+@perf.traced('regulator.fetch_date_range')
+def fetch_date_range(collection_name, tz):
+    """Return the first and last reading dates in the site's timezone, or None if there are no readings."""
+    bounds = get_reading_store(collection_name).date_bounds()
+    if bounds is None:
+        return None
+    oldest, newest = (pd.to_datetime(value, utc=True).tz_convert(tz) for value in bounds)
+    return oldest.date(), newest.date()
+
+@st.cache_data(ttl=60)
+@perf.traced('regulator.fetch_sensors')
+def fetch_sensors(collection_name):
+    """Return the sorted list of known sensor IDs."""
+    return get_reading_store(collection_name).sensor_ids()
+
+def iter_export_chunks(df, collection_name, start, end, sensor_id, tz):
+    """Yield export chunks with display timestamps, from the loaded frame or by paging the reading store."""
+    if df is not None:
+        for chunk in iter_frame_chunks(df):
+            yield with_formatted_timestamps(chunk, tz)
+        return
+    for records in iter_query_pages(collection_name, start=start, end=end, sensor_id=sensor_id):
+        yield with_formatted_timestamps(build_reading_frame(records), tz)
+
+@perf.traced('regulator.to_csv')
+def to_csv(chunks, compress=False):
+    """Convert DataFrame chunks to a CSV file object, optionally gzip-compressed."""
+    return write_csv(chunks, EXPORT_COLUMNS, compress=compress)
+
+@perf.traced('regulator.to_pdf')
+def to_pdf(chunks, summary, include_appendix=False, tz=DEFAULT_TIMEZONE, progress=None):
+    """Convert DataFrame chunks, streamed, to a PDF report with a per-sensor summary from the rollups."""
+    return build_pdf_report(chunks, summary, columns=EXPORT_COLUMNS,
+                            include_appendix=include_appendix, tz=tz, progress=progress)
+
+def discard_csv_export():
+    """Forget the session's prepared CSV and close its temporary file."""
+    csv_export = st.session_state.pop('csv_export', None)
+    if csv_export:
+        csv_export[2].close()
 
-    for index, row in df.iterrows():
-        for value in row:
-            pdf.cell(40, 10, txt=str(value), border=1)
-        pdf.ln()
+def pdf_job_status(export_key):
+    """Return (job ID, (progress, pdf, error)) of the session's PDF report for this selection, or None."""
+    pdf_job = st.session_state.get('pdf_job')
+    if not pdf_job:
+        return None
+    if pdf_job[0] != export_key:
+        # Built for another selection; it can no longer be downloaded
+        get_report_jobs().discard(pdf_job[1])
+        st.session_state.pop('pdf_job', None)
+        return None
+    status = get_report_jobs().status(pdf_job[1])
+    if status is None:
+        st.session_state.pop('pdf_job', None)
+        return None
+    return pdf_job[1], status
 
-    return pdf.output(dest='S').encode('latin1')
+@st.fragment(run_every=1)
+def show_pdf_progress(export_key):
+    """Poll a pending PDF report, rerunning the page once it is done."""
+    job = pdf_job_status(export_key)
+    if job is None or job[1][1] is not None or job[1][2] is not None:
+        st.rerun()
+    st.progress(job[1][0], text="Building PDF report...")
+
+def show_pdf_job(export_key):
+    """Show the progress of the session's PDF report and offer it once built.
+
+    Only a pending report polls; a finished one is rendered with the page.
+    """
+    job = pdf_job_status(export_key)
+    if job is None:
+        return
+    job_id, (progress, pdf, error) = job
+    if error is not None:
+        st.error(f"PDF report failed: {error}")
+    elif pdf is None:
+        show_pdf_progress(export_key)
+    else:
+        def discard():
+            get_report_jobs().discard(job_id)
+            st.session_state.pop('pdf_job', None)
+
+        st.download_button(
+            label="📄 Download PDF",
+            data=pdf,
+            file_name='filtered_data.pdf',
+            mime='application/pdf',
+            key='download-pdf',
+            on_click=discard
+        )
 
 # Streamlit app components
 st.set_page_config(page_title="Regulator Dashboard", layout="wide")
+user = require_login("Login Page", "Please log in to access the regulator dashboard.")
 st.title("📊 Regulator Dashboard")
 
-# Fetch data
-collection_name = "iot_gateway_reading"
-df = fetch_data(collection_name)
-
-# Process timestamps
-df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
-df['timestamp'] = df['timestamp'].dt.tz_convert('Asia/Singapore')
-df['formatted_timestamp'] = df['timestamp'].dt.strftime('%d/%m/%Y %H:%M')
+# Each site has its own collection and timezone; only the user's sites are offered
+sites = user_sites(user)
+if not sites:
+    st.warning("⚠️ You do not have access to any site.")
+    st.stop()
+site = sites[0]
+if len(sites) > 1:
+    site = st.sidebar.selectbox("Site", sites, format_func=lambda site: site.name)
+collection_name = site.collection
+date_range = fetch_date_range(collection_name, site.timezone)
+if date_range is None:
+    st.warning("⚠️ No data available.")
+    st.stop()
 
 # Custom CSS for improved design and responsiveness
 st.markdown(
@@ -131,64 +225,134 @@ with st.container():
     st.header("📅 Filter by Date Range")
     
     # Create a date range selector similar to a slicer
-    min_date = df['timestamp'].min().date()
-    max_date = df['timestamp'].max().date()
+    min_date, max_date = date_range
+    # Statistics only reach back as far as the day rollups are kept
+    retained_date = (pd.Timestamp(max_date) - RETENTION['1d']).date()
+    if min_date < retained_date:
+        st.caption(f"Readings before {retained_date} are past the rollup retention and cannot be selected.")
+        min_date = retained_date
     
-    start_date, end_date = st.date_input(
+    selected_range = st.date_input(
         "Select date range",
         value=(min_date, max_date),
         min_value=min_date,
         max_value=max_date,
     )
     
-    if isinstance(start_date, tuple):
-        start_date, end_date = start_date
+    # While only one end of the range is picked, show the full range
+    if isinstance(selected_range, tuple) and len(selected_range) == 2:
+        start_date, end_date = selected_range
     else:
         start_date = min_date
         end_date = max_date
     
     # Convert to timezone-aware timestamps
-    start_timestamp = pd.Timestamp(start_date).tz_localize('Asia/Singapore')
-    end_timestamp = pd.Timestamp(end_date).tz_localize('Asia/Singapore') + pd.Timedelta(days=1)
-    
-    # Filter DataFrame based on date range
-    filtered_df = df[(df['timestamp'] >= start_timestamp) & (df['timestamp'] < end_timestamp)]
+    start_timestamp = pd.Timestamp(start_date).tz_localize(site.timezone)
+    end_timestamp = pd.Timestamp(end_date).tz_localize(site.timezone) + pd.Timedelta(days=1)
     
     # Sensor ID Dropdown Filter with "All" option
     st.header("🔍 Select Sensor")
-    sensor_ids = sorted(df['sensorID'].unique())
-    sensor_ids_with_all = ["All"] + sensor_ids
+    sensor_ids_with_all = ["All"] + fetch_sensors(collection_name)
     selected_sensor = st.selectbox("Select Sensor ID", options=sensor_ids_with_all)
     
-    if selected_sensor != "All":
-        filtered_df = filtered_df[filtered_df['sensorID'] == selected_sensor]
+    sensor_filter = None if selected_sensor == "All" else selected_sensor
+    rollups = get_rollup_store(collection_name, site.timezone)
+    with perf.span('regulator.rollups'):
+        rollups.refresh()
+        summary = rollups.summarize(start_timestamp, end_timestamp, sensor_id=sensor_filter)
     
-    if filtered_df.empty:
+    # Raw readings are only loaded for short ranges; long ranges chart the rollups
+    filtered_df = None
+    if summary['count'] and end_timestamp - start_timestamp <= RAW_CHART_MAX_RANGE:
+        # Date range and sensor are filtered by Firestore
+        filtered_df = fetch_data(
+            collection_name,
+            start=start_timestamp.to_pydatetime(),
+            end=end_timestamp.to_pydatetime(),
+            sensor_id=sensor_filter,
+        )
+    
+    if summary['count'] == 0:
         st.warning("⚠️ No data available for the selected filters.")
     else:
         # Chart Section
         st.header(f"📈 Pressure Readings Over Time - {'All Sensors' if selected_sensor == 'All' else selected_sensor}")
         
-        # Create a responsive Altair chart
-        chart = alt.Chart(filtered_df).mark_line(point=True).encode(
-            x=alt.X('timestamp:T', title='Timestamp', axis=alt.Axis(labelAngle=-45, labelFontSize=10)),
-            y=alt.Y('pressure:Q', title='Pressure'),
-            color=alt.Color('sensorID:N', title='Sensor ID'),
-            tooltip=['formatted_timestamp', 'sensorID', 'pressure']
-        ).interactive().properties(
-            width='container',
-            height=400,
-            title='Pressure Readings Over Time'
-        )
+        if filtered_df is None:
+            # Long ranges: mean line with a min/max band from the rollups
+            series_df = rollups.series(start_timestamp, end_timestamp, sensor_id=sensor_filter)
+            base = alt.Chart(series_df).encode(
+                x=alt.X('timestamp:T', title='Timestamp', axis=alt.Axis(labelAngle=-45, labelFontSize=10)),
+                color=alt.Color('sensorID:N', title='Sensor ID'),
+            )
+            band = base.mark_area(opacity=0.2).encode(y=alt.Y('pressure_min:Q', title='Pressure'), y2='pressure_max:Q')
+            line = base.mark_line().encode(
+                y='pressure_mean:Q',
+                tooltip=[alt.Tooltip('timestamp:T', format='%d/%m/%Y %H:%M'), 'sensorID',
+                         alt.Tooltip('pressure_mean:Q', format='.2f'), 'pressure_min', 'pressure_max', 'count']
+            )
+            chart = (band + line).interactive().properties(
+                width='container',
+                height=400,
+                title='Pressure Readings Over Time'
+            )
+        else:
+            # Keep the chart within the point budget; min/max per bucket keeps spikes visible
+            with st.sidebar.expander("⚙️ Chart settings"):
+                max_points = st.number_input("Max chart points", min_value=100, max_value=MAX_CHART_POINTS,
+                                             value=DEFAULT_MAX_POINTS, step=100)
+                method = st.radio("Downsampling", options=["minmax", "lttb"],
+                                  format_func={"minmax": "Min/max per bucket", "lttb": "LTTB"}.get)
+            with st.sidebar.expander("🔎 Anomaly detection"):
+                detect_anomalies = st.toggle("Highlight anomalies", value=True)
+                window = st.number_input("Window (readings)", min_value=5, max_value=1000, value=DEFAULT_WINDOW)
+                threshold = st.number_input("Threshold (std devs)", min_value=1.0, max_value=10.0,
+                                            value=DEFAULT_THRESHOLD, step=0.5)
+            chart_df = downsample(filtered_df, start_timestamp, end_timestamp, max_points=max_points, method=method)
+            # Display columns only for the plotted rows; float32 pressures are rounded for tooltips
+            chart_df = with_formatted_timestamps(chart_df, site.timezone).assign(pressure=chart_df['pressure'].astype('float64').round(6))
+            if len(chart_df) < len(filtered_df):
+                st.caption(f"Showing {len(chart_df):,} of {len(filtered_df):,} readings.")
         
-        st.altair_chart(chart, use_container_width=True)
+            # Create a responsive Altair chart
+            chart = alt.Chart(chart_df).mark_line(point=True).encode(
+                x=alt.X('timestamp:T', title='Timestamp', axis=alt.Axis(labelAngle=-45, labelFontSize=10)),
+                y=alt.Y('pressure:Q', title='Pressure'),
+                color=alt.Color('sensorID:N', title='Sensor ID'),
+                tooltip=['formatted_timestamp', 'sensorID', 'pressure']
+            )
+            if detect_anomalies:
+                # Detected on every raw reading, not just the plotted ones; cached per selection and window
+                with perf.span('regulator.anomalies'):
+                    anomalies = get_anomaly_cache().get((collection_name, start_timestamp, end_timestamp, sensor_filter),
+                                                        filtered_df, window=int(window), threshold=threshold)
+                if len(anomalies):
+                    counts = anomalies['kind'].value_counts()
+                    st.caption("Anomalies: " + ", ".join(f"{count} {kind}" for kind, count in counts.items()))
+                    chart += alt.Chart(with_formatted_timestamps(anomalies, site.timezone)).mark_point(
+                        color='red', filled=True, size=80
+                    ).encode(
+                        x='timestamp:T',
+                        y='pressure:Q',
+                        shape=alt.Shape('kind:N', title='Anomaly'),
+                        tooltip=['formatted_timestamp', 'sensorID', 'kind', alt.Tooltip('score:Q', format='.1f')]
+                    )
+            chart = chart.interactive().properties(
+                width='container',
+                height=400,
+                title='Pressure Readings Over Time'
+            )
+        
+        # Serializing the chart spec and its data is most of the cost of drawing it
+        with perf.span('regulator.chart'):
+            st.altair_chart(chart, use_container_width=True)
         
         # Statistics Section (Moved Below the Chart)
         st.header("📊 Statistics")
-        total_records = filtered_df.shape[0]
-        mean_pressure = filtered_df['pressure'].mean()
-        median_pressure = filtered_df['pressure'].median()
-        std_pressure = filtered_df['pressure'].std()
+        total_records = summary['count']
+        mean_pressure = summary['mean']
+        median_pressure = summary['median']
+        std_pressure = summary['std']
         
         st.markdown(
             f"""
@@ -213,30 +377,56 @@ with st.container():
             """,
             unsafe_allow_html=True
         )
+        if pd.isna(median_pressure) and start_timestamp < pd.Timestamp.now(tz=site.timezone) - DIGEST_RETENTION:
+            st.caption(f"Medians are kept for the last {DIGEST_RETENTION.days} days only.")
         
         # Export Data Section
         st.header("💾 Export Data")
         st.markdown('<div class="export-button">', unsafe_allow_html=True)
         
+        # Exports are only built on request and are tied to the current selection
+        export_key = (site.id, start_timestamp, end_timestamp, selected_sensor)
+        
         # Export CSV Button
-        csv = to_csv(filtered_df[['formatted_timestamp', 'sensorID', 'pressure']])
-        st.download_button(
-            label="📥 Download CSV",
-            data=csv,
-            file_name='filtered_data.csv',
-            mime='text/csv',
-            key='download-csv'
-        )
+        compress_csv = st.checkbox("Compress CSV (gzip)")
+        if st.button("Prepare CSV", key='prepare-csv'):
+            chunks = iter_export_chunks(filtered_df, collection_name, start_timestamp.to_pydatetime(),
+                                        end_timestamp.to_pydatetime(), sensor_filter, site.timezone)
+            discard_csv_export()
+            st.session_state['csv_export'] = (export_key, compress_csv, to_csv(chunks, compress=compress_csv))
+            audit.record('export_readings_csv', user['sub'], site=site.id, start=start_timestamp.isoformat(),
+                         end=end_timestamp.isoformat(), sensor=selected_sensor, compressed=compress_csv)
         
-        # Export PDF Button
-        pdf = to_pdf(filtered_df[['formatted_timestamp', 'sensorID', 'pressure']])
-        st.download_button(
-            label="📄 Download PDF",
-            data=pdf,
-            file_name='filtered_data.pdf',
-            mime='application/pdf',
-            key='download-pdf'
-        )
+        csv_export = st.session_state.get('csv_export')
+        if csv_export and csv_export[0] != export_key:
+            # Prepared for another selection; it can no longer be downloaded
+            discard_csv_export()
+        elif csv_export:
+            _, compressed, csv_file = csv_export
+            csv_file.seek(0)
+            st.download_button(
+                label="📥 Download CSV",
+                data=csv_file.read(),
+                file_name='filtered_data.csv.gz' if compressed else 'filtered_data.csv',
+                mime='application/gzip' if compressed else 'text/csv',
+                key='download-csv',
+                on_click=discard_csv_export
+            )
+        
+        # Export PDF Button: built in a worker thread so the page stays responsive
+        include_appendix = st.checkbox("Include raw readings appendix in PDF")
+        if st.button("Prepare PDF", key='prepare-pdf'):
+            chunks = iter_export_chunks(filtered_df, collection_name, start_timestamp.to_pydatetime(),
+                                        end_timestamp.to_pydatetime(), sensor_filter, site.timezone)
+            jobs = get_report_jobs()
+            if 'pdf_job' in st.session_state:
+                jobs.discard(st.session_state['pdf_job'][1])
+            summary_by_sensor = rollups.sensor_summary(start_timestamp, end_timestamp, sensor_id=sensor_filter)
+            job_id = jobs.submit(to_pdf, chunks, summary_by_sensor, include_appendix=include_appendix, tz=site.timezone)
+            st.session_state['pdf_job'] = (export_key, job_id)
+            audit.record('export_readings_pdf', user['sub'], site=site.id, start=start_timestamp.isoformat(),
+                         end=end_timestamp.isoformat(), sensor=selected_sensor, appendix=include_appendix)
+        show_pdf_job(export_key)
         
         st.markdown('</div>', unsafe_allow_html=True)
     
@@ -1,30 +1,29 @@
 import streamlit as st
-import bcrypt
 import pandas as pd
-from firebase_config import get_database
-
-# Initialize Firestore client
-db = get_database()
-
-def hash_password(password):
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
-
-def check_password(password, hashed):
-    return bcrypt.checkpw(password.encode(), hashed.encode())
-
-def add_user(username, name, email, password, is_admin):
-    """Add a new user to Firestore."""
-    user_ref = db.collection('users').document(username)
-    user_ref.set({
+from storage import USER_PAGE_SIZE, get_user_store
+from login import hash_password, invalidate_user
+from session import current_user, require_login
+import audit
+import perf
+from sites import get_sites
+from user_bulk import delete_users, export_users, import_users, read_user_rows, set_users_disabled
+
+def add_user(username, name, email, password, is_admin, sites=None):
+    """Add a new user to the user store; without `sites` the user sees every site."""
+    data = {
         'name': name,
         'email': email,
         'password': hash_password(password),  # Hash the password before storing
         'is_admin': is_admin
-    })
-
-def update_user(username, name=None, email=None, password=None, is_admin=None):
-    """Update an existing user in Firestore."""
-    user_ref = db.collection('users').document(username)
+    }
+    if sites:
+        data['sites'] = list(sites)
+    get_user_store().set(username, data)
+    users_changed(username)
+    audit.record('user_added', actor(), target=username, is_admin=is_admin)
+
+def update_user(username, name=None, email=None, password=None, is_admin=None, sites=None):
+    """Update an existing user in the user store; an empty list of `sites` gives access to every site."""
     updates = {}
     if name:
         updates['name'] = name
@@ -34,62 +33,45 @@ def update_user(username, name=None, email=None, password=None, is_admin=None):
         updates['password'] = hash_password(password)  # Hash password if updating
     if is_admin is not None:
         updates['is_admin'] = is_admin
-    user_ref.update(updates)
+    if sites is not None:
+        updates['sites'] = list(sites) or None
+    get_user_store().update(username, updates)
+    users_changed(username)
+    audit.record('user_updated', actor(), target=username, fields=sorted(updates))
 
 def remove_user(username):
-    """Remove a user from Firestore."""
-    db.collection('users').document(username).delete()
-
-def get_users():
-    """Retrieve all users from Firestore."""
-    users_ref = db.collection('users')
-    docs = users_ref.stream()
-    users = []
-    for doc in docs:
-        user_data = doc.to_dict()
-        user_data['username'] = doc.id
-        users.append(user_data)
-    return users
-
-def is_logged_in():
-    """Check if a user is logged in."""
-    return 'logged_in' in st.session_state and st.session_state.logged_in
-
-def get_current_user():
-    """Get the current logged-in user."""
-    return st.session_state.get('current_user', {})
-
-def login(username, password):
-    """Simulate a login function."""
-    user_ref = db.collection('users').document(username)
-    user = user_ref.get()
-    if user.exists:
-        user_data = user.to_dict()
-        if check_password(password, user_data['password']):
-            st.session_state.logged_in = True
-            st.session_state.current_user = user_data
-            return True
-    return False
-
+    """Remove a user from the user store."""
+    get_user_store().delete(username)
+    users_changed(username)
+    audit.record('user_removed', actor(), target=username)
+
+@st.cache_data(ttl=300)
+@perf.traced('users.get_user_page')
+def get_user_page(prefix='', field='username', after=None, limit=USER_PAGE_SIZE):
+    """Retrieve one page of the user directory, without password hashes.
+
+    Returns (users, cursor); pass the cursor as `after` for the next page.
+    """
+    users, cursor = get_user_store().page(prefix, field=field, after=after, limit=limit)
+    perf.count(docs=len(users))
+    return [{key: value for key, value in user.items() if key != 'password'} for user in users], cursor
+
+def actor():
+    """Return the username of the admin making a change."""
+    user = current_user()
+    return user['sub'] if user else None
+
+def users_changed(username=None):
+    """Drop cached copies of users after one (or, without a username, many) changed."""
+    invalidate_user(username)
+    get_user_page.clear()
+
+@perf.traced('page.user_management')
 def main():
-    if not is_logged_in():
-        st.title("Login")
-        with st.form("login_form"):
-            username = st.text_input("Username")
-            password = st.text_input("Password", type="password")
-            submit_button = st.form_submit_button("Login")
-            if submit_button:
-                if login(username, password):
-                    st.success("Logged in successfully!")
-                    st.rerun()  # Refresh the UI
-                else:
-                    st.error("Invalid username or password")
-        return
-
-    current_user = get_current_user()
+    user = require_login()
 
     # Check if the current user is an admin
-    if not current_user.get('is_admin', False):
+    if not user.get('is_admin', False):
         st.warning("You do not have permission to view this page.")
         return
 
@@ -104,51 +86,156 @@ def main():
             email = st.text_input("Email")
             password = st.text_input("Password", type="password")
             is_admin = st.checkbox("Admin")
+            sites = site_input()
             submit_button = st.form_submit_button("Add User")
             if submit_button:
-                add_user(username, name, email, password, is_admin)
+                add_user(username, name, email, password, is_admin, sites)
                 st.success(f"User {username} added successfully!")
                 st.rerun()  # Refresh the UI
 
-    users = get_users()
-    if users:
-        # Create DataFrame from user list
-        df = pd.DataFrame(users)
-        df = df[['name', 'username', 'email', 'is_admin']]  # Select only desired columns
-
-        st.write("## Users")
-        for i, user in df.iterrows():
-            cols = st.columns([3, 3, 3, 3, 1, 1])  # Adjust column widths
-            cols[0].write(user['name'])
-            cols[1].write(user['username'])
-            cols[2].write(user['email'])
-            cols[3].write(user['is_admin'])
-
-            with cols[4]:
-                # Update button as a popover with adjusted content
-                with st.popover("✏️", use_container_width=True):
-                    st.write(f"**Update User: {user['username']}**")
-                    with st.form(f"update_user_form_{user['username']}"):
-                        new_name = st.text_input("New Name", value=user['name'])
-                        new_email = st.text_input("New Email", value=user['email'])
-                        new_password = st.text_input("New Password", type="password")
-                        new_is_admin = st.checkbox("Admin", value=user['is_admin'])
-                        submit_button = st.form_submit_button("Update User")
-                        if submit_button:
-                            update_user(user['username'], new_name, new_email, new_password, new_is_admin)
-                            st.success(f"User {user['username']} updated successfully!")
-                            st.rerun()  # Refresh the UI
-
-            with cols[5]:
-                # Delete button as a popover with adjusted content
-                with st.popover("🗑️", use_container_width=True):
-                    st.write(f"**Delete User: {user['username']}**")
-                    st.write("Are you sure you want to delete this user?")
-                    confirm_delete = st.checkbox(f"Confirm delete {user['username']}")
-                    if confirm_delete and st.button("Delete User", key=f"delete_{user['username']}"):
-                        remove_user(user['username'])
-                        st.success(f"User {user['username']} removed successfully!")
-                        st.rerun()  # Refresh the UI
+    show_bulk_tools()
+    show_user_directory()
+
+def show_bulk_tools():
+    """Render bulk import and export of users."""
+    with st.expander("📦 Import / export users"):
+        st.caption("CSV or JSON with username, name, email, password, is_admin and disabled. "
+                   "Rows without a password update existing users.")
+        uploaded = st.file_uploader("User file", type=['csv', 'json'])
+        if uploaded is not None and st.button("Import Users"):
+            try:
+                rows = read_user_rows(uploaded.getvalue(), uploaded.name)
+            except ValueError as error:
+                st.error(f"Could not read {uploaded.name}: {error}")
+                rows = None
+            if rows is not None:
+                with st.spinner(f"Importing {len(rows)} users..."):
+                    imported, errors = import_users(rows)
+                users_changed()
+                audit.record('users_imported', actor(), file=uploaded.name, imported=imported, failed=len(errors))
+                st.success(f"Imported {imported} users.")
+                if errors:
+                    st.warning(f"{len(errors)} rows were not imported:")
+                    st.dataframe(pd.DataFrame(errors, columns=['row', 'username', 'error']), hide_index=True)
+
+        export_cols = st.columns(2)
+        export_format = export_cols[0].radio("Export format", ['csv', 'json'], horizontal=True)
+        if export_cols[1].button("Prepare Export"):
+            st.session_state['user_export'] = (export_format, export_users(export_format))
+            audit.record('export_users', actor(), format=export_format)
+        user_export = st.session_state.get('user_export')
+        if user_export:
+            export_cols[1].download_button(
+                label="⬇️ Download Users",
+                data=user_export[1],
+                file_name=f'users.{user_export[0]}',
+                mime='text/csv' if user_export[0] == 'csv' else 'application/json',
+                on_click=lambda: st.session_state.pop('user_export', None)
+            )
+
+def show_bulk_actions(usernames):
+    """Render enable, disable and delete for the selected users."""
+    st.write(f"**{len(usernames)} users selected**")
+    action_cols = st.columns(3)
+    errors = action = None
+    if action_cols[0].button("Enable"):
+        errors, action = set_users_disabled(usernames, False), 'users_enabled'
+    if action_cols[1].button("Disable"):
+        errors, action = set_users_disabled(usernames, True), 'users_disabled'
+    with action_cols[2]:
+        confirm_delete = st.checkbox(f"Confirm delete {len(usernames)} users")
+        if confirm_delete and st.button("Delete Users"):
+            errors, action = delete_users(usernames), 'users_removed'
+    if errors is not None:
+        users_changed()
+        audit.record(action, actor(), targets=[name for name in usernames if name not in errors])
+        for username, error in errors.items():
+            st.error(f"{username}: {error}")
+        if not errors:
+            st.rerun()  # Refresh the UI
+
+def show_user_directory():
+    """Render one page of users, with editors for the selected users only."""
+    st.write("## Users")
+    search_cols = st.columns([3, 1])
+    prefix = search_cols[0].text_input("Search", placeholder="Starts with...").strip()
+    field = search_cols[1].radio("Search by", ['username', 'email'], horizontal=True)
+
+    # Cursors of the pages visited so far, reset whenever the search changes
+    search = (prefix, field)
+    if st.session_state.get('user_search') != search:
+        st.session_state.user_search = search
+        st.session_state.user_cursors = [None]
+    cursors = st.session_state.user_cursors
+
+    users, next_cursor = get_user_page(prefix, field=field, after=cursors[-1])
+    if not users:
+        st.info("No users found.")
+        return
+
+    # Keep `sites` so the editor starts from the user's current sites
+    df = pd.DataFrame(users).reindex(columns=['name', 'username', 'email', 'is_admin', 'disabled', 'sites'])
+    selection = st.dataframe(
+        df, hide_index=True, use_container_width=True,
+        on_select='rerun', selection_mode='multi-row', key=f'user_table_{len(cursors)}'
+    )
+
+    nav_cols = st.columns([1, 1, 4])
+    if nav_cols[0].button("◀ Previous", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    if nav_cols[1].button("Next ▶", disabled=next_cursor is None):
+        cursors.append(next_cursor)
+        st.rerun()
+    nav_cols[2].caption(f"Page {len(cursors)}")
+
+    selected = selection.selection.rows
+    if len(selected) == 1:
+        show_user_editor(df.iloc[selected[0]])
+    elif selected:
+        show_bulk_actions(df['username'].iloc[selected].tolist())
+
+def site_input(current=None):
+    """Render a site picker when there is more than one site; return the chosen site IDs, or None."""
+    sites = get_sites()
+    if len(sites) < 2:
+        return None
+    current = [site_id for site_id in current if site_id in sites] if isinstance(current, list) else []
+    return st.multiselect("Sites", list(sites), default=current, format_func=lambda site_id: sites[site_id].name,
+                          help="Leave empty for every site. Admins always see every site.")
+
+def show_user_editor(user):
+    """Render the update and delete forms of one user."""
+    st.write(f"### {user['username']}")
+    update_col, delete_col = st.columns(2)
+
+    with update_col:
+        with st.form(f"update_user_form_{user['username']}"):
+            st.write("**Update User**")
+            new_name = st.text_input("New Name", value=user['name'] or '')
+            new_email = st.text_input("New Email", value=user['email'] or '')
+            new_password = st.text_input("New Password", type="password")
+            new_is_admin = st.checkbox("Admin", value=bool(user['is_admin']))
+            current_sites = user.get('sites') if isinstance(user.get('sites'), list) else []
+            new_sites = site_input(current_sites)
+            submit_button = st.form_submit_button("Update User")
+            if submit_button:
+                # Sites are only written when the picker changed, so other edits never widen access
+                if new_sites is not None and \
+                        sorted(new_sites) == sorted(site_id for site_id in current_sites if site_id in get_sites()):
+                    new_sites = None
+                update_user(user['username'], new_name, new_email, new_password, new_is_admin, new_sites)
+                st.success(f"User {user['username']} updated successfully!")
+                st.rerun()  # Refresh the UI
+
+    with delete_col:
+        st.write("**Delete User**")
+        st.write("Are you sure you want to delete this user?")
+        confirm_delete = st.checkbox(f"Confirm delete {user['username']}")
+        if confirm_delete and st.button("Delete User", key=f"delete_{user['username']}"):
+            remove_user(user['username'])
+            st.success(f"User {user['username']} removed successfully!")
+            st.rerun()  # Refresh the UI
 
 if __name__ == "__main__":
     main()
@@ -1,36 +1,115 @@
 import streamlit as st
-from login import is_logged_in, login as authenticate_user
-
-def show_login_page():
-    """Render the login page."""
-    st.title("Login Page")
-    st.write("Please log in to access the audit logs.")
-    
-    with st.form("login_form"):
-        username = st.text_input("Username")
-        password = st.text_input("Password", type="password")
-        login_button = st.form_submit_button("Login")
-
-        if login_button:
-            if authenticate_user(username, password):
-                st.session_state['logged_in'] = True
-                st.session_state['username'] = username
-                st.session_state.page = 'audit_log'
-                st.rerun()  # Refresh the app after logging in
-            else:
-                st.error("Invalid credentials. Please try again.")
-
-def show_audit_log():
+import json
+import pandas as pd
+from storage import AUDIT_PAGE_SIZE, get_audit_store
+from session import require_login
+from exporters import write_csv
+from reading_frame import DEFAULT_TIMEZONE, format_timestamps
+import audit
+import perf
+
+AUDIT_COLUMNS = ['formatted_timestamp', 'username', 'action', 'details']
+
+def events_frame(events):
+    """Convert audit events to a display/export frame in local time."""
+    df = pd.DataFrame(events, columns=['timestamp', 'username', 'action', 'details'])
+    df['formatted_timestamp'] = format_timestamps(pd.to_datetime(df['timestamp'], utc=True),
+                                                  fmt='%d/%m/%Y %H:%M:%S')
+    df['details'] = [json.dumps(details, default=str) if details else '' for details in df['details']]
+    return df[AUDIT_COLUMNS]
+
+@st.cache_data(ttl=30)
+@perf.traced('audit_log.fetch_page')
+def fetch_audit_page(start, end, username, action, after=None, limit=AUDIT_PAGE_SIZE):
+    """Return (events frame, cursor) of one page of matching events, newest first."""
+    events, cursor = get_audit_store().page(start=start, end=end, username=username, action=action,
+                                            after=after, limit=limit)
+    perf.count(docs=len(events))
+    return events_frame(events), cursor
+
+@perf.traced('audit_log.export')
+def export_audit_log(start, end, username, action):
+    """Write all matching events to a CSV file page by page."""
+    pages = get_audit_store().query_pages(start=start, end=end, username=username, action=action)
+
+    def frames():
+        for events in pages:
+            perf.count(docs=len(events))
+            yield events_frame(events)
+
+    return write_csv(frames(), AUDIT_COLUMNS)
+
+def discard_audit_export():
+    """Forget the session's prepared audit CSV and close its temporary file."""
+    audit_export = st.session_state.pop('audit_export', None)
+    if audit_export:
+        audit_export[1].close()
+
+def show_audit_log(user):
     """Render the audit log page."""
     st.title("Audit Log")
-    st.write("This is where audit logs will be displayed.")
 
+    filter_cols = st.columns([2, 2, 2])
+    today = pd.Timestamp.now(tz=DEFAULT_TIMEZONE).date()
+    date_range = filter_cols[0].date_input("Date range", (today - pd.Timedelta(days=7), today))
+    username = filter_cols[1].text_input("Username").strip() or None
+    action = filter_cols[2].selectbox("Action", ["All"] + audit.ACTIONS)
+    action = None if action == "All" else action
+    if not isinstance(date_range, tuple) or len(date_range) != 2:
+        st.info("Select a start and end date.")
+        return
+    start = pd.Timestamp(date_range[0]).tz_localize(DEFAULT_TIMEZONE).to_pydatetime()
+    end = (pd.Timestamp(date_range[1]).tz_localize(DEFAULT_TIMEZONE) + pd.Timedelta(days=1)).to_pydatetime()
+
+    # Cursors of the pages visited so far, reset whenever the filters change
+    filters = (start, end, username, action)
+    if st.session_state.get('audit_filters') != filters:
+        st.session_state.audit_filters = filters
+        st.session_state.audit_cursors = [None]
+        # A CSV prepared for other filters can no longer be downloaded
+        discard_audit_export()
+    cursors = st.session_state.audit_cursors
+
+    df, next_cursor = fetch_audit_page(start, end, username, action, after=cursors[-1])
+    if df.empty:
+        st.info("No events match the filters.")
+        return
+    st.dataframe(df.rename(columns={'formatted_timestamp': 'time'}), hide_index=True, use_container_width=True)
+
+    nav_cols = st.columns([1, 1, 2, 2])
+    if nav_cols[0].button("◀ Newer", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    if nav_cols[1].button("Older ▶", disabled=next_cursor is None):
+        cursors.append(next_cursor)
+        st.rerun()
+    nav_cols[2].caption(f"Page {len(cursors)}")
+
+    if nav_cols[3].button("Prepare CSV"):
+        discard_audit_export()
+        st.session_state['audit_export'] = (filters, export_audit_log(start, end, username, action))
+        audit.record('export_audit_log', user['sub'], start=start.isoformat(), end=end.isoformat(),
+                     filter_username=username, filter_action=action)
+    audit_export = st.session_state.get('audit_export')
+    if audit_export:
+        csv_file = audit_export[1]
+        csv_file.seek(0)
+        nav_cols[3].download_button(
+            label="📥 Download CSV",
+            data=csv_file.read(),
+            file_name='audit_log.csv',
+            mime='text/csv',
+            on_click=discard_audit_export
+        )
+
+@perf.traced('page.audit_log')
 def main():
     """Main function to handle the application flow."""
-    if not is_logged_in():
-        show_login_page()
-    else:
-        show_audit_log()
+    user = require_login("Login Page", "Please log in to access the audit logs.")
+    if not user.get('is_admin', False):
+        st.warning("You do not have permission to view this page.")
+        return
+    show_audit_log(user)
 
 if __name__ == "__main__":
     main()
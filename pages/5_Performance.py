@@ -0,0 +1,62 @@
+import streamlit as st
+import altair as alt
+import pandas as pd
+from firebase_config import client_stats
+from reading_cache import get_reading_cache
+from session import require_login
+import perf
+
+def show_performance():
+    """Render the traced spans of this process."""
+    st.title("Performance")
+
+    enabled = st.toggle("Tracing", value=perf.is_enabled(),
+                        help="Applies to every session of this app process until it restarts.")
+    if enabled != perf.is_enabled():
+        perf.set_enabled(enabled)
+    recorder = perf.get_recorder()
+
+    summary = recorder.summary()
+    if summary.empty:
+        st.info("No traced calls yet." if enabled else
+                "Tracing is off. Turn it on above, or set `enabled = true` under `[perf]` in secrets.")
+        return
+
+    st.dataframe(
+        summary,
+        hide_index=True,
+        use_container_width=True,
+        column_config={column: st.column_config.NumberColumn(format="%.1f") for column in summary.columns
+                       if column.endswith(('_ms', '_per_call'))},
+    )
+    port = perf.start_metrics_endpoint()
+    if port is not None:
+        st.caption(f"Prometheus metrics are served on port {port} at /metrics.")
+
+    cols = st.columns([3, 1])
+    name = cols[0].selectbox("Span", summary['span'])
+    if cols[1].button("Reset"):
+        recorder.reset()
+        st.rerun()
+    samples = pd.DataFrame({'ms': recorder.samples(name)})
+    st.altair_chart(
+        alt.Chart(samples).mark_bar().encode(
+            x=alt.X('ms:Q', bin=alt.Bin(maxbins=40), title='Duration (ms)'),
+            y=alt.Y('count():Q', title='Calls'),
+        ).properties(width='container', height=250, title=f"Recent {name} calls"),
+        use_container_width=True
+    )
+
+    with st.expander("Connections and caches"):
+        st.json({'firestore_clients': client_stats(), 'reading_cache': get_reading_cache().stats()})
+
+def main():
+    """Main function to handle the application flow."""
+    user = require_login("Login Page", "Please log in to access performance data.")
+    if not user.get('is_admin', False):
+        st.warning("You do not have permission to view this page.")
+        return
+    show_performance()
+
+if __name__ == "__main__":
+    main()
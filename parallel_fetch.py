@@ -0,0 +1,140 @@
+# parallel_fetch.py
+"""Parallel, paginated loading of large reading ranges.
+
+The requested time range is split into shards, one per SHARD_SPAN up to
+MAX_SHARDS, that are paged through at the same time on a bounded thread
+pool. Batches are yielded as they arrive, and a shard that fails with a
+transient error is retried with exponential backoff, resuming after the
+cursor of the last record it emitted.
+"""
+import queue
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from google.api_core import exceptions as google_exceptions
+from storage import PAGE_SIZE, get_reading_store, reading_cursor
+from reading_frame import build_reading_frame, concat_reading_frames
+import perf
+
+# Time covered by one shard; shorter ranges are fetched with fewer shards
+SHARD_SPAN = pd.Timedelta(hours=6)
+# Most time shards per load
+MAX_SHARDS = 16
+# Shards fetched at the same time
+DEFAULT_MAX_WORKERS = 8
+MAX_RETRIES = 5
+BASE_DELAY_SECONDS = 0.5
+# Errors worth retrying: the request may succeed a moment later
+RETRYABLE_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.Aborted,
+)
+# SQLITE_BUSY and SQLITE_LOCKED; other operational errors, such as a missing table, fail the same way every time
+SQLITE_RETRYABLE_MESSAGES = ('database is locked', 'database table is locked')
+
+def is_retryable(error):
+    """Whether an error is transient: a Firestore outage or a locked or busy SQLite database."""
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return isinstance(error, sqlite3.OperationalError) and str(error).startswith(SQLITE_RETRYABLE_MESSAGES)
+
+def _utc(value):
+    """Convert a datetime-like value to a UTC pandas Timestamp."""
+    timestamp = pd.Timestamp(value)
+    return timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')
+
+def shard_count(start, end, max_shards=MAX_SHARDS):
+    """Return how many shards [start, end) is worth: one per SHARD_SPAN, between 1 and max_shards."""
+    span_end = _utc(end) if end is not None else pd.Timestamp.now(tz='UTC')
+    return max(1, min(max_shards, int(-(-(span_end - _utc(start)) // SHARD_SPAN))))
+
+def split_range(start, end, shards):
+    """Split [start, end) into equal time shards; a None end leaves the last shard open."""
+    start = _utc(start)
+    span_end = _utc(end) if end is not None else pd.Timestamp.now(tz='UTC')
+    if shards <= 1 or span_end <= start:
+        return [(start.to_pydatetime(), end)]
+    edges = pd.date_range(start, span_end, periods=shards + 1)
+    bounds = [(lo.to_pydatetime(), hi.to_pydatetime()) for lo, hi in zip(edges[:-1], edges[1:])]
+    bounds[-1] = (bounds[-1][0], end)
+    return bounds
+
+def _fetch_shard(store, lo, hi, sensor_id, page_size, emit, stopped):
+    """Page through one shard; a retry resumes after the cursor of the last emitted record."""
+    cursor = None
+    attempt = 0
+    while True:
+        try:
+            for page in store.query_pages(start=lo, end=hi, sensor_id=sensor_id, after=cursor, page_size=page_size):
+                if stopped.is_set():
+                    return
+                emit(page)
+                cursor = reading_cursor(page, cursor)
+                attempt = 0
+            return
+        except Exception as error:
+            attempt += 1
+            if not is_retryable(error) or attempt > MAX_RETRIES:
+                raise
+            time.sleep(BASE_DELAY_SECONDS * 2 ** (attempt - 1) * (1 + random.random()))
+
+def iter_batches(collection_name, start=None, end=None, sensor_id=None, shards=None,
+                 max_workers=DEFAULT_MAX_WORKERS, page_size=PAGE_SIZE):
+    """Yield lists of reading records from parallel shards of [start, end), in arrival order.
+
+    Without `shards`, the count follows the length of the range (see shard_count).
+    """
+    store = get_reading_store(collection_name)
+    if start is None:
+        bounds = store.date_bounds()
+        if bounds is None:
+            return
+        start = bounds[0]
+    shard_bounds = split_range(start, end, shards or shard_count(start, end))
+
+    # Bounded, so fast shards wait for the consumer instead of buffering everything
+    batches = queue.Queue(maxsize=2 * max_workers)
+    stopped = threading.Event()
+    done = object()
+
+    def emit(records):
+        while not stopped.is_set():
+            try:
+                batches.put(records, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def run(lo, hi):
+        try:
+            _fetch_shard(store, lo, hi, sensor_id, page_size, emit, stopped)
+        finally:
+            emit(done)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(shard_bounds)), thread_name_prefix='fetch') as executor:
+        futures = [executor.submit(run, lo, hi) for lo, hi in shard_bounds]
+        try:
+            remaining = len(futures)
+            while remaining:
+                batch = batches.get()
+                if batch is done:
+                    remaining -= 1
+                else:
+                    perf.count(docs=len(batch))
+                    yield batch
+            for future in futures:
+                future.result()
+        finally:
+            stopped.set()
+
+def fetch_frame(collection_name, start=None, end=None, sensor_id=None, **options):
+    """Load [start, end) in parallel into one reading frame sorted by timestamp."""
+    frames = [build_reading_frame(batch)
+              for batch in iter_batches(collection_name, start=start, end=end, sensor_id=sensor_id, **options)]
+    return concat_reading_frames(frames).sort_values('timestamp', ignore_index=True)
@@ -0,0 +1,281 @@
+# parquet_cache.py
+"""On-disk columnar cache of historical readings.
+
+Readings never change once written, so a sync job copies them from the
+reading store into Parquet files partitioned by UTC day and sensor:
+
+    <path>/<collection>/day=2024-05-01/sensorID=PR-01/part-....parquet
+
+and records the newest synced timestamp, with the IDs of the readings
+synced at it, as a high-water mark. The mark also numbers the sync
+batches, so files a crashed sync left behind are never read, and each
+closed day is compacted once into one file per sensor. Readers get
+`timestamp`, `sensorID` and `pressure` from memory-mapped files with
+partition pruning, and only ask the store for readings past the mark.
+
+Enable it in `.streamlit/secrets.toml`:
+
+    [parquet_cache]
+    path = "reading_cache"
+
+and sync on a schedule with `python parquet_cache.py iot_gateway_reading`;
+without collection names, every site's collection is synced.
+Run one sync job per cache directory.
+"""
+import streamlit as st
+import json
+import os
+import sys
+import threading
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+from storage import cursor_timestamp, get_reading_store, reading_cursor
+
+COLUMNS = ['timestamp', 'sensorID', 'pressure']
+SCHEMA = pa.schema([
+    ('timestamp', pa.timestamp('us', tz='UTC')),
+    ('sensorID', pa.string()),
+    ('pressure', pa.float64()),
+])
+PARTITIONING = ds.partitioning(pa.schema([('day', pa.string()), ('sensorID', pa.string())]), flavor='hive')
+# Rows buffered before a sync writes files, so a cold sync does not produce many tiny files
+WRITE_ROWS = 500_000
+# Readings younger than this are left to the tail query; they may still be arriving out of order
+SYNC_LAG = pd.Timedelta(minutes=10)
+# How often the in-process sync thread runs
+SYNC_INTERVAL_SECONDS = 15 * 60
+
+def _utc(value):
+    """Convert a datetime-like value to a UTC pandas Timestamp."""
+    timestamp = pd.Timestamp(value)
+    return timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')
+
+def _file_batch(name):
+    """Return (sync batch, compacted) of a data file name; files from before batches were numbered are batch 0."""
+    parts = name[:-len('.parquet')].split('-')
+    numbered = len(parts) == 3 and len(parts[1]) == 10 and parts[1].isdigit()
+    return (int(parts[1]) if numbered else 0), parts[-1] == 'c'
+
+class ParquetCache:
+    """Day/sensor partitioned Parquet copy of one readings collection."""
+
+    def __init__(self, root, collection_name):
+        self.collection_name = collection_name
+        self.root = os.path.join(root, collection_name)
+        self._watermark_path = os.path.join(self.root, '_watermark.json')
+        self._filesystem = pafs.LocalFileSystem(use_mmap=True)
+        self._lock = threading.Lock()
+        self._dataset_lock = threading.Lock()
+        self._dataset = (None, None)  # (batch, dataset of its live files)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _mark(self):
+        """Return the stored high-water mark, or None before the first sync."""
+        if not os.path.exists(self._watermark_path):
+            return None
+        with open(self._watermark_path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _cursor(mark):
+        timestamp = _utc(mark['timestamp']).to_pydatetime()
+        # Marks written before IDs were recorded are bare timestamps
+        return (timestamp, frozenset(mark['ids'])) if 'ids' in mark else timestamp
+
+    @property
+    def watermark(self):
+        """Cursor of the newest synced readings (see storage.reading_cursor), or None before the first sync."""
+        mark = self._mark()
+        return None if mark is None else self._cursor(mark)
+
+    def _set_mark(self, cursor, batch, compacted_through):
+        """Persist the high-water mark atomically; it commits every file of batches up to `batch`."""
+        tmp_path = self._watermark_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            mark = {'timestamp': _utc(cursor_timestamp(cursor)).isoformat(),
+                    'batch': batch, 'compacted_through': compacted_through}
+            if isinstance(cursor, tuple):
+                mark['ids'] = sorted(cursor[1])
+            json.dump(mark, f)
+        os.replace(tmp_path, self._watermark_path)
+
+    def _files(self, committed):
+        """Return (live, stale) data file paths as of the committed batch.
+
+        Files of later batches were left by a sync that stopped before it
+        moved the mark; files older than their partition's compacted file
+        were replaced by it. Readers skip stale files and sync removes them.
+        """
+        live, stale = [], []
+        for directory, _, names in os.walk(self.root):
+            files = [(name, *_file_batch(name)) for name in names if name.endswith('.parquet')]
+            compacted = max((batch for _, batch, is_compacted in files
+                             if is_compacted and batch <= committed), default=-1)
+            for name, batch, _ in files:
+                path = os.path.join(directory, name)
+                (stale if batch > committed or batch < compacted else live).append(path)
+        return live, stale
+
+    @staticmethod
+    def _remove(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _write(self, records, batch):
+        """Write records as new files of a sync batch under their day/sensor partitions."""
+        df = pd.DataFrame(records, columns=COLUMNS)
+        df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+        table = pa.Table.from_pandas(df, schema=SCHEMA, preserve_index=False)
+        table = table.append_column('day', pa.array(df['timestamp'].dt.strftime('%Y-%m-%d')))
+        pq.write_to_dataset(table, self.root, partition_cols=['day', 'sensorID'],
+                            basename_template=f'part-{batch:010d}-{{i}}.parquet')
+
+    def _compact(self, cursor, batch, compacted_through):
+        """Rewrite every closed day not compacted yet as one file per sensor; return the new (batch, day).
+
+        Days before the watermark's day get no more readings, so each is
+        compacted once. The compacted files replace the old ones as soon as
+        the mark commits their batch.
+        """
+        newest_day = _utc(cursor_timestamp(cursor)).strftime('%Y-%m-%d')
+        partitions = {}
+        for path in self._files(batch)[0]:
+            directory = os.path.dirname(path)
+            day = os.path.relpath(directory, self.root).split(os.sep)[0][len('day='):]
+            if (compacted_through is None or day > compacted_through) and day < newest_day:
+                partitions.setdefault(directory, []).append(path)
+        if not partitions:
+            return batch, compacted_through
+        batch += 1
+        for directory, paths in partitions.items():
+            if len(paths) > 1:
+                # The partition columns live in the directory names, not in the files
+                table = pq.read_table(paths, partitioning=None).sort_by('timestamp')
+                pq.write_table(table, os.path.join(directory, f'part-{batch:010d}-c.parquet'))
+        compacted_through = max(os.path.relpath(directory, self.root).split(os.sep)[0][len('day='):]
+                                for directory in partitions)
+        self._set_mark(cursor, batch, compacted_through)
+        self._remove(self._files(batch)[1])
+        return batch, compacted_through
+
+    def sync(self, store=None):
+        """Copy readings past the high-water mark (up to SYNC_LAG ago) into the cache; return rows added."""
+        store = store or get_reading_store(self.collection_name)
+        with self._lock:
+            mark = self._mark() or {}
+            batch, compacted_through = mark.get('batch', 0), mark.get('compacted_through')
+            # Files of a sync or compaction that stopped before its mark was written
+            self._remove(self._files(batch)[1])
+            cursor = self._cursor(mark) if mark else None
+            end = (pd.Timestamp.now(tz='UTC') - SYNC_LAG).to_pydatetime()
+            buffered, added = [], 0
+            for page in store.query_pages(after=cursor, end=end):
+                buffered.extend(page)
+                if len(buffered) >= WRITE_ROWS:
+                    batch, cursor = self._commit(buffered, batch, cursor, compacted_through)
+                    added += len(buffered)
+                    buffered = []
+            if buffered:
+                batch, cursor = self._commit(buffered, batch, cursor, compacted_through)
+                added += len(buffered)
+            if cursor is not None:
+                self._compact(cursor, batch, compacted_through)
+            return added
+
+    def _commit(self, records, batch, cursor, compacted_through):
+        """Write records as the next batch and move the mark past them; return (batch, cursor)."""
+        batch += 1
+        self._write(records, batch)
+        cursor = reading_cursor(records, cursor)
+        self._set_mark(cursor, batch, compacted_through)
+        return batch, cursor
+
+    def _live_dataset(self, batch):
+        """Return the dataset of the live files of a batch, listing the tree only when the batch changed."""
+        with self._dataset_lock:
+            if self._dataset[0] != batch:
+                live = self._files(batch)[0]
+                dataset = ds.dataset(live, format='parquet', partitioning=PARTITIONING,
+                                     partition_base_dir=self.root, filesystem=self._filesystem) if live else None
+                self._dataset = (batch, dataset)
+            return self._dataset[1]
+
+    def read(self, start=None, end=None, sensor_id=None, columns=COLUMNS):
+        """Return (frame, watermark): cached readings in [start, end), optionally of one sensor.
+
+        The frame holds exactly the readings up to the returned watermark, even
+        while a sync is running, so callers can fetch the tail after it.
+        """
+        for attempt in range(2):
+            mark = self._mark()
+            if mark is None:
+                return pd.DataFrame(columns=columns), None
+            dataset = self._live_dataset(mark.get('batch', 0))
+            if dataset is None:
+                return pd.DataFrame(columns=columns), None
+            try:
+                return self._read(dataset, self._cursor(mark), start, end, sensor_id, columns)
+            except FileNotFoundError:
+                # A compaction replaced files after the mark was read; list them again
+                if attempt:
+                    raise
+
+    def _read(self, dataset, watermark, start, end, sensor_id, columns):
+        timestamp_type = SCHEMA.field('timestamp').type
+        conditions = [ds.field('timestamp') <= pa.scalar(_utc(cursor_timestamp(watermark)), type=timestamp_type)]
+        if start is not None:
+            start = _utc(start)
+            conditions += [ds.field('day') >= start.strftime('%Y-%m-%d'),
+                           ds.field('timestamp') >= pa.scalar(start, type=timestamp_type)]
+        if end is not None:
+            end = _utc(end)
+            conditions += [ds.field('day') <= end.strftime('%Y-%m-%d'),
+                           ds.field('timestamp') < pa.scalar(end, type=timestamp_type)]
+        if sensor_id is not None:
+            conditions.append(ds.field('sensorID') == sensor_id)
+        condition = conditions[0]
+        for clause in conditions[1:]:
+            condition = condition & clause
+        table = dataset.to_table(columns=columns, filter=condition)
+        return table.to_pandas().sort_values('timestamp', ignore_index=True), watermark
+
+    def start_sync_thread(self, interval=SYNC_INTERVAL_SECONDS):
+        """Sync now and then every `interval` seconds in a daemon thread."""
+        def run():
+            while True:
+                try:
+                    self.sync()
+                except Exception as error:
+                    print(f"Parquet cache sync of {self.collection_name} failed: {error}", file=sys.stderr)
+                time.sleep(interval)
+
+        threading.Thread(target=run, daemon=True, name=f'parquet-sync-{self.collection_name}').start()
+
+def cache_path():
+    """Return the configured cache directory, or None if the cache is disabled."""
+    return st.secrets.get('parquet_cache', {}).get('path')
+
+@st.cache_resource
+def _get_parquet_cache(root, collection_name):
+    cache = ParquetCache(root, collection_name)
+    cache.start_sync_thread()
+    return cache
+
+def get_parquet_cache(collection_name):
+    """Get the shared Parquet cache of a collection, or None if it is not configured."""
+    root = cache_path()
+    return _get_parquet_cache(root, collection_name) if root else None
+
+if __name__ == "__main__":
+    from sites import get_sites
+
+    for name in sys.argv[1:] or [site.collection for site in get_sites().values()]:
+        rows = ParquetCache(cache_path() or 'reading_cache', name).sync()
+        print(f"{name}: synced {rows} readings")
@@ -0,0 +1,246 @@
+# perf.py
+"""Lightweight tracing of where rerun time goes.
+
+Traced functions and `span` blocks record their wall time, the documents
+they read from the store and the rows and bytes of what they returned.
+Spans nest: documents read inside a span count towards every enclosing
+span on the same thread, so a page's span holds the totals of its rerun.
+The recent samples of each span name give the percentiles shown on the
+Performance page and served in Prometheus text format.
+
+Tracing is off unless enabled in `.streamlit/secrets.toml`; while it is
+off a traced call costs one flag check:
+
+    [perf]
+    enabled = true
+    port = 9108               # optional: serve GET /metrics on this port from app start
+    host = "0.0.0.0"          # optional: accept scrapes from other machines, not just localhost
+"""
+import streamlit as st
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+
+# Recent calls kept per span name for percentiles
+MAX_SAMPLES = 2_000
+# Interface the metrics endpoint listens on unless [perf] host says otherwise
+DEFAULT_METRICS_HOST = '127.0.0.1'
+PERCENTILES = (50, 90, 99)
+
+_enabled = None
+_local = threading.local()
+
+def is_enabled():
+    """Return whether tracing is on; read from the [perf] secrets on first use."""
+    global _enabled
+    if _enabled is None:
+        _enabled = bool(st.secrets.get('perf', {}).get('enabled', False))
+    return _enabled
+
+def set_enabled(enabled):
+    """Turn tracing on or off for the whole process."""
+    global _enabled
+    _enabled = bool(enabled)
+
+class Span:
+    """Counters of one traced call."""
+
+    __slots__ = ('name', 'parent', 'docs', 'rows', 'bytes')
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.docs = 0
+        self.rows = 0
+        self.bytes = 0
+
+    def add(self, docs=0, rows=0, nbytes=0):
+        self.docs += docs
+        self.rows += rows
+        self.bytes += nbytes
+
+class _NullSpan:
+    """Stands in for a span while tracing is off."""
+
+    __slots__ = ()
+
+    def add(self, docs=0, rows=0, nbytes=0):
+        pass
+
+NULL_SPAN = _NullSpan()
+
+class Recorder:
+    """Recent samples and running totals per span name."""
+
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.max_samples = max_samples
+        self._samples = {}  # name -> deque of call seconds
+        self._totals = {}   # name -> [calls, errors, seconds, docs, rows, bytes]
+        self._lock = threading.Lock()
+
+    def record(self, span, seconds, error=False):
+        with self._lock:
+            samples = self._samples.get(span.name)
+            if samples is None:
+                samples = self._samples[span.name] = deque(maxlen=self.max_samples)
+                self._totals[span.name] = [0, 0, 0.0, 0, 0, 0]
+            samples.append(seconds)
+            totals = self._totals[span.name]
+            totals[0] += 1
+            totals[1] += error
+            totals[2] += seconds
+            totals[3] += span.docs
+            totals[4] += span.rows
+            totals[5] += span.bytes
+
+    def _snapshot(self):
+        with self._lock:
+            return {name: (np.array(self._samples[name]), list(totals)) for name, totals in self._totals.items()}
+
+    def summary(self):
+        """Return one row per span name: calls, errors, latency percentiles and mean docs/rows/bytes."""
+        rows = []
+        for name, (samples, (calls, errors, seconds, docs, n_rows, nbytes)) in sorted(self._snapshot().items()):
+            row = {'span': name, 'calls': calls, 'errors': errors}
+            for q, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+                row[f'p{q}_ms'] = value * 1000
+            row.update(mean_ms=seconds / calls * 1000, docs_per_call=docs / calls,
+                       rows_per_call=n_rows / calls, bytes_per_call=nbytes / calls)
+            rows.append(row)
+        columns = ['span', 'calls', 'errors'] + [f'p{q}_ms' for q in PERCENTILES] + \
+            ['mean_ms', 'docs_per_call', 'rows_per_call', 'bytes_per_call']
+        return pd.DataFrame(rows, columns=columns)
+
+    def samples(self, name):
+        """Return the recent call durations of a span name, in milliseconds."""
+        with self._lock:
+            return [seconds * 1000 for seconds in self._samples.get(name, ())]
+
+    def prometheus(self):
+        """Render the spans in the Prometheus text exposition format."""
+        snapshot = self._snapshot()
+        lines = ["# TYPE app_span_seconds summary"]
+        for name, (samples, totals) in sorted(snapshot.items()):
+            for q, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+                lines.append(f'app_span_seconds{{span="{name}",quantile="{q / 100}"}} {value}')
+            lines.append(f'app_span_seconds_sum{{span="{name}"}} {totals[2]}')
+            lines.append(f'app_span_seconds_count{{span="{name}"}} {totals[0]}')
+        for metric, index in (('errors', 1), ('documents_read', 3), ('rows', 4), ('bytes', 5)):
+            lines.append(f"# TYPE app_span_{metric}_total counter")
+            for name, (_, totals) in sorted(snapshot.items()):
+                lines.append(f'app_span_{metric}_total{{span="{name}"}} {totals[index]}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._totals.clear()
+
+_recorder = Recorder()
+
+def get_recorder():
+    """Get the recorder shared by every session and thread of the process."""
+    return _recorder
+
+@contextmanager
+def span(name):
+    """Trace a block; yields the span so the block can add documents, rows and bytes."""
+    if not is_enabled():
+        yield NULL_SPAN
+        return
+    parent = getattr(_local, 'span', None)
+    current = _local.span = Span(name, parent)
+    error = False
+    started = time.perf_counter()
+    try:
+        yield current
+    except Exception:
+        # Streamlit's rerun and stop signals are not Exceptions and do not count as errors
+        error = True
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        _local.span = parent
+        if parent is not None:
+            parent.docs += current.docs
+        _recorder.record(current, seconds, error)
+
+def count(docs=0, rows=0, nbytes=0):
+    """Add to the innermost span running on this thread, if any."""
+    current = getattr(_local, 'span', None)
+    if current is not None:
+        current.add(docs, rows, nbytes)
+
+def result_size(result):
+    """Return (rows, bytes) of a traced function's result, where they are cheap to tell."""
+    if isinstance(result, tuple) and result:
+        result = result[0]
+    if isinstance(result, pd.DataFrame):
+        return len(result), int(result.memory_usage().sum())
+    if isinstance(result, (bytes, bytearray)):
+        return 0, len(result)
+    if isinstance(result, list):
+        return len(result), 0
+    if hasattr(result, 'seek') and hasattr(result, 'tell'):
+        position = result.tell()
+        size = result.seek(0, 2)
+        result.seek(position)
+        return 0, size
+    return 0, 0
+
+def traced(name):
+    """Decorate a function to trace each call as a span, counting the rows and bytes it returns."""
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not is_enabled():
+                return function(*args, **kwargs)
+            with span(name) as current:
+                result = function(*args, **kwargs)
+                rows, nbytes = result_size(result)
+                current.add(rows=rows, nbytes=nbytes)
+            return result
+        return wrapper
+    return decorate
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            status, body, content_type = 200, _recorder.prometheus(), 'text/plain; version=0.0.4'
+        else:
+            status, body, content_type = 404, 'not found\n', 'text/plain'
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would fill the log
+        pass
+
+@st.cache_resource
+def _start_metrics_server(port, host):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name='perf-metrics').start()
+    return server
+
+def start_metrics_endpoint():
+    """Serve GET /metrics if [perf] port is set, whether or not tracing is on yet; return the port.
+
+    Called at app start, so scrapers do not wait for an admin to turn
+    tracing on from the Performance page.
+    """
+    config = st.secrets.get('perf', {})
+    port = config.get('port')
+    if port is None:
+        return None
+    _start_metrics_server(int(port), config.get('host', DEFAULT_METRICS_HOST))
+    return int(port)
@@ -0,0 +1,152 @@
+# reading_cache.py
+import streamlit as st
+import threading
+import time
+from storage import get_reading_store, reading_cursor
+from parquet_cache import get_parquet_cache
+from parallel_fetch import fetch_frame
+from reading_frame import as_reading_frame, build_reading_frame, concat_reading_frames
+import perf
+
+# Bound on cached selections
+DEFAULT_MAX_ENTRIES = 32
+# Drop entries that nobody has read for this long
+DEFAULT_TTL_SECONDS = 60 * 60
+# Bound on cached rows across all entries, evicted least recently used first
+DEFAULT_MAX_ROWS = 5_000_000
+# Within this window a rerun is served from memory without asking Firestore for the tail
+DEFAULT_REFRESH_SECONDS = 10
+
+def fetch_after(collection_name, watermark=None, start=None, end=None, sensor_id=None):
+    """Fetch selected readings past the watermark (a timestamp or a reading cursor), oldest first."""
+    records = get_reading_store(collection_name).query(start=start, end=end, sensor_id=sensor_id, after=watermark)
+    perf.count(docs=len(records))
+    return records
+
+def load_history(collection_name, start=None, end=None, sensor_id=None):
+    """Return (frame, watermark) of the selected readings for a cold start.
+
+    Reads the Parquet cache when there is one; otherwise loads the range
+    from the reading store with the parallel fetcher. Readings newer than
+    the watermark are left for fetch_after().
+    """
+    parquet = get_parquet_cache(collection_name)
+    if parquet is not None:
+        frame, watermark = parquet.read(start=start, end=end, sensor_id=sensor_id)
+        if watermark is not None:
+            return as_reading_frame(frame), watermark
+    frame = fetch_frame(collection_name, start=start, end=end, sensor_id=sensor_id)
+    if frame.empty:
+        return frame, None
+    # The frame has no reading IDs: leave its newest timestamp to fetch_after(), which
+    # then also returns readings stored later with that timestamp
+    newest = frame['timestamp'].iloc[-1]
+    return frame[frame['timestamp'] < newest], (newest.to_pydatetime(), frozenset())
+
+class ReadingCache:
+    """Process-wide cache of typed reading frames that only fetches documents newer than its watermark."""
+
+    def __init__(self, ttl_seconds=DEFAULT_TTL_SECONDS, max_rows=DEFAULT_MAX_ROWS,
+                 refresh_seconds=DEFAULT_REFRESH_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.refresh_seconds = refresh_seconds
+        self._entries = {}
+        self._lock = threading.Lock()  # guards the dicts and counters, never held while fetching
+        self._fetch_locks = {}  # key -> lock held while that selection is loaded or refreshed
+        self._stats = {'hits': 0, 'misses': 0, 'incremental_fetches': 0,
+                       'rows_fetched': 0, 'evictions': 0}
+
+    def get_frame(self, collection_name, start=None, end=None, sensor_id=None):
+        """Return the selected readings, loading only what is new since the last call.
+
+        `start`/`end` bound the timestamp range and `sensor_id` picks one sensor;
+        each distinct selection is cached separately. Concurrent calls for one
+        selection share its fetch; other selections are fetched meanwhile.
+        """
+        key = (collection_name, start, end, sensor_id)
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            fetch_lock = self._fetch_locks.setdefault(key, threading.Lock())
+
+        with fetch_lock:
+            with self._lock:
+                now = time.monotonic()
+                entry = self._entries.get(key)
+                self._stats['misses' if entry is None else 'hits'] += 1
+
+            if entry is None:
+                frame, watermark = load_history(collection_name, start=start, end=end, sensor_id=sensor_id)
+                records = fetch_after(collection_name, watermark, start=start, end=end, sensor_id=sensor_id)
+                if records:
+                    frame = concat_reading_frames([frame, build_reading_frame(records)])
+                entry = {'frame': frame, 'watermark': watermark, 'accessed_at': now}
+                with self._lock:
+                    self._entries[key] = entry
+                    self._advance(entry, records, now)
+            elif now - entry['refreshed_at'] >= self.refresh_seconds:
+                records = fetch_after(collection_name, entry['watermark'],
+                                      start=start, end=end, sensor_id=sensor_id)
+                frame = concat_reading_frames([entry['frame'], build_reading_frame(records)]) if records else None
+                with self._lock:
+                    self._stats['incremental_fetches'] += 1
+                    if frame is not None:
+                        entry['frame'] = frame
+                    self._advance(entry, records, now)
+
+            with self._lock:
+                entry['accessed_at'] = now
+                self._evict_oversize()
+                # Callers add and replace columns; a shallow copy keeps the cached frame intact
+                return entry['frame'].copy(deep=False)
+
+    def _advance(self, entry, records, now):
+        """Move the watermark past the records just fetched."""
+        if records:
+            entry['watermark'] = reading_cursor(records, entry['watermark'])
+            self._stats['rows_fetched'] += len(records)
+        entry['refreshed_at'] = now
+
+    def _evict_expired(self, now):
+        """Drop entries that have not been read within the TTL."""
+        for key, entry in list(self._entries.items()):
+            if now - entry['accessed_at'] > self.ttl_seconds:
+                del self._entries[key]
+                self._stats['evictions'] += 1
+        for key, fetch_lock in list(self._fetch_locks.items()):
+            if key not in self._entries and not fetch_lock.locked():
+                del self._fetch_locks[key]
+
+    def _evict_oversize(self):
+        """Drop least recently read entries until the size bounds hold, always keeping the newest one."""
+        by_age = sorted(self._entries.items(), key=lambda item: item[1]['accessed_at'])
+        total_rows = sum(len(entry['frame']) for _, entry in by_age)
+        entries = len(by_age)
+        for key, entry in by_age[:-1]:
+            if total_rows <= self.max_rows and entries <= self.max_entries:
+                break
+            entries -= 1
+            total_rows -= len(entry['frame'])
+            del self._entries[key]
+            self._stats['evictions'] += 1
+
+    def invalidate(self, collection_name=None):
+        """Forget every selection of one collection, or everything when no name is given."""
+        with self._lock:
+            for key in list(self._entries):
+                if collection_name is None or key[0] == collection_name:
+                    del self._entries[key]
+
+    def stats(self):
+        """Return hit/miss counters and the current cache size."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['rows'] = sum(len(entry['frame']) for entry in self._entries.values())
+        return stats
+
+@st.cache_resource
+def get_reading_cache():
+    """Get the reading cache shared by all sessions."""
+    return ReadingCache()
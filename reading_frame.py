@@ -0,0 +1,72 @@
+# reading_frame.py
+"""Compact, typed DataFrames of readings.
+
+Every reading frame has exactly three columns:
+
+- timestamp: datetime64[ns, UTC]
+- sensorID: categorical
+- pressure: float32
+
+Display strings such as `formatted_timestamp` are not stored; create them
+with format_timestamps() for the rows that are actually shown or exported.
+"""
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+READING_COLUMNS = ['timestamp', 'sensorID', 'pressure']
+DEFAULT_TIMEZONE = 'Asia/Singapore'
+TIMESTAMP_FORMAT = '%d/%m/%Y %H:%M'
+
+def empty_reading_frame():
+    """Return a reading frame with no rows."""
+    return pd.DataFrame({
+        'timestamp': pd.Series(dtype='datetime64[ns, UTC]'),
+        'sensorID': pd.Categorical([]),
+        'pressure': pd.Series(dtype=np.float32),
+    })
+
+def build_reading_frame(records):
+    """Build a reading frame straight from reading dicts, one column at a time."""
+    if not records:
+        return empty_reading_frame()
+    timestamps = pd.to_datetime([record.get('timestamp') for record in records], utc=True)
+    pressures = pd.to_numeric([record.get('pressure') for record in records], errors='coerce')
+    return pd.DataFrame({
+        'timestamp': timestamps.as_unit('ns'),
+        'sensorID': pd.Categorical([record.get('sensorID') for record in records]),
+        'pressure': pressures.astype(np.float32),
+    })
+
+def as_reading_frame(df):
+    """Coerce any frame with timestamp, sensorID and pressure columns to a reading frame."""
+    if df.empty:
+        return empty_reading_frame()
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(df['timestamp'], utc=True).dt.as_unit('ns'),
+        'sensorID': df['sensorID'].astype('category'),
+        'pressure': pd.to_numeric(df['pressure'], errors='coerce').astype(np.float32),
+    }).reset_index(drop=True)
+
+def concat_reading_frames(frames):
+    """Concatenate reading frames, merging their sensor categories instead of falling back to objects.
+
+    Extra columns, such as formatted_timestamp on export chunks, are kept.
+    """
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return empty_reading_frame()
+    if len(frames) == 1:
+        return frames[0]
+    sensor_ids = union_categoricals([frame['sensorID'] for frame in frames], ignore_order=True)
+    combined = pd.concat([frame.drop(columns='sensorID') for frame in frames], ignore_index=True)
+    combined.insert(frames[0].columns.get_loc('sensorID'), 'sensorID', sensor_ids)
+    return combined
+
+def format_timestamps(timestamps, tz=DEFAULT_TIMEZONE, fmt=TIMESTAMP_FORMAT):
+    """Format UTC timestamps as local display strings."""
+    return timestamps.dt.tz_convert(tz).dt.strftime(fmt)
+
+def with_formatted_timestamps(df, tz=DEFAULT_TIMEZONE):
+    """Return a copy of a (small) frame with a formatted_timestamp column for display or export."""
+    return df.assign(formatted_timestamp=format_timestamps(df['timestamp'], tz))
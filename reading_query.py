@@ -0,0 +1,51 @@
+# reading_query.py
+"""Translate Regulator page selections into Firestore queries.
+
+Filters run server-side, so only the selected readings are transferred.
+The composite indexes these queries need are declared in
+firestore.indexes.json (deploy with `firebase deploy --only firestore:indexes`):
+
+- sensorID ASC, timestamp ASC: one sensor over a date range
+- sensorID ASC, timestamp DESC: the newest reading of one sensor
+"""
+from google.cloud import firestore
+from firebase_config import get_database
+from sensor_index import known_sensor_ids
+
+def build_reading_query(collection_name, start=None, end=None, sensor_id=None, after=None, db=None):
+    """Build a query for readings in [start, end) of one sensor (or all), oldest first.
+
+    `after` is an exclusive lower bound used to fetch only documents newer than a watermark.
+    A (timestamp, IDs) cursor is an inclusive bound instead; the store drops the IDs it lists.
+    """
+    db = db or get_database()
+    query = db.collection(collection_name)
+    if sensor_id is not None:
+        query = query.where('sensorID', '==', sensor_id)
+    if start is not None:
+        query = query.where('timestamp', '>=', start)
+    if isinstance(after, tuple):
+        query = query.where('timestamp', '>=', after[0])
+    elif after is not None:
+        query = query.where('timestamp', '>', after)
+    if end is not None:
+        query = query.where('timestamp', '<', end)
+    return query.order_by('timestamp')
+
+def _edge_timestamp(collection_name, direction, db):
+    """Return the timestamp of the first document in the given direction, or None."""
+    docs = db.collection(collection_name).order_by('timestamp', direction=direction).limit(1).get()
+    return docs[0].to_dict().get('timestamp') if docs else None
+
+def fetch_date_bounds(collection_name, db=None):
+    """Return (oldest, newest) reading timestamps with two single-document reads, or None if empty."""
+    db = db or get_database()
+    oldest = _edge_timestamp(collection_name, firestore.Query.ASCENDING, db)
+    if oldest is None:
+        return None
+    newest = _edge_timestamp(collection_name, firestore.Query.DESCENDING, db)
+    return oldest, newest
+
+def fetch_sensor_ids(collection_name, db=None):
+    """Return the distinct sensor IDs from the collection's latest-per-sensor index, one document per sensor."""
+    return known_sensor_ids(collection_name, db)
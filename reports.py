@@ -0,0 +1,211 @@
+# reports.py
+"""PDF reports for reading data, built in a background worker.
+
+A report opens with a per-sensor summary table and a downsampled chart.
+Raw readings only go into an optional appendix that is capped at
+`max_rows`; those rows are formatted column-wise up front and written
+one line per row. Readings are streamed in chunks, so a report never
+holds more than one chunk, the chart points and the appendix rows.
+"""
+import streamlit as st
+import os
+import tempfile
+import threading
+import time
+import uuid
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from fpdf import FPDF
+from downsample import downsample
+from reading_frame import DEFAULT_TIMEZONE, concat_reading_frames
+
+# Raw rows allowed in the appendix before it is truncated
+DEFAULT_MAX_ROWS = 2000
+# Points drawn in the report chart
+CHART_POINTS = 1000
+# Appendix rows written between progress updates
+ROW_BATCH = 200
+# Reports built at the same time across all sessions
+MAX_WORKERS = 2
+# Finished reports nobody collected are dropped after this long
+JOB_TTL_SECONDS = 15 * 60
+# Jobs kept across all sessions; the oldest finished ones go first
+MAX_JOBS = 32
+
+def summary_table(df):
+    """Return count, mean, min, max and std of pressure per sensor."""
+    summary = df.groupby('sensorID', observed=True)['pressure'].agg(['count', 'mean', 'min', 'max', 'std'])
+    return summary.reset_index()
+
+def _chart_image(chart_df, path, tz=DEFAULT_TIMEZONE):
+    """Render already downsampled readings as a pressure chart to a PNG file."""
+    # A Figure of its own, not pyplot: reports are drawn on worker threads
+    fig = Figure(figsize=(10, 4), dpi=100)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    for sensor_id, series in chart_df.groupby('sensorID', observed=True):
+        ax.plot(series['timestamp'].dt.tz_convert(tz), series['pressure'], linewidth=0.8, label=str(sensor_id))
+    ax.set_xlabel('Timestamp')
+    ax.set_ylabel('Pressure')
+    if chart_df['sensorID'].nunique() <= 10:
+        ax.legend(fontsize=7)
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    fig.savefig(path, format='png')
+
+def _format_rows(df, columns, width):
+    """Format every row as one fixed-width line, a column at a time."""
+    lines = pd.Series('', index=df.index)
+    for column in columns:
+        values = df[column]
+        if pd.api.types.is_float_dtype(values):
+            text = values.map('{:.2f}'.format)
+        else:
+            text = values.astype(str)
+        lines = lines + text.str.slice(0, width - 1).str.ljust(width)
+    return lines.tolist()
+
+def _latin1(text):
+    """Replace characters the core PDF fonts cannot encode."""
+    return str(text).encode('latin1', 'replace').decode('latin1')
+
+def build_pdf_report(chunks, summary, title="Filtered Data", columns=('formatted_timestamp', 'sensorID', 'pressure'),
+                     include_appendix=False, max_rows=DEFAULT_MAX_ROWS, tz=DEFAULT_TIMEZONE, progress=None):
+    """Build a PDF report from reading chunks in timestamp order and return its bytes.
+
+    `summary` is the per-sensor table of summary_table() for the same
+    readings, e.g. from the rollups. `progress`, if given, is called with a
+    fraction between 0 and 1.
+    """
+    def report(fraction):
+        if progress:
+            progress(fraction)
+
+    # One pass over the chunks: chart points are re-downsampled as they
+    # accumulate, and only the first max_rows rows are kept for the appendix
+    total = int(summary['count'].sum())
+    chart_df, rows, seen = None, [], 0
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        seen += len(chunk)
+        points = chunk if chart_df is None else concat_reading_frames([chart_df, chunk])
+        chart_df = downsample(points, points['timestamp'].min(), points['timestamp'].max(), max_points=CHART_POINTS)
+        if include_appendix and sum(len(part) for part in rows) < max_rows:
+            rows.append(chunk.head(max_rows - sum(len(part) for part in rows)))
+        report(0.6 * min(1.0, seen / max(1, total)))
+    total = max(total, seen)
+
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+    pdf.set_font("Arial", 'B', size=14)
+    pdf.cell(0, 10, txt=_latin1(title), ln=True, align='C')
+    pdf.set_font("Arial", size=10)
+    pdf.cell(0, 8, txt=f"{total} readings from {len(summary)} sensors", ln=True, align='C')
+
+    # Summary table
+    pdf.set_font("Arial", 'B', size=10)
+    for header in ['Sensor', 'Count', 'Mean', 'Min', 'Max', 'Std']:
+        pdf.cell(31, 8, txt=header, border=1)
+    pdf.ln()
+    pdf.set_font("Arial", size=10)
+    for sensor_id, count, *values in summary.itertuples(index=False, name=None):
+        pdf.cell(31, 8, txt=_latin1(sensor_id), border=1)
+        pdf.cell(31, 8, txt=str(count), border=1)
+        for value in values:
+            pdf.cell(31, 8, txt='' if pd.isna(value) else f"{value:.2f}", border=1)
+        pdf.ln()
+
+    # Chart
+    if chart_df is not None:
+        fd, chart_path = tempfile.mkstemp(suffix='.png')
+        os.close(fd)
+        try:
+            _chart_image(chart_df, chart_path, tz)
+            pdf.ln(5)
+            pdf.image(chart_path, w=190)
+        finally:
+            os.remove(chart_path)
+    report(0.7)
+
+    # Appendix of raw rows
+    if include_appendix:
+        rows = concat_reading_frames(rows)
+        width = 30
+        pdf.add_page()
+        pdf.set_font("Courier", 'B', size=9)
+        pdf.cell(0, 6, txt=''.join(column.ljust(width) for column in columns), ln=True)
+        pdf.set_font("Courier", size=9)
+        lines = _format_rows(rows, columns, width)
+        for start in range(0, len(lines), ROW_BATCH):
+            for line in lines[start:start + ROW_BATCH]:
+                pdf.cell(0, 5, txt=_latin1(line), ln=True)
+            report(0.7 + 0.3 * min(1.0, (start + ROW_BATCH) / max(1, len(lines))))
+        if total > max_rows:
+            pdf.set_font("Arial", 'I', size=9)
+            pdf.cell(0, 8, txt=f"Appendix truncated to {max_rows} of {total} rows; use the CSV export for all rows.", ln=True)
+
+    data = pdf.output(dest='S').encode('latin1')
+    report(1.0)
+    return data
+
+class ReportJobs:
+    """Bounded worker pool that builds reports and tracks their progress."""
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, build, *args, **kwargs):
+        """Start `build(*args, progress=..., **kwargs)` in the pool and return a job ID."""
+        job_id = uuid.uuid4().hex
+        job = {'progress': 0.0, 'submitted_at': time.monotonic()}
+
+        def set_progress(fraction):
+            job['progress'] = fraction
+
+        job['future'] = self._executor.submit(build, *args, progress=set_progress, **kwargs)
+        job['future'].add_done_callback(lambda _: job.__setitem__('finished_at', time.monotonic()))
+        with self._lock:
+            self._jobs[job_id] = job
+            self._prune()
+        return job_id
+
+    def _prune(self):
+        """Drop finished jobs past their TTL, then the oldest finished ones beyond MAX_JOBS."""
+        now = time.monotonic()
+        for job_id, job in list(self._jobs.items()):
+            if now - job.get('finished_at', now) > JOB_TTL_SECONDS:
+                del self._jobs[job_id]
+        finished = sorted((job['finished_at'], job_id) for job_id, job in self._jobs.items() if 'finished_at' in job)
+        for _, job_id in finished[:max(0, len(self._jobs) - MAX_JOBS)]:
+            del self._jobs[job_id]
+
+    def status(self, job_id):
+        """Return (progress, result, error) of a job; result and error are None while it runs."""
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        future = job['future']
+        if not future.done():
+            return job['progress'], None, None
+        error = future.exception()
+        return 1.0, None if error else future.result(), error
+
+    def discard(self, job_id):
+        """Forget a finished or abandoned job."""
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None:
+            job['future'].cancel()
+
+@st.cache_resource
+def get_report_jobs():
+    """Get the report worker pool shared by all sessions."""
+    return ReportJobs()
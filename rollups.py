@@ -0,0 +1,330 @@
+# rollups.py
+"""Per-sensor pressure rollups at minute, hour and day resolution.
+
+Each bucket keeps count, sum, sum of squares, min and max, which merge by
+addition. Approximate quantiles such as the median come from one t-digest
+per sensor and day, kept for DIGEST_RETENTION. Rollups are built
+incrementally from readings newer than the store's watermark, so
+statistics and long-range charts read a few hundred buckets instead of
+every raw reading.
+"""
+import streamlit as st
+import numpy as np
+import pandas as pd
+import bisect
+import threading
+import time
+from collections import Counter
+from reading_cache import fetch_after, load_history
+from reading_frame import build_reading_frame
+from storage import cursor_timestamp, reading_cursor
+
+# Finest to coarsest: name -> pandas frequency
+RESOLUTIONS = {'1m': '1min', '1h': '1h', '1d': '1D'}
+# Buckets older than this (relative to the newest reading) are dropped; a cold
+# start loads only the readings the coarsest resolution still keeps
+RETENTION = {'1m': pd.Timedelta(days=2), '1h': pd.Timedelta(days=90), '1d': pd.Timedelta(days=5 * 365)}
+# Day digests older than this are dropped; one per sensor and day bounds their number
+DIGEST_RETENTION = pd.Timedelta(days=366)
+# The cold start folds in history one window at a time instead of in one frame
+COLD_START_WINDOW = pd.Timedelta(days=30)
+# Buckets are aligned to local midnight so whole-day ranges read day rollups
+DEFAULT_TIMEZONE = 'Asia/Singapore'
+# Within this window the store does not ask Firestore for new readings
+REFRESH_SECONDS = 10
+# Readings added in-process but not yet seen by refresh(); beyond this add() leaves them to refresh()
+MAX_PENDING = 500_000
+
+class TDigest:
+    """Mergeable quantile sketch (merging t-digest with the arcsine scale function)."""
+
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+
+    def update(self, values):
+        """Add raw values."""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        self._compress(values, np.ones(len(values)))
+
+    def merge(self, other):
+        """Add every value summarized by another digest."""
+        self._compress(other.means, other.weights)
+
+    def _compress(self, means, weights):
+        """Merge new centroids and collapse neighbours whose combined size the scale function allows."""
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        if len(means) == 0:
+            return
+        order = np.argsort(means, kind='mergesort')
+        means, weights = means[order], weights[order]
+        q = (np.cumsum(weights) - weights / 2) / weights.sum()
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+        groups = np.floor(k - k.min()).astype(np.int64)
+        group_weights = np.bincount(groups, weights)
+        nonempty = group_weights > 0
+        self.means = (np.bincount(groups, weights * means)[nonempty] / group_weights[nonempty])
+        self.weights = group_weights[nonempty]
+
+    def quantile(self, q):
+        """Return the approximate q-quantile, or NaN if the digest is empty."""
+        if len(self.means) == 0:
+            return float('nan')
+        positions = (np.cumsum(self.weights) - self.weights / 2) / self.weights.sum()
+        return float(np.interp(q, positions, self.means))
+
+def _aggregate(df, freq):
+    """Aggregate readings to one row per (sensorID, bucket)."""
+    keys = [df['sensorID'], df['timestamp'].dt.floor(freq).rename('bucket')]
+    pressure = df['pressure'].astype(np.float64)
+    table = pressure.groupby(keys, observed=True).agg(['count', 'sum', 'min', 'max'])
+    table['sumsq'] = (pressure ** 2).groupby(keys, observed=True).sum()
+    return table
+
+def _combine(table, new):
+    """Merge two rollup tables, adding counts and sums and keeping extremes."""
+    if table is None or table.empty:
+        return new
+    both = pd.concat([table, new])
+    if not both.index.has_duplicates:
+        return both.sort_index()
+    return both.groupby(level=[0, 1]).agg(
+        {'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max', 'sumsq': 'sum'})
+
+def _aligned(timestamp, freq):
+    """Whether a timestamp lies on a bucket boundary of the given frequency."""
+    return timestamp == timestamp.floor(freq)
+
+def _reading_keys(df):
+    """Return (timestamp ns, sensorID, pressure) of every row, to recognise the same reading twice."""
+    return list(zip(df['timestamp'].to_numpy().astype('datetime64[ns]').astype(np.int64),
+                    df['sensorID'].astype(str), df['pressure'].astype(np.float32)))
+
+class RollupStore:
+    """Incrementally maintained rollups of one readings collection."""
+
+    def __init__(self, collection_name, tz=DEFAULT_TIMEZONE):
+        self.collection_name = collection_name
+        self.tz = tz
+        self._tables = {name: None for name in RESOLUTIONS}
+        self._digests = {}  # day bucket -> {sensorID: TDigest}
+        self._digest_days = []  # the keys of _digests, oldest first
+        self._oldest = {name: None for name in RESOLUTIONS}  # oldest bucket kept per resolution
+        self._watermark = None
+        self._pending = Counter()  # keys of added readings newer than the watermark
+        self._newest = None
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+
+    def add(self, df):
+        """Fold a writer's new readings into every resolution right away.
+
+        Used by in-process writers such as the ingestion pipeline. The
+        watermark stays where it is, since other writers may have stored
+        older readings in between; refresh() still fetches past it and skips
+        the readings it has already been given here. Before the first
+        refresh the readings are skipped; the cold start loads them from
+        the store.
+        """
+        with self._lock:
+            if self._refreshed_at is None or df.empty:
+                return
+            df = df.dropna(subset=['timestamp', 'sensorID', 'pressure'])
+            if self._watermark is not None:
+                # Readings before the watermark are never fetched, so nothing would skip them
+                df = df[df['timestamp'] >= pd.Timestamp(cursor_timestamp(self._watermark))]
+            if df.empty or len(self._pending) + len(df) > MAX_PENDING:
+                return
+            self._pending.update(_reading_keys(df))
+            self._add(df)
+
+    def _add(self, df):
+        if df.empty:
+            return
+        df = df.dropna(subset=['timestamp', 'sensorID', 'pressure'])
+        if df.empty:
+            return
+        df = df.assign(timestamp=pd.to_datetime(df['timestamp'], utc=True).dt.tz_convert(self.tz))
+        newest = df['timestamp'].max()
+        self._newest = newest if self._newest is None else max(self._newest, newest)
+
+        for name, freq in RESOLUTIONS.items():
+            # Fine resolutions only aggregate the recent readings they keep
+            retention = RETENTION[name]
+            part = df if retention is None else df[df['timestamp'] >= self._newest - retention]
+            if part.empty:
+                continue
+            self._tables[name] = _combine(self._tables[name], _aggregate(part, freq))
+            oldest = part['timestamp'].min().floor(freq)
+            if self._oldest[name] is None or oldest < self._oldest[name]:
+                self._oldest[name] = oldest
+
+        part = df[df['timestamp'] >= self._newest - DIGEST_RETENTION]
+        days = part['timestamp'].dt.floor(RESOLUTIONS['1d'])
+        for (sensor_id, day), values in part['pressure'].groupby([part['sensorID'], days], observed=True):
+            digests = self._digests.get(day)
+            if digests is None:
+                digests = self._digests[day] = {}
+                bisect.insort(self._digest_days, day)
+            digests.setdefault(sensor_id, TDigest()).update(values.to_numpy())
+        self._apply_retention()
+
+    def _apply_retention(self):
+        """Drop buckets and day digests that fall outside their retention window."""
+        for name, retention in RETENTION.items():
+            table = self._tables[name]
+            cutoff = self._newest - retention
+            # Nothing to drop until the cutoff passes the oldest bucket; spares a scan of the table
+            if table is None or self._oldest[name] is None or self._oldest[name] >= cutoff:
+                continue
+            buckets = table.index.get_level_values('bucket')
+            table = self._tables[name] = table[buckets >= cutoff]
+            self._oldest[name] = table.index.get_level_values('bucket').min() if len(table) else None
+        cutoff = self._newest - DIGEST_RETENTION
+        while self._digest_days and self._digest_days[0] < cutoff:
+            del self._digests[self._digest_days.pop(0)]
+
+    def refresh(self):
+        """Fold readings newer than the watermark into the rollups."""
+        with self._lock:
+            now = time.monotonic()
+            if self._refreshed_at is not None and now - self._refreshed_at < REFRESH_SECONDS:
+                return
+            if self._refreshed_at is None:
+                self._cold_start()
+            records = fetch_after(self.collection_name, self._watermark)
+            if records:
+                self._add(self._unseen(build_reading_frame(records)))
+                self._watermark = reading_cursor(records, self._watermark)
+                watermark = pd.Timestamp(cursor_timestamp(self._watermark)).value
+                self._pending = Counter({key: n for key, n in self._pending.items() if n > 0 and key[0] >= watermark})
+            self._refreshed_at = now
+
+    def _cold_start(self):
+        """Fold in the retained history a window at a time, then leave only the tail to fetch."""
+        now = pd.Timestamp.now(tz='UTC')
+        start = now - max(RETENTION.values())
+        while start + COLD_START_WINDOW < now:
+            end = start + COLD_START_WINDOW
+            history, watermark = load_history(self.collection_name, start=start.to_pydatetime(),
+                                              end=end.to_pydatetime())
+            self._add(history)
+            # Readings of the window past the history's watermark
+            self._add(build_reading_frame(fetch_after(self.collection_name, watermark, start=start.to_pydatetime(),
+                                                      end=end.to_pydatetime())))
+            start = end
+        history, watermark = load_history(self.collection_name, start=start.to_pydatetime())
+        self._add(history)
+        # An empty tail still leaves refresh() to fetch from the last window on, not from the beginning
+        self._watermark = watermark if watermark is not None else (start.to_pydatetime(), frozenset())
+
+    def _unseen(self, df):
+        """Drop fetched readings that add() has already folded in, once each."""
+        if not self._pending:
+            return df
+        keep = np.ones(len(df), dtype=bool)
+        for row, key in enumerate(_reading_keys(df)):
+            if self._pending[key] > 0:
+                self._pending[key] -= 1
+                keep[row] = False
+        return df[keep]
+
+    def _select(self, name, start, end, sensor_id):
+        """Return rollup rows of one resolution in [start, end), optionally for one sensor."""
+        table = self._tables[name]
+        if table is None:
+            index = pd.MultiIndex.from_arrays([[], []], names=['sensorID', 'bucket'])
+            return pd.DataFrame(columns=['count', 'sum', 'min', 'max', 'sumsq'], index=index)
+        buckets = table.index.get_level_values('bucket')
+        mask = (buckets >= start) & (buckets < end)
+        if sensor_id is not None:
+            mask &= table.index.get_level_values('sensorID') == sensor_id
+        return table[mask]
+
+    def _covers(self, name, start):
+        """Whether a resolution still keeps the buckets from start on."""
+        retention = RETENTION[name]
+        return retention is None or self._newest is None or start >= self._newest - retention
+
+    def _covering(self, start):
+        """Resolutions that keep the buckets from start on, finest first; the coarsest if none does."""
+        return [name for name in RESOLUTIONS if self._covers(name, start)] or [list(RESOLUTIONS)[-1]]
+
+    def _stats_resolution(self, start, end):
+        """Coarsest retained resolution whose buckets tile [start, end) exactly."""
+        covering = self._covering(start)
+        for name in reversed(covering):
+            freq = RESOLUTIONS[name]
+            if _aligned(start, freq) and _aligned(end, freq):
+                return name
+        return covering[0]
+
+    def summarize(self, start, end, sensor_id=None):
+        """Return count, mean, std, median, min and max of pressure in [start, end).
+
+        The median is NaN for ranges older than DIGEST_RETENTION.
+        """
+        with self._lock:
+            name = self._stats_resolution(start, end)
+            rows = self._select(name, start, end, sensor_id)
+            digest = TDigest()
+            # Day digests of the days the range touches; exact for whole days, which the Regulator asks for
+            first = bisect.bisect_left(self._digest_days, pd.Timestamp(start).floor(RESOLUTIONS['1d']))
+            for day in self._digest_days[first:bisect.bisect_left(self._digest_days, end)]:
+                for digest_sensor, day_digest in self._digests[day].items():
+                    if sensor_id is None or digest_sensor == sensor_id:
+                        digest.merge(day_digest)
+
+        count = int(rows['count'].sum())
+        if count == 0:
+            return {'count': 0, 'mean': float('nan'), 'std': float('nan'),
+                    'median': float('nan'), 'min': float('nan'), 'max': float('nan')}
+        total = rows['sum'].sum()
+        mean = total / count
+        # Sample standard deviation, like DataFrame.std
+        variance = (rows['sumsq'].sum() - count * mean ** 2) / (count - 1) if count > 1 else float('nan')
+        return {
+            'count': count,
+            'mean': mean,
+            'std': float(np.sqrt(max(variance, 0.0))) if count > 1 else float('nan'),
+            'median': digest.quantile(0.5),
+            'min': rows['min'].min(),
+            'max': rows['max'].max(),
+        }
+
+    def sensor_summary(self, start, end, sensor_id=None):
+        """Return count, mean, min, max and std of pressure per sensor in [start, end), like reports.summary_table."""
+        with self._lock:
+            rows = self._select(self._stats_resolution(start, end), start, end, sensor_id)
+        table = rows.groupby(level='sensorID', observed=True).agg(
+            {'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max', 'sumsq': 'sum'})
+        table = table[table['count'] > 0]
+        count = table['count'].to_numpy(dtype=np.float64)
+        mean = table['sum'].to_numpy(dtype=np.float64) / count
+        # Sample standard deviation, like DataFrame.std
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = (table['sumsq'].to_numpy(dtype=np.float64) - count * mean ** 2) / (count - 1)
+        std = np.where(count > 1, np.sqrt(np.maximum(variance, 0.0)), np.nan)
+        return pd.DataFrame({'sensorID': table.index.to_numpy(), 'count': count.astype(np.int64), 'mean': mean,
+                             'min': table['min'].to_numpy(), 'max': table['max'].to_numpy(), 'std': std})
+
+    def series(self, start, end, sensor_id=None, max_buckets=500):
+        """Return per-bucket pressure mean/min/max at the finest retained resolution that fits max_buckets."""
+        span = pd.Timestamp(end) - pd.Timestamp(start)
+        with self._lock:
+            covering = self._covering(pd.Timestamp(start))
+            name = next((name for name in covering
+                         if span / pd.Timedelta(RESOLUTIONS[name]) <= max_buckets), covering[-1])
+            rows = self._select(name, start, end, sensor_id)
+        frame = rows.reset_index().rename(columns={'bucket': 'timestamp'})
+        frame['pressure_mean'] = frame['sum'] / frame['count']
+        frame = frame.rename(columns={'min': 'pressure_min', 'max': 'pressure_max'})
+        return frame[['timestamp', 'sensorID', 'pressure_mean', 'pressure_min', 'pressure_max', 'count']]
+
+@st.cache_resource
+def get_rollup_store(collection_name, tz=DEFAULT_TIMEZONE):
+    """Get the rollup store of a collection, with days in its site's timezone, shared by all sessions."""
+    return RollupStore(collection_name, tz)
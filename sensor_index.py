@@ -0,0 +1,177 @@
+# sensor_index.py
+import streamlit as st
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from google.cloud import firestore
+from firebase_config import get_database
+
+# Materialized latest reading per sensor, one index per readings collection (and so per site);
+# the document ID is the sensorID
+LATEST_COLLECTION = 'sensor_latest'
+
+# Upper bound on concurrent limit(1) queries in the fallback path
+MAX_FALLBACK_WORKERS = 16
+# How often an index that writers do not maintain is checked for new sensors
+DISCOVERY_SECONDS = 5 * 60
+
+_discovered_at = {}  # collection name -> time.monotonic() of its last discovery
+_discovery_lock = threading.Lock()
+
+def index_maintained_on_write():
+    """Whether every writer keeps the index current, set via [sensor_index] in secrets.
+
+    Until then the index only serves as the registry of known sensors, and
+    sensors that started reporting since are added every DISCOVERY_SECONDS.
+    """
+    return bool(st.secrets.get('sensor_index', {}).get('maintained_on_write', False))
+
+def latest_index(collection_name, db):
+    """Return the index collection of a readings collection."""
+    return db.collection(LATEST_COLLECTION).document(collection_name).collection('sensors')
+
+def update_latest(collection_name, reading, db=None):
+    """Record a reading in the collection's latest-per-sensor index if it is newer than the stored one.
+
+    Writers call this after storing a reading in the readings collection.
+    """
+    db = db or get_database()
+    sensor_id = reading.get('sensorID')
+    if not sensor_id:
+        return False
+    doc_ref = latest_index(collection_name, db).document(sensor_id)
+
+    @firestore.transactional
+    def _update(transaction):
+        snapshot = doc_ref.get(transaction=transaction)
+        if snapshot.exists:
+            current = snapshot.to_dict().get('timestamp')
+            if current is not None and current >= reading['timestamp']:
+                return False
+        transaction.set(doc_ref, reading)
+        return True
+
+    return _update(db.transaction())
+
+def fetch_latest_from_index(collection_name, db=None):
+    """Return the indexed latest reading for every sensor of a collection, one document per sensor."""
+    db = db or get_database()
+    return [doc.to_dict() for doc in latest_index(collection_name, db).stream()]
+
+def known_sensor_ids(collection_name, db=None):
+    """Return the IDs of all sensors of a collection present in the index without reading their data."""
+    db = db or get_database()
+    return sorted(doc.id for doc in latest_index(collection_name, db).list_documents())
+
+def _fetch_sensor_latest(db, collection_name, sensor_id):
+    """Fetch the newest reading of one sensor with a bounded query."""
+    # Needs the composite index (sensorID ASC, timestamp DESC)
+    query = (
+        db.collection(collection_name)
+        .where('sensorID', '==', sensor_id)
+        .order_by('timestamp', direction=firestore.Query.DESCENDING)
+        .limit(1)
+    )
+    docs = query.get()
+    return docs[0].to_dict() if docs else None
+
+def fetch_latest_per_sensor(collection_name, sensor_ids, db=None):
+    """Fetch the latest reading of each given sensor with one limit(1) query per sensor, in parallel."""
+    db = db or get_database()
+    if not sensor_ids:
+        return []
+    workers = min(MAX_FALLBACK_WORKERS, len(sensor_ids))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda sensor_id: _fetch_sensor_latest(db, collection_name, sensor_id), sensor_ids)
+        return [record for record in results if record]
+
+def _discovery_due(collection_name):
+    """Whether this process should look for new sensors of a collection now; claims the slot if so."""
+    with _discovery_lock:
+        now = time.monotonic()
+        last = _discovered_at.get(collection_name)
+        if last is not None and now - last < DISCOVERY_SECONDS:
+            return False
+        _discovered_at[collection_name] = now
+        return True
+
+def discover_sensors(collection_name, records, db=None):
+    """Add sensors that reported since the last discovery to the index; return their readings.
+
+    Only readings newer than the stored `discovered_through` mark are
+    scanned, or, before the first discovery, newer than the newest
+    indexed reading.
+    """
+    db = db or get_database()
+    parent = db.collection(LATEST_COLLECTION).document(collection_name)
+    snapshot = parent.get()
+    since = snapshot.to_dict().get('discovered_through') if snapshot.exists else None
+    if since is None:
+        since = max((record['timestamp'] for record in records if record.get('timestamp') is not None), default=None)
+    query = db.collection(collection_name)
+    if since is not None:
+        query = query.where('timestamp', '>', since)
+
+    known = {record.get('sensorID') for record in records}
+    found = {}
+    newest = since
+    for doc in query.order_by('timestamp').stream():
+        record = doc.to_dict()
+        newest = record['timestamp']
+        sensor_id = record.get('sensorID')
+        if sensor_id and sensor_id not in known:
+            found[sensor_id] = record
+
+    batch = db.batch()
+    for count, (sensor_id, record) in enumerate(found.items(), start=1):
+        batch.set(latest_index(collection_name, db).document(sensor_id), record)
+        if count % 500 == 0:
+            batch.commit()
+            batch = db.batch()
+    if newest is not None:
+        batch.set(parent, {'discovered_through': newest}, merge=True)
+    batch.commit()
+    return list(found.values())
+
+def fetch_latest_records(collection_name, db=None):
+    """Return the latest reading of every sensor, reading O(sensors) documents."""
+    db = db or get_database()
+    records = fetch_latest_from_index(collection_name, db)
+    if not records:
+        # First run against an existing collection: build the index once
+        return rebuild_latest_index(collection_name, db)
+    if not index_maintained_on_write():
+        # Nobody adds new sensors to the index; look for them now and then
+        if _discovery_due(collection_name):
+            records += discover_sensors(collection_name, records, db)
+        # Index only lists the sensors; ask each one for its newest reading
+        sensor_ids = [record['sensorID'] for record in records]
+        return fetch_latest_per_sensor(collection_name, sensor_ids, db)
+    return records
+
+def rebuild_latest_index(collection_name, db=None):
+    """Backfill the index from the full readings collection.
+
+    This is the only O(history) operation here; run it once for an existing collection.
+    """
+    db = db or get_database()
+    latest = {}
+    for doc in db.collection(collection_name).stream():
+        record = doc.to_dict()
+        sensor_id = record.get('sensorID')
+        if not sensor_id or record.get('timestamp') is None:
+            continue
+        if sensor_id not in latest or record['timestamp'] > latest[sensor_id]['timestamp']:
+            latest[sensor_id] = record
+
+    batch = db.batch()
+    for count, (sensor_id, record) in enumerate(latest.items(), start=1):
+        batch.set(latest_index(collection_name, db).document(sensor_id), record)
+        if count % 500 == 0:
+            batch.commit()
+            batch = db.batch()
+    if latest:
+        newest = max(record['timestamp'] for record in latest.values())
+        batch.set(db.collection(LATEST_COLLECTION).document(collection_name), {'discovered_through': newest}, merge=True)
+    batch.commit()
+    return list(latest.values())
@@ -0,0 +1,135 @@
+# session.py
+"""Signed session tokens shared by all pages.
+
+After a successful login the session holds a JWT carrying the user's
+username and role claims. Pages verify it locally on every rerun, so
+checking who is logged in, or whether they are an admin, never reads the
+user store. A token is refreshed, with the user's current roles, while
+the user is active, up to MAX_SESSION_SECONDS after login.
+
+Set the signing key in `.streamlit/secrets.toml`; without one, a random key
+is generated per process:
+
+    [auth]
+    jwt_secret = "..."
+"""
+import streamlit as st
+import secrets
+import time
+import jwt
+import audit
+from login import LoginThrottled, authenticate, get_auth_service
+
+SESSION_KEY = 'session_token'
+ALGORITHM = 'HS256'
+# Lifetime of one token
+TOKEN_TTL_SECONDS = 30 * 60
+# Tokens closer than this to expiry are replaced on the next rerun
+REFRESH_WITHIN_SECONDS = 10 * 60
+# Tokens are not refreshed past this long after login
+MAX_SESSION_SECONDS = 12 * 60 * 60
+# User fields copied into the token
+ROLE_CLAIMS = ('name', 'email', 'is_admin', 'sites')
+
+@st.cache_resource
+def _generated_secret():
+    return secrets.token_urlsafe(32)
+
+def signing_key():
+    """Return the configured JWT signing key, or this process's generated one."""
+    return st.secrets.get('auth', {}).get('jwt_secret') or _generated_secret()
+
+def issue_token(username, user_data, auth_time=None, now=None):
+    """Return a signed token for a user, with their role claims."""
+    now = int(now or time.time())
+    claims = {key: user_data.get(key) for key in ROLE_CLAIMS if key in user_data}
+    claims.update(sub=username, iat=now, exp=now + TOKEN_TTL_SECONDS, auth_time=int(auth_time or now))
+    return jwt.encode(claims, signing_key(), algorithm=ALGORITHM)
+
+def verify_token(token):
+    """Return a token's claims, or None if it is invalid or expired."""
+    try:
+        return jwt.decode(token, signing_key(), algorithms=[ALGORITHM], options={'require': ['sub', 'exp']})
+    except jwt.InvalidTokenError:
+        return None
+
+def start_session(username, user_data):
+    """Log the current session in as a user."""
+    st.session_state[SESSION_KEY] = issue_token(username, user_data)
+
+def end_session():
+    """Log the current session out."""
+    st.session_state.pop(SESSION_KEY, None)
+
+def current_user():
+    """Return the logged-in user's claims, refreshing the token if it is close to expiry, or None."""
+    token = st.session_state.get(SESSION_KEY)
+    if not token:
+        return None
+    claims = verify_token(token)
+    if claims is None:
+        end_session()
+        return None
+    now = time.time()
+    auth_time = claims.get('auth_time', claims.get('iat', now))
+    if claims['exp'] - now < REFRESH_WITHIN_SECONDS and now - auth_time < MAX_SESSION_SECONDS:
+        # The only user lookup of a session after login, so role changes, removals and disabling take effect
+        user_data = get_auth_service().get_user(claims['sub'])
+        if not user_data or user_data.get('disabled'):
+            end_session()
+            return None
+        token = issue_token(claims['sub'], user_data, auth_time=auth_time, now=now)
+        st.session_state[SESSION_KEY] = token
+        claims = verify_token(token)
+    return claims
+
+def is_logged_in():
+    """Check if the user is logged in."""
+    return current_user() is not None
+
+def is_admin():
+    """Check if the logged-in user is an admin."""
+    user = current_user()
+    return bool(user and user.get('is_admin'))
+
+def show_login_form(message="Please log in to continue."):
+    """Render the shared login form; return True once the session is logged in."""
+    st.write(message)
+    with st.form("login_form"):
+        username = st.text_input("Username")
+        password = st.text_input("Password", type="password")
+        login_button = st.form_submit_button("Login")
+
+    if login_button:
+        try:
+            user_data = authenticate(username, password)
+        except LoginThrottled as error:
+            st.error(str(error))
+            return False
+        if user_data:
+            start_session(username, user_data)
+            return True
+        st.error("Invalid credentials. Please try again.")
+    return False
+
+def show_logout_button():
+    """Render a sidebar button that ends the session."""
+    user = current_user()
+    if user is None:
+        return
+    st.sidebar.caption(f"Logged in as {user.get('name') or user['sub']}")
+    if st.sidebar.button("Log out", key='logout'):
+        audit.record('logout', user['sub'])
+        end_session()
+        st.rerun()
+
+def require_login(title="Login", message="Please log in to continue."):
+    """Return the logged-in user's claims, or show the login form and stop the script."""
+    user = current_user()
+    if user is None:
+        st.title(title)
+        if show_login_form(message):
+            st.rerun()
+        st.stop()
+    show_logout_button()
+    return user
@@ -0,0 +1,93 @@
+# sites.py
+"""Sites, their reading collections and timezones, and who may see them.
+
+Every site keeps its readings in a collection of its own, so one site's
+writes and reads never contend with another's, and the stores, caches,
+rollups and live feeds that are already kept per collection work per site
+as they are. Sites are set in `.streamlit/secrets.toml`:
+
+    [sites.SG]
+    name = "Singapore"
+    collection = "iot_gateway_reading"
+    timezone = "Asia/Singapore"
+
+    [sites.SYD]
+    name = "Sydney"
+    collection = "iot_gateway_reading_syd"
+    timezone = "Australia/Sydney"
+
+Without a [sites] section there is a single site on the original
+collection. A user record may list the `sites` the user may see; admins
+and users without the field see every site. Queries fan out in parallel
+across the sites a user may see and nothing else, and their results are
+merged into one frame with a categorical `site` column.
+"""
+import streamlit as st
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from reading_frame import TIMESTAMP_FORMAT, concat_reading_frames
+
+Site = namedtuple('Site', ['id', 'name', 'collection', 'timezone'])
+
+DEFAULT_SITE = Site('SG', 'Singapore', 'iot_gateway_reading', 'Asia/Singapore')
+# Sites queried at the same time
+FAN_OUT_WORKERS = 8
+
+def get_sites():
+    """Return {site ID: Site} from the [sites] secrets, in the order they are configured."""
+    config = st.secrets.get('sites', {})
+    if not config:
+        return {DEFAULT_SITE.id: DEFAULT_SITE}
+    return {
+        site_id: Site(site_id, site.get('name', site_id),
+                      site.get('collection', f"{DEFAULT_SITE.collection}_{site_id.lower()}"),
+                      site.get('timezone', 'UTC'))
+        for site_id, site in config.items()
+    }
+
+def get_site(site_id=None):
+    """Return a site by ID, or the first configured site; raises KeyError for an unknown ID."""
+    sites = get_sites()
+    return sites[site_id] if site_id is not None else next(iter(sites.values()))
+
+def user_sites(user):
+    """Return the sites a user may see, in configuration order."""
+    sites = list(get_sites().values())
+    if not user or user.get('is_admin') or user.get('sites') is None:
+        return sites
+    return [site for site in sites if site.id in user['sites']]
+
+@st.cache_resource
+def _fan_out_pool():
+    return ThreadPoolExecutor(max_workers=FAN_OUT_WORKERS, thread_name_prefix='sites')
+
+def fan_out(function, sites):
+    """Call function(site) for every site in parallel; return the results in site order."""
+    if len(sites) == 1:
+        return [function(sites[0])]
+    return list(_fan_out_pool().map(function, sites))
+
+def merge_site_frames(sites, frames, sort=False):
+    """Concatenate the reading frames of sites, adding a categorical `site` column.
+
+    With `sort`, rows are merged into one timestamp order.
+    """
+    codes = np.repeat(np.arange(len(sites), dtype=np.int16), [len(frame) for frame in frames])
+    merged = concat_reading_frames(frames).assign(
+        site=pd.Categorical.from_codes(codes, categories=[site.id for site in sites]))
+    return merged.sort_values('timestamp', kind='stable', ignore_index=True) if sort else merged
+
+def format_site_timestamps(df, sites, fmt=TIMESTAMP_FORMAT):
+    """Format each row's UTC timestamp in the timezone of its site.
+
+    Rows are converted with one vectorized conversion per distinct
+    timezone, not per row or per site.
+    """
+    zones = df['site'].map({site.id: site.timezone for site in sites}).astype(object).to_numpy()
+    formatted = np.empty(len(df), dtype=object)
+    for tz in pd.unique(zones):
+        rows = zones == tz
+        formatted[rows] = df['timestamp'][rows].dt.tz_convert(tz).dt.strftime(fmt).to_numpy()
+    return pd.Series(formatted, index=df.index)
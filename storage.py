@@ -0,0 +1,780 @@
+# storage.py
+"""Storage backends for readings, users, audit events and alerts.
+
+Pages talk to a ReadingStore, a UserStore, an AuditStore and an AlertStore
+instead of Firestore directly. The backend is chosen in `.streamlit/secrets.toml`:
+
+    [storage]
+    backend = "sqlite"            # or "firestore" (the default)
+    sqlite_path = "iot_local.db"
+
+The SQLite backend is an embedded stand-in with time and sensor indexes
+for running the app offline, load-testing it and comparing query latency
+against Firestore. It stores `timestamp`, `sensorID` and `pressure` only.
+"""
+import streamlit as st
+import json
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+from google.cloud import firestore
+from firebase_config import get_database
+from reading_query import build_reading_query, fetch_date_bounds
+from sensor_index import fetch_latest_records, known_sensor_ids, update_latest
+
+# Documents per page when paging through readings
+PAGE_SIZE = 5_000
+# Concurrent sensor_latest updates after a write
+INDEX_WORKERS = 16
+# Attempts BulkWriter makes per document before the write counts as failed
+BULK_WRITE_ATTEMPTS = 5
+# Users per page of the user directory, and the fields it can be searched by
+USER_PAGE_SIZE = 50
+USER_SEARCH_FIELDS = ('username', 'email')
+# Firestore allows at most 500 writes per batch
+WRITE_BATCH_SIZE = 500
+# Events per page of the audit log
+AUDIT_PAGE_SIZE = 100
+# Upper bound of a prefix range: sorts after any character used in names and emails
+PREFIX_END = '\uf8ff'
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# How often the SQLite backend polls for new readings to push to watchers
+POLL_SECONDS = 1
+
+def reading_cursor(records, cursor=None):
+    """Return the cursor past records fetched after `cursor`: (newest timestamp, IDs of the readings at it).
+
+    Querying after a bare timestamp skips readings stored later with that
+    same timestamp; after a cursor they are returned, and only the listed
+    readings are skipped.
+    """
+    if not records:
+        return cursor
+    newest = records[-1]['timestamp']
+    ids = set(cursor[1]) if isinstance(cursor, tuple) and cursor[0] == newest else set()
+    for record in reversed(records):
+        if record['timestamp'] != newest:
+            break
+        ids.add(record['id'])
+    return newest, frozenset(ids)
+
+def assign_reading_ids(records):
+    """Give every record without one an `id`, so storing it again replaces it instead of adding a copy."""
+    return [record if 'id' in record else dict(record, id=uuid.uuid4().hex) for record in records]
+
+def cursor_timestamp(after):
+    """Return the timestamp of a watermark that may be a bare timestamp or a cursor."""
+    return after[0] if isinstance(after, tuple) else after
+
+def _unseen(records, after):
+    """Drop the records a cursor lists as already fetched."""
+    if not isinstance(after, tuple) or not after[1]:
+        return records
+    return [record for record in records if record['id'] not in after[1]]
+
+class ReadingStore:
+    """Interface of a readings backend.
+
+    Records are dicts with timestamp, sensorID and pressure, plus the `id`
+    of the stored reading when they come from query() or query_pages().
+    """
+
+    def query(self, start=None, end=None, sensor_id=None, after=None):
+        """Return readings in [start, end) newer than `after`, optionally of one sensor, oldest first.
+
+        `after` is a timestamp or a cursor from reading_cursor().
+        """
+        raise NotImplementedError
+
+    def query_pages(self, start=None, end=None, sensor_id=None, after=None, page_size=PAGE_SIZE):
+        """Yield the readings of query() as lists of at most page_size records."""
+        raise NotImplementedError
+
+    def date_bounds(self):
+        """Return (oldest, newest) reading timestamps, or None if there are no readings."""
+        raise NotImplementedError
+
+    def sensor_ids(self):
+        """Return the sorted distinct sensor IDs."""
+        raise NotImplementedError
+
+    def latest_per_sensor(self):
+        """Return the newest reading of every sensor."""
+        raise NotImplementedError
+
+    def add_readings(self, records):
+        """Store readings; return the ones that could not be stored.
+
+        A record's `id`, if it has one, names the stored reading, so writing
+        the same records again (see assign_reading_ids) does not duplicate them.
+        """
+        raise NotImplementedError
+
+    def watch(self, callback, after=None):
+        """Call `callback(records)` with readings newer than `after` as they arrive.
+
+        Returns an object whose unsubscribe() stops the watch.
+        """
+        raise NotImplementedError
+
+class UserStore:
+    """Interface of a users backend. Users are dicts keyed by username."""
+
+    def get(self, username):
+        """Return a user's data, or None if there is no such user."""
+        raise NotImplementedError
+
+    def list(self):
+        """Return all users, each with its `username`."""
+        raise NotImplementedError
+
+    def page(self, prefix='', field='username', after=None, limit=USER_PAGE_SIZE):
+        """Return (users, cursor): up to `limit` users whose `field` starts with `prefix`.
+
+        Users are ordered by `field` (`username` or `email`) and carry their
+        `username`. Pass the returned cursor as `after` for the next page; it
+        is None on the last page.
+        """
+        raise NotImplementedError
+
+    def set(self, username, data):
+        """Create or replace a user."""
+        raise NotImplementedError
+
+    def update(self, username, updates):
+        """Change some fields of an existing user."""
+        raise NotImplementedError
+
+    def delete(self, username):
+        """Remove a user."""
+        raise NotImplementedError
+
+    def write_many(self, operations):
+        """Apply many ('set' | 'update' | 'delete', username, data) operations.
+
+        Returns {username: error message} for the operations that failed;
+        the others are applied.
+        """
+        errors = {}
+        for operation, username, data in operations:
+            try:
+                if operation == 'delete':
+                    self.delete(username)
+                else:
+                    getattr(self, operation)(username, data)
+            except Exception as error:
+                errors[username] = str(error) or type(error).__name__
+        return errors
+
+class AuditStore:
+    """Interface of an audit log backend.
+
+    Events are dicts with an `id`, an aware UTC `timestamp`, the acting
+    `username`, an `action` name and a `details` dict.
+    """
+
+    def add_events(self, events):
+        """Store many events."""
+        raise NotImplementedError
+
+    def page(self, start=None, end=None, username=None, action=None, after=None, limit=AUDIT_PAGE_SIZE):
+        """Return (events, cursor): up to `limit` matching events, newest first.
+
+        Pass the returned cursor as `after` for the next page; it is None on
+        the last page.
+        """
+        raise NotImplementedError
+
+    def query_pages(self, start=None, end=None, username=None, action=None, page_size=PAGE_SIZE):
+        """Yield lists of matching events, newest first, page by page."""
+        cursor = None
+        while True:
+            events, cursor = self.page(start=start, end=end, username=username, action=action,
+                                       after=cursor, limit=page_size)
+            if events:
+                yield events
+            if cursor is None:
+                return
+
+class AlertStore:
+    """Interface of an alerts backend.
+
+    Alerts are dicts with an `id`, the readings `collection`, `sensorID`,
+    `kind`, `status` ('active' or 'resolved'), `raised_at` and `resolved_at`
+    timestamps, and details.
+    """
+
+    def save_alerts(self, alerts):
+        """Create or replace many alerts by ID."""
+        raise NotImplementedError
+
+    def active_alerts(self, collection):
+        """Return the alerts of one readings collection that are still active."""
+        raise NotImplementedError
+
+class FirestoreReadingStore(ReadingStore):
+    """Readings in a Firestore collection, with the sensor_latest index."""
+
+    def __init__(self, collection_name):
+        self.collection_name = collection_name
+
+    def query(self, start=None, end=None, sensor_id=None, after=None):
+        query = build_reading_query(self.collection_name, start=start, end=end, sensor_id=sensor_id, after=after)
+        return _unseen([dict(doc.to_dict(), id=doc.id) for doc in query.get()], after)
+
+    def query_pages(self, start=None, end=None, sensor_id=None, after=None, page_size=PAGE_SIZE):
+        query = build_reading_query(self.collection_name, start=start, end=end, sensor_id=sensor_id, after=after)
+        last_doc = None
+        while True:
+            page = query.limit(page_size)
+            if last_doc is not None:
+                page = page.start_after(last_doc)
+            docs = page.get()
+            if not docs:
+                return
+            records = _unseen([dict(doc.to_dict(), id=doc.id) for doc in docs], after)
+            if records:
+                yield records
+            if len(docs) < page_size:
+                return
+            last_doc = docs[-1]
+
+    def date_bounds(self):
+        return fetch_date_bounds(self.collection_name)
+
+    def sensor_ids(self):
+        return known_sensor_ids(self.collection_name)
+
+    def latest_per_sensor(self):
+        return fetch_latest_records(self.collection_name)
+
+    def add_readings(self, records):
+        db = get_database()
+        collection = db.collection(self.collection_name)
+        # BulkWriter sends the writes in parallel batches and ramps up under Firestore's rate limits
+        bulk_writer = db.bulk_writer()
+        failed_ids = set()
+
+        def on_write_error(failure, writer):
+            # close() does not raise for documents that could not be written; collect them instead
+            if failure.attempts < BULK_WRITE_ATTEMPTS:
+                return True
+            failed_ids.add(failure.operation.reference.id)
+            return False
+
+        bulk_writer.on_write_error(on_write_error)
+        stored = []
+        for record in records:
+            document = collection.document(record['id']) if 'id' in record else collection.document()
+            data = {key: value for key, value in record.items() if key != 'id'}
+            # set, not create: a retried batch overwrites what an earlier attempt stored
+            bulk_writer.set(document, data)
+            stored.append((document.id, record, data))
+        bulk_writer.close()
+        # One index update per sensor, with that sensor's newest stored reading
+        newest = {}
+        for document_id, _, data in stored:
+            if document_id in failed_ids:
+                continue
+            current = newest.get(data['sensorID'])
+            if current is None or data['timestamp'] > current['timestamp']:
+                newest[data['sensorID']] = data
+        with ThreadPoolExecutor(max_workers=INDEX_WORKERS) as executor:
+            list(executor.map(lambda record: update_latest(self.collection_name, record, db), newest.values()))
+        return [record for document_id, record, _ in stored if document_id in failed_ids]
+
+    def watch(self, callback, after=None):
+        query = get_database().collection(self.collection_name)
+        if after is not None:
+            query = query.where('timestamp', '>', after)
+
+        def on_snapshot(docs, changes, read_time):
+            records = [change.document.to_dict() for change in changes
+                       if change.type.name in ('ADDED', 'MODIFIED')]
+            if records:
+                callback(records)
+
+        return query.on_snapshot(on_snapshot)
+
+class FirestoreUserStore(UserStore):
+    """Users in the Firestore `users` collection, keyed by username."""
+
+    def __init__(self, collection_name='users'):
+        self.collection_name = collection_name
+
+    def _document(self, username):
+        return get_database().collection(self.collection_name).document(username)
+
+    def get(self, username):
+        user_doc = self._document(username).get()
+        return user_doc.to_dict() if user_doc.exists else None
+
+    def list(self):
+        users = []
+        for doc in get_database().collection(self.collection_name).stream():
+            user_data = doc.to_dict()
+            user_data['username'] = doc.id
+            users.append(user_data)
+        return users
+
+    def page(self, prefix='', field='username', after=None, limit=USER_PAGE_SIZE):
+        if field not in USER_SEARCH_FIELDS:
+            raise ValueError(f"Cannot search users by {field!r}")
+        collection = get_database().collection(self.collection_name)
+        query = collection
+        if field == 'username':
+            # Usernames are document IDs, compared as document references
+            if prefix:
+                query = (query.where(firestore.FieldPath.document_id(), '>=', collection.document(prefix))
+                         .where(firestore.FieldPath.document_id(), '<', collection.document(prefix + PREFIX_END)))
+            query = query.order_by(firestore.FieldPath.document_id())
+            if after is not None:
+                query = query.start_after([collection.document(after[-1])])
+        else:
+            if prefix:
+                query = query.where(field, '>=', prefix).where(field, '<', prefix + PREFIX_END)
+            query = query.order_by(field).order_by(firestore.FieldPath.document_id())
+            if after is not None:
+                query = query.start_after([after[0], collection.document(after[-1])])
+
+        docs = query.limit(limit + 1).get()
+        users = [dict(doc.to_dict(), username=doc.id) for doc in docs[:limit]]
+        return users, _user_cursor(users, field, more=len(docs) > limit)
+
+    def set(self, username, data):
+        self._document(username).set(data)
+
+    def update(self, username, updates):
+        self._document(username).update(updates)
+
+    def delete(self, username):
+        self._document(username).delete()
+
+    def write_many(self, operations):
+        db = get_database()
+        collection = db.collection(self.collection_name)
+        errors = {}
+        for start in range(0, len(operations), WRITE_BATCH_SIZE):
+            chunk = operations[start:start + WRITE_BATCH_SIZE]
+            batch = db.batch()
+            for operation, username, data in chunk:
+                document = collection.document(username)
+                if operation == 'delete':
+                    batch.delete(document)
+                else:
+                    getattr(batch, operation)(document, data)
+            try:
+                batch.commit()
+            except Exception:
+                # A batch fails as a whole (e.g. an update of a missing user); redo it one by one to find the culprits
+                errors.update(super().write_many(chunk))
+        return errors
+
+class FirestoreAuditStore(AuditStore):
+    """Audit events in the Firestore `audit_log` collection, keyed by event ID."""
+
+    def __init__(self, collection_name='audit_log'):
+        self.collection_name = collection_name
+
+    def add_events(self, events):
+        db = get_database()
+        collection = db.collection(self.collection_name)
+        for start in range(0, len(events), WRITE_BATCH_SIZE):
+            batch = db.batch()
+            for event in events[start:start + WRITE_BATCH_SIZE]:
+                batch.set(collection.document(event['id']), {key: value for key, value in event.items() if key != 'id'})
+            batch.commit()
+
+    def page(self, start=None, end=None, username=None, action=None, after=None, limit=AUDIT_PAGE_SIZE):
+        collection = get_database().collection(self.collection_name)
+        query = collection
+        # Equality filters with a timestamp range use the composite indexes in firestore.indexes.json
+        if username:
+            query = query.where('username', '==', username)
+        if action:
+            query = query.where('action', '==', action)
+        if start is not None:
+            query = query.where('timestamp', '>=', start)
+        if end is not None:
+            query = query.where('timestamp', '<', end)
+        query = (query.order_by('timestamp', direction=firestore.Query.DESCENDING)
+                 .order_by(firestore.FieldPath.document_id(), direction=firestore.Query.DESCENDING))
+        if after is not None:
+            query = query.start_after([after[0], collection.document(after[1])])
+        docs = query.limit(limit + 1).get()
+        events = [dict(doc.to_dict(), id=doc.id) for doc in docs[:limit]]
+        return events, _audit_cursor(events, more=len(docs) > limit)
+
+class FirestoreAlertStore(AlertStore):
+    """Alerts in the Firestore `alerts` collection, keyed by alert ID."""
+
+    def __init__(self, collection_name='alerts'):
+        self.collection_name = collection_name
+
+    def save_alerts(self, alerts):
+        db = get_database()
+        collection = db.collection(self.collection_name)
+        for start in range(0, len(alerts), WRITE_BATCH_SIZE):
+            batch = db.batch()
+            for alert in alerts[start:start + WRITE_BATCH_SIZE]:
+                batch.set(collection.document(alert['id']), {key: value for key, value in alert.items() if key != 'id'})
+            batch.commit()
+
+    def active_alerts(self, collection):
+        docs = (get_database().collection(self.collection_name)
+                .where('status', '==', 'active').where('collection', '==', collection).get())
+        return [dict(doc.to_dict(), id=doc.id) for doc in docs]
+
+def _audit_cursor(events, more):
+    """Return the cursor after the last event of a page, or None if there are no more pages."""
+    if not more or not events:
+        return None
+    return events[-1]['timestamp'], events[-1]['id']
+
+def _user_cursor(users, field, more):
+    """Return the cursor after the last user of a page, or None if there are no more pages."""
+    if not more or not users:
+        return None
+    last = users[-1]
+    return (last['username'],) if field == 'username' else (last.get(field), last['username'])
+
+def _to_micros(value):
+    """Convert a datetime, pandas Timestamp or ISO string to UTC epoch microseconds."""
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize('UTC')
+    return timestamp.value // 1000
+
+def _from_micros(micros):
+    """Convert UTC epoch microseconds to an aware datetime."""
+    return EPOCH + timedelta(microseconds=micros)
+
+class _Poller:
+    """Daemon thread that polls a SQLite store for new readings."""
+
+    def __init__(self, store, callback, after):
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(store, callback, after), daemon=True)
+        self._thread.start()
+
+    def _run(self, store, callback, after):
+        while not self._stopped.wait(POLL_SECONDS):
+            records = store.query(after=after)
+            if records:
+                # A cursor, so readings stored later with the newest timestamp are not skipped
+                after = reading_cursor(records, after)
+                callback(records)
+
+    @property
+    def is_active(self):
+        return self._thread.is_alive()
+
+    def unsubscribe(self):
+        self._stopped.set()
+
+class SQLiteStore:
+    """Shared SQLite connection holding the readings, users, audit_log and alerts tables."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS readings (
+                collection TEXT NOT NULL,
+                ts INTEGER NOT NULL,
+                sensor_id TEXT NOT NULL,
+                pressure REAL
+            );
+            CREATE INDEX IF NOT EXISTS readings_ts ON readings (collection, ts);
+            CREATE INDEX IF NOT EXISTS readings_sensor_ts ON readings (collection, sensor_id, ts);
+            CREATE TABLE IF NOT EXISTS users (
+                username TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS users_email ON users (json_extract(data, '$.email'), username);
+            CREATE TABLE IF NOT EXISTS audit_log (
+                id TEXT PRIMARY KEY,
+                ts INTEGER NOT NULL,
+                username TEXT,
+                action TEXT NOT NULL,
+                details TEXT
+            );
+            CREATE INDEX IF NOT EXISTS audit_ts ON audit_log (ts, id);
+            CREATE INDEX IF NOT EXISTS audit_username_ts ON audit_log (username, ts, id);
+            CREATE INDEX IF NOT EXISTS audit_action_ts ON audit_log (action, ts, id);
+            CREATE TABLE IF NOT EXISTS alerts (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS alerts_status ON alerts (status);
+        ''')
+
+    def execute(self, sql, params=()):
+        """Run a statement and return all result rows."""
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def executemany(self, sql, rows):
+        """Run a statement for many parameter rows in one transaction."""
+        with self.lock, self.connection:
+            self.connection.executemany(sql, rows)
+
+class SQLiteReadingStore(ReadingStore):
+    """Readings in a local SQLite database, indexed by time and by sensor and time."""
+
+    def __init__(self, db, collection_name):
+        self.db = db
+        self.collection_name = collection_name
+
+    def _where(self, start, end, sensor_id, after):
+        """Build the WHERE clause and parameters of a reading query."""
+        clauses, params = ['collection = ?'], [self.collection_name]
+        if sensor_id is not None:
+            clauses.append('sensor_id = ?')
+            params.append(sensor_id)
+        if start is not None:
+            clauses.append('ts >= ?')
+            params.append(_to_micros(start))
+        if isinstance(after, tuple):
+            clauses.append('ts >= ?')
+            params.append(_to_micros(after[0]))
+        elif after is not None:
+            clauses.append('ts > ?')
+            params.append(_to_micros(after))
+        if end is not None:
+            clauses.append('ts < ?')
+            params.append(_to_micros(end))
+        return ' AND '.join(clauses), params
+
+    @staticmethod
+    def _record(row):
+        record = {'timestamp': _from_micros(row[0]), 'sensorID': row[1], 'pressure': row[2]}
+        if len(row) > 3:
+            record['id'] = row[3]
+        return record
+
+    def query(self, start=None, end=None, sensor_id=None, after=None):
+        where, params = self._where(start, end, sensor_id, after)
+        rows = self.db.execute(
+            f'SELECT ts, sensor_id, pressure, rowid FROM readings WHERE {where} ORDER BY ts, rowid', params)
+        return _unseen([self._record(row) for row in rows], after)
+
+    def query_pages(self, start=None, end=None, sensor_id=None, after=None, page_size=PAGE_SIZE):
+        where, params = self._where(start, end, sensor_id, after)
+        last = None
+        while True:
+            clause, page_params = where, list(params)
+            if last is not None:
+                clause += ' AND (ts > ? OR (ts = ? AND rowid > ?))'
+                page_params += [last[0], last[0], last[1]]
+            rows = self.db.execute(
+                f'SELECT ts, sensor_id, pressure, rowid FROM readings WHERE {clause} '
+                f'ORDER BY ts, rowid LIMIT ?', page_params + [page_size])
+            if not rows:
+                return
+            records = _unseen([self._record(row) for row in rows], after)
+            if records:
+                yield records
+            if len(rows) < page_size:
+                return
+            last = (rows[-1][0], rows[-1][3])
+
+    def date_bounds(self):
+        oldest, newest = self.db.execute(
+            'SELECT MIN(ts), MAX(ts) FROM readings WHERE collection = ?', (self.collection_name,))[0]
+        if oldest is None:
+            return None
+        return _from_micros(oldest), _from_micros(newest)
+
+    def sensor_ids(self):
+        rows = self.db.execute(
+            'SELECT DISTINCT sensor_id FROM readings WHERE collection = ? ORDER BY sensor_id',
+            (self.collection_name,))
+        return [row[0] for row in rows]
+
+    def latest_per_sensor(self):
+        # SQLite returns the other columns from the row holding MAX(ts)
+        rows = self.db.execute(
+            'SELECT MAX(ts), sensor_id, pressure FROM readings WHERE collection = ? GROUP BY sensor_id',
+            (self.collection_name,))
+        return [self._record(row) for row in rows]
+
+    def add_readings(self, records):
+        self.db.executemany(
+            'INSERT INTO readings (collection, ts, sensor_id, pressure) VALUES (?, ?, ?, ?)',
+            [(self.collection_name, _to_micros(record['timestamp']), record['sensorID'], record.get('pressure'))
+             for record in records])
+        # One transaction: either every reading is stored or the call raises
+        return []
+
+    def watch(self, callback, after=None):
+        return _Poller(self, callback, after)
+
+class SQLiteUserStore(UserStore):
+    """Users in a local SQLite database, stored as JSON documents."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def get(self, username):
+        rows = self.db.execute('SELECT data FROM users WHERE username = ?', (username,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def list(self):
+        rows = self.db.execute('SELECT username, data FROM users ORDER BY username')
+        return [dict(json.loads(data), username=username) for username, data in rows]
+
+    def page(self, prefix='', field='username', after=None, limit=USER_PAGE_SIZE):
+        if field not in USER_SEARCH_FIELDS:
+            raise ValueError(f"Cannot search users by {field!r}")
+        key = 'username' if field == 'username' else f"json_extract(data, '$.{field}')"
+        where, params = [], []
+        if prefix:
+            where.append(f'{key} >= ? AND {key} < ?')
+            params += [prefix, prefix + PREFIX_END]
+        if after is not None:
+            if field == 'username':
+                where.append('username > ?')
+            else:
+                where.append(f'({key}, username) > (?, ?)')
+            params += list(after)
+        sql = f"SELECT username, data FROM users {'WHERE ' + ' AND '.join(where) if where else ''}"
+        sql += f' ORDER BY {key}, username LIMIT ?'
+        rows = self.db.execute(sql, params + [limit + 1])
+        users = [dict(json.loads(data), username=username) for username, data in rows[:limit]]
+        return users, _user_cursor(users, field, more=len(rows) > limit)
+
+    def set(self, username, data):
+        self.db.executemany('INSERT OR REPLACE INTO users (username, data) VALUES (?, ?)',
+                            [(username, json.dumps(data))])
+
+    def update(self, username, updates):
+        with self.db.lock, self.db.connection:
+            row = self.db.connection.execute('SELECT data FROM users WHERE username = ?', (username,)).fetchone()
+            if row is None:
+                raise KeyError(username)
+            data = dict(json.loads(row[0]), **updates)
+            self.db.connection.execute('UPDATE users SET data = ? WHERE username = ?', (json.dumps(data), username))
+
+    def delete(self, username):
+        self.db.executemany('DELETE FROM users WHERE username = ?', [(username,)])
+
+    def write_many(self, operations):
+        errors = {}
+        with self.db.lock, self.db.connection:
+            connection = self.db.connection
+            for operation, username, data in operations:
+                if operation == 'set':
+                    connection.execute('INSERT OR REPLACE INTO users (username, data) VALUES (?, ?)',
+                                       (username, json.dumps(data)))
+                elif operation == 'delete':
+                    connection.execute('DELETE FROM users WHERE username = ?', (username,))
+                else:
+                    row = connection.execute('SELECT data FROM users WHERE username = ?', (username,)).fetchone()
+                    if row is None:
+                        errors[username] = f"No user {username!r}"
+                        continue
+                    connection.execute('UPDATE users SET data = ? WHERE username = ?',
+                                       (json.dumps(dict(json.loads(row[0]), **data)), username))
+        return errors
+
+class SQLiteAuditStore(AuditStore):
+    """Audit events in a local SQLite table, indexed by time, user and action."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def add_events(self, events):
+        self.db.executemany(
+            'INSERT OR REPLACE INTO audit_log (id, ts, username, action, details) VALUES (?, ?, ?, ?, ?)',
+            [(event['id'], _to_micros(event['timestamp']), event.get('username'), event['action'],
+              json.dumps(event.get('details') or {}, default=str)) for event in events]
+        )
+
+    def page(self, start=None, end=None, username=None, action=None, after=None, limit=AUDIT_PAGE_SIZE):
+        where, params = [], []
+        if username:
+            where.append('username = ?')
+            params.append(username)
+        if action:
+            where.append('action = ?')
+            params.append(action)
+        if start is not None:
+            where.append('ts >= ?')
+            params.append(_to_micros(start))
+        if end is not None:
+            where.append('ts < ?')
+            params.append(_to_micros(end))
+        if after is not None:
+            where.append('(ts, id) < (?, ?)')
+            params += [_to_micros(after[0]), after[1]]
+        sql = 'SELECT id, ts, username, action, details FROM audit_log'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        rows = self.db.execute(sql + ' ORDER BY ts DESC, id DESC LIMIT ?', params + [limit + 1])
+        events = [{'id': id_, 'timestamp': _from_micros(ts), 'username': user, 'action': name,
+                   'details': json.loads(details or '{}')}
+                  for id_, ts, user, name, details in rows[:limit]]
+        return events, _audit_cursor(events, more=len(rows) > limit)
+
+class SQLiteAlertStore(AlertStore):
+    """Alerts in a local SQLite table, stored as JSON documents."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def save_alerts(self, alerts):
+        self.db.executemany(
+            'INSERT OR REPLACE INTO alerts (id, status, data) VALUES (?, ?, ?)',
+            [(alert['id'], alert['status'], json.dumps({key: value for key, value in alert.items() if key != 'id'},
+                                                      default=str)) for alert in alerts]
+        )
+
+    def active_alerts(self, collection):
+        rows = self.db.execute(
+            "SELECT id, data FROM alerts WHERE status = 'active' AND json_extract(data, '$.collection') = ?",
+            (collection,))
+        return [dict(json.loads(data), id=id_) for id_, data in rows]
+
+def storage_config():
+    """Return the [storage] section of the Streamlit secrets."""
+    return st.secrets.get('storage', {})
+
+@st.cache_resource
+def get_sqlite(path):
+    """Get the shared SQLite connection of a database file."""
+    return SQLiteStore(path)
+
+def get_reading_store(collection_name):
+    """Get the configured reading store of a collection."""
+    config = storage_config()
+    if config.get('backend', 'firestore') == 'sqlite':
+        return SQLiteReadingStore(get_sqlite(config.get('sqlite_path', 'iot_local.db')), collection_name)
+    return FirestoreReadingStore(collection_name)
+
+def get_user_store():
+    """Get the configured user store."""
+    config = storage_config()
+    if config.get('backend', 'firestore') == 'sqlite':
+        return SQLiteUserStore(get_sqlite(config.get('sqlite_path', 'iot_local.db')))
+    return FirestoreUserStore()
+
+def get_audit_store():
+    """Get the configured audit log store."""
+    config = storage_config()
+    if config.get('backend', 'firestore') == 'sqlite':
+        return SQLiteAuditStore(get_sqlite(config.get('sqlite_path', 'iot_local.db')))
+    return FirestoreAuditStore()
+
+def get_alert_store():
+    """Get the configured alerts store."""
+    config = storage_config()
+    if config.get('backend', 'firestore') == 'sqlite':
+        return SQLiteAlertStore(get_sqlite(config.get('sqlite_path', 'iot_local.db')))
+    return FirestoreAlertStore()
@@ -1,163 +1,237 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime, timezone
-from firebase_config import get_database
-from login import login as authenticate_user, is_logged_in
+import numpy as np
+from html import escape
+from storage import get_reading_store
+from reading_frame import build_reading_frame, format_timestamps
+from live_updates import LIVE_REFRESH_SECONDS, get_live_feed
+from ingest import start_embedded_ingest
+from alerts import active_alerts, start_alerting
+from session import current_user, is_logged_in, show_login_form, show_logout_button
+from sites import fan_out, format_site_timestamps, merge_site_frames, user_sites
+import perf
+
+# Sessions rerunning within this window share one fetch of the latest readings
+LATEST_READINGS_TTL_SECONDS = 10
 
 def show_login_page():
     """Render the login page."""
     st.title("Login Page")
-    st.write("Please log in to access the dashboard.")
-    
-    with st.form("login_form"):
-        username = st.text_input("Username")
-        password = st.text_input("Password", type="password")
-        login_button = st.form_submit_button("Login")
-
-        if login_button:
-            if authenticate_user(username, password):
-                st.session_state['logged_in'] = True
-                st.session_state['username'] = username
-                st.session_state.page = 'dashboard'
-                st.rerun()  # Refresh the app after logging in
-            else:
-                st.error("Invalid credentials. Please try again.")
+    if show_login_form("Please log in to access the dashboard."):
+        st.session_state.page = 'dashboard'
+        st.rerun()  # Refresh the app after logging in
 
+@perf.traced('overview.fetch_latest_readings')
 def fetch_latest_readings(collection_name):
-    """Fetch the latest reading for each sensor from Firestore."""
-    db = get_database()
-    docs = db.collection(collection_name).order_by('timestamp', direction='DESCENDING').get()
-    
-    data = []
-    seen_sensors = set()
-
-    for doc in docs:
-        record = doc.to_dict()
-        sensor_id = record.get('sensorID')
-        if sensor_id not in seen_sensors:
-            data.append(record)
-            seen_sensors.add(sensor_id)
-
-    return pd.DataFrame(data) if data else pd.DataFrame()
+    """Fetch the latest reading for each sensor, reading one record per sensor."""
+    records = get_reading_store(collection_name).latest_per_sensor()
+    perf.count(docs=len(records))
+    return build_reading_frame(records)
+
+@st.cache_data(ttl=LATEST_READINGS_TTL_SECONDS)
+def fetch_site_latest_readings(sites):
+    """Fetch the latest reading of every sensor at the given sites in parallel, merged into one frame."""
+    return merge_site_frames(sites, fan_out(lambda site: fetch_latest_readings(site.collection), sites))
+
+# A sensor whose latest reading is older than this is flagged as outdated
+STALE_AFTER = pd.Timedelta(minutes=5)
+CARDS_PER_PAGE = 60
+
+def build_sensor_cards(latest_df, now=None, sites=None):
+    """Compute timestamp text, staleness and colors for every sensor at once.
+
+    With `sites`, timestamps are shown in the timezone of each card's site.
+    """
+    now = now or pd.Timestamp.now(tz='UTC')
+    if sites and 'site' in latest_df:
+        cards = latest_df[['sensorID', 'site', 'timestamp', 'pressure']].copy()
+        cards['formatted_timestamp'] = format_site_timestamps(cards, sites)
+    else:
+        cards = latest_df[['sensorID', 'timestamp', 'pressure']].copy()
+        cards['formatted_timestamp'] = format_timestamps(cards['timestamp'])
+    cards['is_outdated'] = (now - cards['timestamp']) > STALE_AFTER
+    cards['bg_color'] = np.where(cards['is_outdated'], "#f1948a", "#85c1e9")
+    cards['flash_class'] = np.where(cards['is_outdated'], "flash-red", "")
+    return cards.sort_values(by=['site', 'sensorID'] if 'site' in cards else 'sensorID', ignore_index=True)
+
+def filter_sensor_cards(cards, search="", status="All"):
+    """Keep the cards whose sensor ID contains the search text and that match the status."""
+    if search:
+        cards = cards[cards['sensorID'].astype(str).str.contains(search, case=False, regex=False)]
+    if status == "Outdated":
+        cards = cards[cards['is_outdated']]
+    elif status == "Up to date":
+        cards = cards[~cards['is_outdated']]
+    return cards
+
+def render_sensor_cards(cards):
+    """Render all cards as one HTML grid in a single markdown element."""
+    html = (
+        '<div class="sensor-container ' + cards['flash_class'] + '" style="background-color: ' + cards['bg_color'] + ';">'
+        + '<div class="sensor-info"><h3>' + cards['sensorID'].astype(str).map(escape) + '</h3>'
+        + (('<p><strong>Site:</strong> ' + cards['site'].astype(str).map(escape) + '</p>')
+           if 'site' in cards and len(cards['site'].cat.categories) > 1 else '')
+        + '<p><strong>Timestamp:</strong> ' + cards['formatted_timestamp'] + '</p></div>'
+        + '<div class="sensor-reading"><div class="reading-box">'
+        + '<p><strong>Pressure:</strong> ' + cards['pressure'].astype(str).map(escape) + '</p>'
+        + '</div></div></div>'
+    )
+    st.markdown('<div class="sensor-grid">' + ''.join(html) + '</div>', unsafe_allow_html=True)
+
+def show_sensor_cards(latest_df, search="", status="All", sites=None):
+    """Render the filtered, paged sensor cards of a latest-readings frame."""
+    if latest_df.empty:
+        st.write("No data available.")
+        return
+
+    cards = filter_sensor_cards(build_sensor_cards(latest_df, sites=sites), search, status)
+    pages = max(1, -(-len(cards) // CARDS_PER_PAGE))
+    page = st.number_input("Page", min_value=1, max_value=pages, value=1) if pages > 1 else 1
+    st.caption(f"{len(cards)} sensors, {int(cards['is_outdated'].sum())} outdated")
+    render_sensor_cards(cards.iloc[(page - 1) * CARDS_PER_PAGE:page * CARDS_PER_PAGE])
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def show_live_sensor_cards(sites, search, status):
+    """Re-render the cards from the sites' shared live tables every few seconds."""
+    feeds = [get_live_feed(site.collection) for site in sites]
+    for feed in feeds:
+        feed.ensure_running()
+    show_sensor_cards(merge_site_frames(sites, [feed.frame() for feed in feeds]), search, status, sites)
+
+def show_active_alerts(sites, engines):
+    """List the active alerts of the sites, if there are any."""
+    alerts = [dict(alert, site=site.id) for site in sites for alert in active_alerts(site.collection, engines)]
+    if not alerts:
+        return
+    with st.expander(f"🚨 {len(alerts)} active alerts", expanded=True):
+        df = pd.DataFrame(alerts, columns=['site', 'sensorID', 'kind', 'raised_at', 'value', 'limit'])
+        df = df.sort_values('raised_at', ascending=False, ignore_index=True)
+        df['raised_at'] = format_site_timestamps(df.assign(timestamp=pd.to_datetime(df['raised_at'], utc=True)), sites)
+        st.dataframe(df if len(sites) > 1 else df.drop(columns='site'), hide_index=True, use_container_width=True)
 
 def show_dashboard():
     """Render the main dashboard."""
     st.title("IoT Dashboard Overview")
 
-    collection_name = "iot_gateway_reading"
-    latest_df = fetch_latest_readings(collection_name)
-
-    if not latest_df.empty:
-        latest_df['timestamp'] = pd.to_datetime(latest_df['timestamp'], utc=True)
-        latest_df['timestamp'] = latest_df['timestamp'].dt.tz_convert('Asia/Singapore')
-        latest_df['formatted_timestamp'] = latest_df['timestamp'].dt.strftime('%d/%m/%Y %H:%M')
-        latest_df = latest_df.sort_values(by='sensorID')
-
-        st.header("Latest Sensor/Regulator Readings")
-
-        for sensor_id, group in latest_df.groupby('sensorID'):
-            for _, row in group.iterrows():
-                time_diff = datetime.now(timezone.utc) - row['timestamp']
-                is_outdated = time_diff.total_seconds() > 5 * 60
-                container_bg_color = "#f1948a" if is_outdated else "#85c1e9"
-                flash_class = "flash-red" if is_outdated else ""
-
-                st.markdown(
-                    f"""
-                    <div class="sensor-container {flash_class}" style="background-color: {container_bg_color};">
-                        <div class="sensor-info">
-                            <h3>{sensor_id}</h3>
-                            <p><strong>Timestamp:</strong> {row["formatted_timestamp"]}</p>
-                        </div>
-                        <div class="sensor-reading">
-                            <div class="reading-box">
-                                <p><strong>Pressure:</strong> {row["pressure"]}</p>
-                            </div>
-                        </div>
-                    </div>
-                    """,
-                    unsafe_allow_html=True
-                )
-
-        st.markdown(
-            """
-            <style>
-            @keyframes flash {
-                0% { background-color: #f1948a; }
-                50% { background-color: #f5b7b1; }
-                100% { background-color: #f1948a; }
-            }
-            .flash-red {
-                animation: flash 1s infinite;
-            }
+    # Only the sites this user may see are queried
+    sites = user_sites(current_user())
+    if not sites:
+        st.warning("You do not have access to any site.")
+        return
+    if len(sites) > 1:
+        names = {site.id: site.name for site in sites}
+        selected_site = st.selectbox("Site", ["All my sites"] + list(names),
+                                     format_func=lambda site_id: names.get(site_id, site_id))
+        if selected_site != "All my sites":
+            sites = [site for site in sites if site.id == selected_site]
+
+    show_active_alerts(sites, start_alerting())
+
+    st.header("Latest Sensor/Regulator Readings")
+
+    search_col, status_col, live_col = st.columns([3, 2, 1])
+    search = search_col.text_input("Search sensors", placeholder="Sensor ID")
+    status = status_col.radio("Status", ["All", "Outdated", "Up to date"], horizontal=True)
+    live = live_col.toggle("Live", help="Push new readings to this page as they arrive")
+
+    if live:
+        show_live_sensor_cards(sites, search, status)
+    else:
+        show_sensor_cards(fetch_site_latest_readings(tuple(sites)), search, status, sites)
+
+    st.markdown(
+        """
+        <style>
+        @keyframes flash {
+            0% { background-color: #f1948a; }
+            50% { background-color: #f5b7b1; }
+            100% { background-color: #f1948a; }
+        }
+        .flash-red {
+            animation: flash 1s infinite;
+        }
+        .sensor-grid {
+            display: grid;
+            grid-template-columns: repeat(auto-fill, minmax(420px, 1fr));
+            column-gap: 20px;
+        }
+        .sensor-container {
+            border: 1px solid #ddd;
+            border-radius: 10px;
+            padding: 15px;
+            margin-bottom: 20px;
+            display: flex;
+            flex-wrap: wrap;
+            justify-content: space-between;
+            align-items: center;
+            background-color: #f5f5f5;
+            box-shadow: 0 4px 8px rgba(0,0,0,0.1);
+        }
+        .sensor-info {
+            flex: 1;
+            min-width: 180px;
+        }
+        .sensor-reading {
+            flex: 2;
+            padding-left: 20px;
+            min-width: 220px;
+        }
+        .reading-box {
+            border: 1px solid #ccc;
+            border-radius: 5px;
+            padding: 10px;
+            margin: 5px 0;
+            background-color: #abebc6;
+        }
+        @media (max-width: 768px) {
             .sensor-container {
-                border: 1px solid #ddd;
-                border-radius: 10px;
+                flex-direction: column;
                 padding: 15px;
-                margin-bottom: 20px;
-                display: flex;
-                flex-wrap: wrap;
-                justify-content: space-between;
-                align-items: center;
-                background-color: #f5f5f5;
-                box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-            }
-            .sensor-info {
-                flex: 1;
-                min-width: 180px;
             }
-            .sensor-reading {
-                flex: 2;
-                padding-left: 20px;
-                min-width: 220px;
+            .sensor-info, .sensor-reading {
+                flex: unset;
+                min-width: 100%;
+                padding-left: 0;
             }
             .reading-box {
-                border: 1px solid #ccc;
-                border-radius: 5px;
-                padding: 10px;
+                padding: 8px;
                 margin: 5px 0;
-                background-color: #abebc6;
             }
-            @media (max-width: 768px) {
-                .sensor-container {
-                    flex-direction: column;
-                    padding: 15px;
-                }
-                .sensor-info, .sensor-reading {
-                    flex: unset;
-                    min-width: 100%;
-                    padding-left: 0;
-                }
-                .reading-box {
-                    padding: 8px;
-                    margin: 5px 0;
-                }
-                h3 {
-                    font-size: 1.2rem;
-                }
-                p {
-                    font-size: 0.9rem;
-                }
+            h3 {
+                font-size: 1.2rem;
             }
-            </style>
-            """,
-            unsafe_allow_html=True
-        )
-    else:
-        st.write("No data available.")
+            p {
+                font-size: 0.9rem;
+            }
+        }
+        </style>
+        """,
+        unsafe_allow_html=True
+    )
 
+@perf.traced('page.main')
 def main():
     """Main function to handle the application flow."""
+    start_embedded_ingest()
+    # Alert engines run for the whole process, not just while the dashboard is open
+    start_alerting()
+    perf.start_metrics_endpoint()
+
     if 'page' not in st.session_state:
         st.session_state.page = 'login'
 
+    # A session started on another page carries over
+    if is_logged_in() and st.session_state.page == 'login':
+        st.session_state.page = 'dashboard'
+
     if not is_logged_in() and st.session_state.page != 'login':
         st.session_state.page = 'login'
-        st.experimental_rerun()  # Redirect to login page
+        st.rerun()  # Redirect to login page
 
     if st.session_state.page == 'login':
         show_login_page()
     elif st.session_state.page == 'dashboard':
+        show_logout_button()
         show_dashboard()
     else:
         st.write("Page not found.")
@@ -0,0 +1,124 @@
+# synthetic_data.py
+"""Reproducible synthetic readings and users for load tests and benchmarks.
+
+Each sensor gets a base pressure, a daily cycle, small noise, occasional
+spikes and outages (runs of missing readings), generated with NumPy a
+block of sensors at a time. The same seed always produces the same data.
+
+Readings are written through the configured reading store, so with
+`[storage] backend = "sqlite"` they go to the local database, and with
+Firestore they go to the emulator when FIRESTORE_EMULATOR_HOST is set:
+
+    $ python synthetic_data.py --sensors 100 --readings 10000
+"""
+import argparse
+import numpy as np
+import pandas as pd
+
+DEFAULT_START = pd.Timestamp('2024-01-01', tz='UTC')
+DEFAULT_INTERVAL = pd.Timedelta(minutes=1)
+# Share of readings that are spikes, and expected outages per reading
+SPIKE_RATE = 0.001
+OUTAGE_RATE = 0.0005
+# Mean length of an outage, in readings
+MEAN_OUTAGE_READINGS = 30
+# Readings generated per block of sensors
+BLOCK_ROWS = 1_000_000
+WRITE_BATCH = 5_000
+
+def sensor_names(n_sensors):
+    """Return the IDs of n synthetic sensors."""
+    width = len(str(n_sensors))
+    return [f"PR-{i:0{width}d}" for i in range(1, n_sensors + 1)]
+
+def _outage_mask(rng, n_readings):
+    """Return a boolean mask of the readings lost to outages for one sensor."""
+    n_outages = rng.poisson(OUTAGE_RATE * n_readings)
+    change = np.zeros(n_readings + 1, dtype=np.int64)
+    starts = rng.integers(0, n_readings, n_outages)
+    ends = np.minimum(starts + rng.geometric(1 / MEAN_OUTAGE_READINGS, n_outages), n_readings)
+    np.add.at(change, starts, 1)
+    np.add.at(change, ends, -1)
+    return np.cumsum(change[:-1]) > 0
+
+def iter_reading_frames(n_sensors, readings_per_sensor, start=DEFAULT_START, interval=DEFAULT_INTERVAL, seed=0):
+    """Yield reading frames (timestamp, sensorID, pressure) covering every sensor, a block at a time."""
+    rng = np.random.default_rng(seed)
+    names = sensor_names(n_sensors)
+    per_block = max(1, BLOCK_ROWS // max(1, readings_per_sensor))
+    step = interval.value
+    day = pd.Timedelta(days=1).value
+    offsets = np.arange(readings_per_sensor, dtype=np.int64) * step
+
+    for first in range(0, n_sensors, per_block):
+        block = names[first:first + per_block]
+        n = len(block)
+        # Timestamps jitter by up to a tenth of the interval around the schedule
+        jitter = rng.uniform(-0.1, 0.1, (n, readings_per_sensor)) * step
+        times = start.value + offsets[None, :] + jitter.astype(np.int64)
+        base = rng.uniform(2.0, 5.0, (n, 1))
+        phase = rng.uniform(0, 2 * np.pi, (n, 1))
+        daily = 0.2 * np.sin(2 * np.pi * (times % day) / day + phase)
+        drift = np.cumsum(rng.normal(0, 0.002, (n, readings_per_sensor)), axis=1)
+        noise = rng.normal(0, 0.02, (n, readings_per_sensor))
+        spikes = (rng.random((n, readings_per_sensor)) < SPIKE_RATE) * rng.choice([-1, 1], (n, readings_per_sensor)) \
+            * rng.uniform(1.0, 3.0, (n, readings_per_sensor))
+        pressure = np.maximum(base + daily + drift + noise + spikes, 0.0)
+        keep = ~np.vstack([_outage_mask(rng, readings_per_sensor) for _ in range(n)])
+
+        yield pd.DataFrame({
+            'timestamp': pd.to_datetime(times[keep], utc=True),
+            'sensorID': pd.Categorical(np.repeat(block, readings_per_sensor).reshape(n, -1)[keep], categories=block),
+            'pressure': pressure[keep].astype(np.float32),
+        })
+
+def frame_records(df):
+    """Convert a reading frame to reading dicts with aware datetimes and float pressures."""
+    timestamps = df['timestamp'].dt.to_pydatetime()
+    return [{'timestamp': timestamp, 'sensorID': sensor_id, 'pressure': float(pressure)}
+            for timestamp, sensor_id, pressure in zip(timestamps, df['sensorID'].astype(str), df['pressure'])]
+
+def populate_readings(store, n_sensors, readings_per_sensor, seed=0, progress=None):
+    """Write synthetic readings to a reading store; return how many were written."""
+    written = 0
+    for df in iter_reading_frames(n_sensors, readings_per_sensor, seed=seed):
+        for first in range(0, len(df), WRITE_BATCH):
+            store.add_readings(frame_records(df.iloc[first:first + WRITE_BATCH]))
+        written += len(df)
+        if progress:
+            progress(written)
+    return written
+
+def synthetic_users(n_users, password_hash, seed=0):
+    """Return n synthetic users (username -> data) that all share one password hash."""
+    rng = np.random.default_rng(seed)
+    admins = rng.random(n_users) < 0.05
+    width = len(str(n_users))
+    return {
+        f"user{i:0{width}d}": {
+            'name': f"Operator {i}",
+            'email': f"user{i:0{width}d}@example.com",
+            'password': password_hash,
+            'is_admin': bool(admins[i]),
+            'disabled': False,
+        }
+        for i in range(n_users)
+    }
+
+def populate_users(user_store, n_users, password_hash, seed=0):
+    """Write synthetic users to a user store; return {username: error} for failures."""
+    users = synthetic_users(n_users, password_hash, seed)
+    return user_store.write_many([('set', username, data) for username, data in users.items()])
+
+if __name__ == "__main__":
+    from storage import get_reading_store
+
+    parser = argparse.ArgumentParser(description="Write synthetic readings to the configured reading store.")
+    parser.add_argument('--collection', default='iot_gateway_reading')
+    parser.add_argument('--sensors', type=int, default=100)
+    parser.add_argument('--readings', type=int, default=10_000, help="readings per sensor, before outages")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    total = populate_readings(get_reading_store(args.collection), args.sensors, args.readings, seed=args.seed,
+                              progress=lambda written: print(f"{written:,} readings written"))
+    print(f"{args.collection}: {total:,} synthetic readings")
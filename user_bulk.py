@@ -0,0 +1,163 @@
+# user_bulk.py
+"""Bulk import, export and admin operations on users.
+
+Imports take CSV or JSON with the columns of USER_FIELDS plus `password`;
+in CSV, `sites` lists site IDs separated by semicolons.
+Passwords are hashed in parallel on a process pool, users are written
+through UserStore.write_many (500 per Firestore batch), and every row that
+could not be imported is reported with its reason. A row with a password
+creates or replaces the user; a row without one updates an existing
+user's other fields.
+"""
+import streamlit as st
+import csv
+import io
+import json
+import multiprocessing
+import os
+import bcrypt
+from concurrent.futures import ProcessPoolExecutor
+from storage import get_user_store
+from login import bcrypt_rounds
+from sites import get_sites
+
+USER_FIELDS = ['username', 'name', 'email', 'is_admin', 'disabled', 'sites']
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+FALSE_VALUES = {'', '0', 'false', 'no', 'n'}
+# Passwords sent to a hashing process at a time
+HASH_CHUNK = 8
+
+def _hash_password(password, rounds):
+    """Hash one password; runs in a worker process."""
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+@st.cache_resource
+def get_hash_pool():
+    """Get the process pool used for bulk password hashing."""
+    # Spawned, not forked: the app process runs many threads
+    return ProcessPoolExecutor(max_workers=os.cpu_count() or 2, mp_context=multiprocessing.get_context('spawn'))
+
+def hash_passwords(passwords, rounds=None):
+    """Hash many passwords in parallel, in order."""
+    if not passwords:
+        return []
+    rounds = rounds or bcrypt_rounds()
+    return list(get_hash_pool().map(_hash_password, passwords, [rounds] * len(passwords), chunksize=HASH_CHUNK))
+
+def _parse_bool(value):
+    """Parse a CSV/JSON flag; raise ValueError if it is not one."""
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f"not a yes/no value: {value!r}")
+
+def read_user_rows(data, file_name):
+    """Parse an uploaded CSV or JSON file into a list of row dicts."""
+    text = data.decode('utf-8-sig')
+    if file_name.lower().endswith('.json'):
+        rows = json.loads(text)
+        if not isinstance(rows, list):
+            raise ValueError("JSON user file must be a list of objects")
+        return rows
+    return list(csv.DictReader(io.StringIO(text)))
+
+def validate_user_row(row):
+    """Return (username, fields, password, None) for a valid row, or (username, None, None, error)."""
+    if not isinstance(row, dict):
+        return None, None, None, "row must be an object"
+    username = str(row.get('username') or '').strip()
+    if not username:
+        return username, None, None, "username is required"
+    if '/' in username:
+        return username, None, None, "username cannot contain '/'"
+    fields = {}
+    for key in ('name', 'email'):
+        value = str(row.get(key) or '').strip()
+        if value:
+            fields[key] = value
+    for key in ('is_admin', 'disabled'):
+        if key in row and row[key] is not None and str(row[key]).strip() != '':
+            try:
+                fields[key] = _parse_bool(row[key])
+            except ValueError as error:
+                return username, None, None, f"{key}: {error}"
+    sites = row.get('sites')
+    if isinstance(sites, str):
+        sites = [site_id.strip() for site_id in sites.split(';') if site_id.strip()]
+    if sites and not isinstance(sites, list):
+        return username, None, None, "sites must be a list of site IDs"
+    if sites:
+        unknown = sorted(set(map(str, sites)) - set(get_sites()))
+        if unknown:
+            return username, None, None, f"sites: unknown site {', '.join(unknown)}"
+        fields['sites'] = list(sites)
+    password = str(row.get('password') or '')
+    return username, fields, password, None
+
+def import_users(rows, rounds=None):
+    """Create or update users from rows; return (imported count, [(row number, username, error)]).
+
+    Row numbers count from 1, like the lines of a CSV after its header.
+    """
+    errors = []
+    new_users, updates, seen = [], [], set()
+    for number, row in enumerate(rows, start=1):
+        username, fields, password, error = validate_user_row(row)
+        if error is None and username in seen:
+            error = "duplicate username in file"
+        if error:
+            errors.append((number, username, error))
+            continue
+        seen.add(username)
+        if password:
+            new_users.append((number, username, fields, password))
+        elif fields:
+            updates.append((number, username, fields))
+        else:
+            errors.append((number, username, "password is required for new users"))
+
+    hashes = hash_passwords([password for _, _, _, password in new_users], rounds)
+    operations = [('set', username, dict({'name': '', 'email': '', 'is_admin': False, 'disabled': False},
+                                         **fields, password=password_hash))
+                  for (_, username, fields, _), password_hash in zip(new_users, hashes)]
+    operations += [('update', username, fields) for _, username, fields in updates]
+    failed = get_user_store().write_many(operations)
+
+    numbers = {username: number for number, username, *_ in new_users + updates}
+    errors += [(numbers[username], username, error) for username, error in failed.items()]
+    errors.sort(key=lambda item: item[0])
+    return len(operations) - len(failed), errors
+
+def iter_all_users(page_size=500):
+    """Yield every user, without password hashes, one directory page at a time."""
+    store = get_user_store()
+    cursor = None
+    while True:
+        users, cursor = store.page(after=cursor, limit=page_size)
+        for user in users:
+            yield {field: user.get(field) for field in USER_FIELDS}
+        if cursor is None:
+            return
+
+def export_users(fmt='csv'):
+    """Export all users (without passwords) as CSV or JSON bytes."""
+    users = iter_all_users()
+    if fmt == 'json':
+        return json.dumps(list(users), indent=2).encode('utf-8')
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=USER_FIELDS)
+    writer.writeheader()
+    writer.writerows(dict(user, sites=';'.join(user['sites'] or [])) for user in users)
+    return buffer.getvalue().encode('utf-8')
+
+def set_users_disabled(usernames, disabled):
+    """Enable or disable many users; return {username: error} for failures."""
+    return get_user_store().write_many([('update', username, {'disabled': disabled}) for username in usernames])
+
+def delete_users(usernames):
+    """Delete many users; return {username: error} for failures."""
+    return get_user_store().write_many([('delete', username, None) for username in usernames])